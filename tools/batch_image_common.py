@@ -0,0 +1,1167 @@
+from PIL import Image, ImageColor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from io import BytesIO
+import fnmatch
+import functools
+import json
+import math
+import os
+import sys
+import time
+
+from batch_image_instrumentation import StageTimer, build_instrumentation
+from batch_image_manifest import MANIFEST_FILENAME, BatchManifest
+
+# 扩充填充模式/Expansion fill modes
+FILL_MODES = ('color', 'edge', 'blur')
+
+# 裁剪锚点模式/Crop anchor modes
+ANCHOR_MODES = ('center', 'energy')
+
+# 编码配置：配置名称 -> PIL格式 -> save参数，None表示使用Pillow默认设置/Encode profiles: profile name -> PIL format -> save options, None means Pillow defaults
+ENCODE_PROFILES = {
+    # 编码最快，文件较大/Fastest encoding, larger files
+    'fast': {
+        'JPEG': {'quality': 85},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'quality': 80, 'method': 0},
+    },
+    # 编码时间与文件大小的折中/Trade-off between encode time and file size
+    'balanced': {
+        'JPEG': {'quality': 85, 'optimize': True},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 80, 'method': 4},
+        'TIFF': {'compression': 'tiff_lzw'},
+    },
+    # 文件最小，编码最慢/Smallest files, slowest encoding
+    'smallest': {
+        'JPEG': {'quality': 80, 'optimize': True, 'progressive': True},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'quality': 75, 'method': 6},
+        'TIFF': {'compression': 'tiff_adobe_deflate'},
+    },
+    # 无损或近无损/Lossless or near-lossless
+    'lossless': {
+        'JPEG': {'quality': 95, 'subsampling': 0, 'optimize': True},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'lossless': True, 'quality': 100, 'method': 6},
+        'TIFF': {'compression': 'tiff_adobe_deflate'},
+    },
+}
+
+# 支持按质量搜索目标文件大小的格式/Formats that support searching quality for a target file size
+QUALITY_FORMATS = ('JPEG', 'WEBP')
+
+# 响应式尺寸阶梯清单文件名，保存在输出文件夹中/Responsive size ladder manifest filename, stored in the output folder
+SRCSET_MANIFEST_FILENAME = 'srcset.json'
+
+# 流水线模式下读取和写入线程数/Number of reader and writer threads in pipelined mode
+IO_THREADS = 4
+
+# EXIF方向标签及各方向值对应的转置操作，与 ImageOps.exif_transpose 相同/EXIF orientation tag and the transpose for each orientation value, same as ImageOps.exif_transpose
+ORIENTATION_TAG = 0x0112
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# 支持的扩展名与PIL格式名称，这些文件不经文件头识别直接处理，无法读取时计为失败/Supported extensions and PIL format names, such files are processed without header sniffing and count as failures when unreadable
+SUPPORTED_FORMATS = {
+    '.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.bmp': 'BMP', '.tif': 'TIFF', '.tiff': 'TIFF', '.webp': 'WEBP',
+}
+
+# 各格式的默认输出扩展名/Default output extension of each format
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'BMP': '.bmp', 'TIFF': '.tiff', 'WEBP': '.webp'}
+
+# 文件头魔数与PIL格式名称/File header magic bytes and PIL format names
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+)
+
+
+def sniff_image_format(path):
+    """
+    根据文件头魔数识别图片格式，不依赖扩展名
+    Identify the image format from the file header magic bytes, independent of the extension
+
+    返回
+    Returns
+        - PIL格式名称，不是支持的图片格式时返回None / PIL format name, None if it is not a supported image format
+    """
+    try:
+        with open(path, 'rb') as image_file:
+            header = image_file.read(12)
+    except OSError:
+        return None
+    # WebP为RIFF容器，需要同时检查第8-12字节/WebP is a RIFF container, bytes 8-12 must be checked as well
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def iter_image_files(input_folder, recursive=False, include=None, exclude=None, skip_folders=()):
+    """
+    流式遍历图片文件
+    Streaming Image File Walker
+
+    功能说明
+    Function Description
+        - 基于 os.scandir 的生成器，每读完一个目录就开始产出文件，无需等待完整列表
+        - Generator built on os.scandir, files are yielded as soon as each directory has been read instead of after a complete listing
+        - 产出相对于输入目录的路径，可用于在输出目录中镜像子目录结构
+        - Yields paths relative to the input directory, which can be used to mirror the subdirectory structure in the output directory
+        - 每个目录内按名称排序，先产出文件再深度优先进入子目录，顺序是确定的
+        - Entries are sorted by name within each directory, files come before a depth-first descent into subdirectories, so the order is deterministic
+        - 扩展名在 SUPPORTED_FORMATS 中的文件全部产出，损坏或截断的文件由处理阶段报告为失败，不会被悄悄跳过
+        - Every file whose extension is in SUPPORTED_FORMATS is yielded, so corrupt or truncated files are reported as failures by the processing stage rather than silently skipped
+        - 其他扩展名或没有扩展名的文件按文件头魔数识别，扩展名错误或缺失的图片也能被处理
+        - Files with another extension or none are identified by header magic bytes, so images with a wrong or missing extension are processed too
+        - 不进入符号链接目录和 skip_folders 中的目录（如位于输入目录内的输出目录）
+        - Does not descend into symlinked directories or directories in skip_folders (such as an output directory inside the input directory)
+
+    参数
+    Parameters
+        - input_folder: 输入图片目录 / Input image directory
+        - recursive: 是否递归子目录，默认为False / Whether to recurse into subdirectories, default is False
+        - include: 包含的glob模式（字符串或列表），匹配文件名或相对路径，默认为None表示全部 / Include glob patterns (string or list) matched against the filename or relative path, default is None meaning all
+        - exclude: 排除的glob模式（字符串或列表），匹配文件名或相对路径 / Exclude glob patterns (string or list) matched against the filename or relative path
+        - skip_folders: 不进入的目录路径 / Directory paths not to descend into
+    """
+    include = [include] if isinstance(include, str) else include
+    exclude = [exclude] if isinstance(exclude, str) else (exclude or [])
+    skip_folders = {os.path.abspath(folder) for folder in skip_folders}
+
+    pending_directories = ['']
+    while pending_directories:
+        relative_directory = pending_directories.pop()
+        with os.scandir(os.path.join(input_folder, relative_directory)) as directory_entries:
+            entries = sorted(directory_entries, key=lambda entry: entry.name)
+
+        subdirectories = []
+        for entry in entries:
+            relative_path = os.path.join(relative_directory, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and os.path.abspath(entry.path) not in skip_folders:
+                    subdirectories.append(relative_path)
+            elif (entry.is_file()
+                  and _matches_patterns(entry.name, relative_path, include, exclude)
+                  and (os.path.splitext(entry.name)[1].lower() in SUPPORTED_FORMATS or sniff_image_format(entry.path) is not None)):
+                yield relative_path
+        # 逆序入栈以保持名称顺序/Push in reverse to keep name order
+        pending_directories.extend(reversed(subdirectories))
+
+
+def _matches_patterns(name, relative_path, include, exclude):
+    # 模式可匹配文件名或以/分隔的相对路径/Patterns may match the filename or the /-separated relative path
+    candidates = (name, relative_path.replace(os.sep, '/'))
+    if include is not None and not any(fnmatch.fnmatch(candidate, pattern) for pattern in include for candidate in candidates):
+        return False
+    return not any(fnmatch.fnmatch(candidate, pattern) for pattern in exclude for candidate in candidates)
+
+
+def resolve_output_format(output_format, source_format, original_ext):
+    """
+    解析输出扩展名与PIL格式名称
+    Resolve the output extension and PIL format name
+
+    参数
+    Parameters
+        - output_format: 用户指定的输出格式，None表示保持原格式 / User-specified output format, None keeps the original format
+        - source_format: 源图片的PIL格式名称 / PIL format name of the source image
+        - original_ext: 源文件扩展名，与源格式不符时改用 FORMAT_EXTENSIONS 中的扩展名 / Extension of the source file, replaced by the one from FORMAT_EXTENSIONS when it does not match the source format
+
+    返回
+    Returns
+        - (输出扩展名, PIL格式名称) / (output extension, PIL format name)
+    """
+    # 如果未指定输出格式，则保持原格式/If output format is not specified, keep the original format
+    if output_format is None:
+        # 扩展名错误或缺失（按文件头识别的图片）时改用实际格式的扩展名/Use the extension of the actual format when the extension is wrong or missing (images identified by their header)
+        if SUPPORTED_FORMATS.get(original_ext.lower()) != source_format and source_format in FORMAT_EXTENSIONS:
+            return FORMAT_EXTENSIONS[source_format], source_format
+        return original_ext, source_format
+
+    # 确保格式名称与PIL兼容/Ensure format name is compatible with PIL
+    if output_format.lower() == 'jpg':
+        return f".{output_format.lower()}", 'JPEG'
+    return f".{output_format.lower()}", output_format.upper()
+
+
+def center_crop_box(size, crop_aspect_ratio):
+    """
+    计算按固定宽高比从中心裁剪的裁剪框
+    Calculate the crop box for a centered crop at a fixed aspect ratio
+
+    参数
+    Parameters
+        - size: 图片尺寸 (宽, 高) / Image size (width, height)
+        - crop_aspect_ratio: 裁剪宽高比，None表示保持原比例（不裁剪） / Crop aspect ratio, None keeps the original ratio (no crop)
+
+    返回
+    Returns
+        - 裁剪框 (左, 上, 右, 下) / Crop box (left, top, right, bottom)
+    """
+    width, height = size
+    if crop_aspect_ratio is None:
+        return (0, 0, width, height)
+
+    # 确定裁剪方向/Determine crop direction
+    if width / height > crop_aspect_ratio:
+        # 图片过宽，裁剪左右/Crop left and right for overly wide images
+        new_width = int(height * crop_aspect_ratio)
+        left = (width - new_width) // 2
+        return (left, 0, left + new_width, height)
+    # 图片过高，裁剪上下/Crop top and bottom for overly tall images
+    new_height = int(width / crop_aspect_ratio)
+    top = (height - new_height) // 2
+    return (0, top, width, top + new_height)
+
+
+def expand_layout(size, target_aspect_ratio):
+    """
+    计算按固定宽高比向外扩充后的画布尺寸和原图放置位置
+    Calculate the canvas size and placement of the original when expanding outward to a fixed aspect ratio
+
+    参数
+    Parameters
+        - size: 图片尺寸 (宽, 高) / Image size (width, height)
+        - target_aspect_ratio: 目标宽高比 / Target aspect ratio
+
+    返回
+    Returns
+        - (画布宽, 画布高, 放置x, 放置y) / (canvas width, canvas height, paste x, paste y)
+    """
+    width, height = size
+
+    # 确定扩充后的尺寸/Determine expanded dimensions
+    if width / height > target_aspect_ratio:
+        # 原图更宽，扩充高度/Original image is wider, expand height
+        new_height = int(width / target_aspect_ratio)
+        return width, new_height, 0, (new_height - height) // 2
+    # 原图更高，扩充宽度/Original image is taller, expand width
+    new_width = int(height * target_aspect_ratio)
+    return new_width, height, (new_width - width) // 2, 0
+
+
+def resolve_color(color):
+    """
+    将颜色解析为RGBA元组，批处理开始前解析一次即可
+    Resolve a color to an RGBA tuple, it only needs to be resolved once before a batch starts
+
+    参数
+    Parameters
+        - color: 英文颜色名称、十六进制字符串、RGB/RGBA元组或灰度整数 / English color name, hexadecimal string, RGB/RGBA tuple or grayscale integer
+    """
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    elif isinstance(color, int):
+        color = (color, color, color)
+    color = tuple(color)
+    return color + (255,) if len(color) == 3 else color
+
+
+def canvas_mode(source_mode):
+    """
+    根据源图片模式选择画布模式
+    Choose the canvas mode according to the source image mode
+    """
+    # 对于带透明度的图片使用RGBA模式，否则使用RGB模式/Use RGBA mode for images with transparency, otherwise RGB mode
+    return 'RGBA' if source_mode in ('RGBA', 'LA') else 'RGB'
+
+
+def new_canvas(source_mode, size, background_color):
+    """
+    按源图片模式创建填充背景色的画布
+    Create a canvas filled with the background color according to the source image mode
+    """
+    # 判断图片模式以支持透明度/Determine image mode to support transparency
+    mode = canvas_mode(source_mode)
+    rgba_color = resolve_color(background_color)
+    return Image.new(mode, size, rgba_color if mode == 'RGBA' else rgba_color[:3])
+
+
+def prepare_for_format(image, final_output_format):
+    """
+    转换图像模式以支持目标格式
+    Convert the image mode to support the target format
+    """
+    if final_output_format == "JPEG":
+        # JPEG不支持透明度，需要转换为RGB模式/JPEG doesn't support transparency, need to convert to RGB mode
+        if image.mode in ('RGBA', 'LA', 'P'):
+            return image.convert('RGB')
+    return image
+
+
+def encode_image(image, image_format, encode_profile=None, target_file_size=None):
+    """
+    在内存中编码图片并返回字节，编码与写盘分开计时
+    Encode the image in memory and return the bytes, so encoding and disk writes are timed separately
+
+    参数
+    Parameters
+        - image_format: PIL格式名称 / PIL format name
+        - encode_profile: ENCODE_PROFILES 中的配置名称，默认为None表示Pillow默认设置 / Profile name from ENCODE_PROFILES, default is None meaning Pillow defaults
+        - target_file_size: 目标文件大小（字节），默认为None / Target file size (bytes), default is None
+            JPEG和WebP在内存中二分搜索不超过目标大小的最高质量，即使最低质量也超过时使用最低质量；其他格式忽略此参数
+            JPEG and WebP binary-search in memory for the highest quality that fits the target size, falling back to the lowest quality when even that is too large; other formats ignore it
+    """
+    options = dict(ENCODE_PROFILES[encode_profile].get(image_format, {})) if encode_profile else {}
+    if target_file_size is None or image_format not in QUALITY_FORMATS:
+        return _encode(image, image_format, options)
+
+    # 有损模式下按质量二分搜索/Binary-search the quality in lossy mode
+    options.pop('lossless', None)
+    low, high = 1, 95
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(image, image_format, dict(options, quality=quality))
+        if len(data) <= target_file_size:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+    # 全部超过目标时最后一次尝试的即为最低质量/When everything exceeds the target, the last attempt is the lowest quality
+    return best if best is not None else data
+
+
+def _encode(image, image_format, options):
+    # 按给定参数编码到内存/Encode into memory with the given options
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def check_encode_options(encode_profile, target_file_size):
+    """
+    检查编码配置和目标文件大小
+    Check the encode profile and target file size
+    """
+    if encode_profile is not None and encode_profile not in ENCODE_PROFILES:
+        raise ValueError(f"不支持的编码配置/Unsupported encode profile: {encode_profile}")
+    if target_file_size is not None and target_file_size <= 0:
+        raise ValueError(f"目标文件大小必须大于0/Target file size must be greater than 0: {target_file_size}")
+
+
+def check_srcset_options(srcset_widths, srcset_formats, memory_budget=None):
+    """
+    检查响应式尺寸阶梯的宽度和格式
+    Check the widths and formats of the responsive size ladder
+    """
+    if srcset_widths is None:
+        return
+    if not srcset_widths or any(int(width) <= 0 for width in srcset_widths):
+        raise ValueError(f"尺寸阶梯的宽度必须大于0/Size ladder widths must be greater than 0: {srcset_widths}")
+    if not srcset_formats:
+        raise ValueError("尺寸阶梯至少需要一种格式/The size ladder needs at least one format")
+    if memory_budget is not None:
+        # 尺寸阶梯需要完整解码，与按行带流式处理冲突/The size ladder needs a full decode, which conflicts with streaming in bands
+        raise ValueError("尺寸阶梯不能与内存预算同时使用/The size ladder cannot be combined with a memory budget")
+
+
+def encode_srcset(image, name_prefix, srcset_widths, srcset_formats, encode_profile=None, target_file_size=None, timer=None):
+    """
+    从一次解码的图片生成响应式尺寸阶梯
+    Build a responsive size ladder from a single decoded image
+
+    功能说明
+    Function Description
+        - 宽度从大到小排列，每一级都从上一级用Lanczos缩小，而不是每次从原图缩小
+        - Widths are processed from largest to smallest and each step is downscaled from the previous one with Lanczos rather than from the original every time
+        - 超过图片宽度的宽度按图片宽度输出（不会放大），重复的宽度只输出一次
+        - Widths above the image width are output at the image width (never upscaled), repeated widths are output once
+        - 每一级编码为所有格式，文件名为 前缀_{宽度}_{高度}.扩展名
+        - Every step is encoded in every format, named prefix_{width}_{height}.extension
+
+    参数
+    Parameters
+        - image: 已解码并处理好的图片 / Decoded and processed image
+        - name_prefix: 输出文件名前缀，如 'photo_crop' / Output filename prefix, e.g. 'photo_crop'
+        - srcset_widths: 宽度列表 / List of widths
+        - srcset_formats: 输出格式列表，如 ('webp', 'jpeg') / List of output formats, e.g. ('webp', 'jpeg')
+        - encode_profile, target_file_size: 同 encode_image，应用于每个文件 / Same as encode_image, applied to every file
+        - timer: 可选的 StageTimer，缩小计入 'transform'，编码计入 'encode' / Optional StageTimer, downscaling counts as 'transform' and encoding as 'encode'
+
+    返回
+    Returns
+        - [(输出文件名, 编码数据, 尺寸, PIL格式名称)]，按宽度从大到小 / [(output filename, encoded data, size, PIL format name)], largest width first
+    """
+    timer = timer if timer is not None else StageTimer()
+    derivatives = []
+    step = image
+    for output_filename, size, image_format in srcset_names(image.size, name_prefix, srcset_widths, srcset_formats):
+        if step.size != size:
+            with timer.stage('transform'):
+                step = step.resize(size, Image.Resampling.LANCZOS)
+        with timer.stage('encode'):
+            data = encode_image(prepare_for_format(step, image_format), image_format, encode_profile, target_file_size)
+        derivatives.append((output_filename, data, size, image_format))
+    return derivatives
+
+
+def srcset_names(size, name_prefix, srcset_widths, srcset_formats):
+    """
+    尺寸阶梯各文件的文件名、尺寸和格式，按宽度从大到小，不需要像素
+    Filename, size and format of every size ladder file, largest width first, without needing pixels
+
+    返回
+    Returns
+        - [(输出文件名, 尺寸, PIL格式名称)] / [(output filename, size, PIL format name)]
+    """
+    width, height = size
+    formats = [resolve_output_format(image_format, None, None) for image_format in srcset_formats]
+    names = []
+    for step_width in sorted({min(int(step_width), width) for step_width in srcset_widths}, reverse=True):
+        step_height = max(1, round(height * step_width / width))
+        for output_ext, image_format in formats:
+            names.append((f"{name_prefix}_{step_width}_{step_height}{output_ext}", (step_width, step_height), image_format))
+    return names
+
+
+def write_output(output_path, data):
+    """
+    将编码后的字节写入输出文件
+    Write the encoded bytes to the output file
+
+    data 也可以是可调用对象 data(output_file)，由它自行流式写入（见 batch_image_tiles）
+    data may also be a callable data(output_file) that streams itself into the file (see batch_image_tiles)
+
+    先写入同一目录下的临时文件，写完后原子地重命名为输出文件，中断的运行不会留下写了一半的输出
+    The data goes to a temporary file in the same directory first and is atomically renamed onto the output when complete, so an interrupted run never leaves a half-written output
+    """
+    temporary_path = partial_path(output_path)
+    try:
+        with open(temporary_path, 'wb') as output_file:
+            if callable(data):
+                data(output_file)
+            else:
+                output_file.write(data)
+        os.replace(temporary_path, output_path)
+    except BaseException:
+        # 失败或中断时删除临时文件/Remove the temporary file on failure or interruption
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def partial_path(output_path):
+    """
+    输出文件写入期间使用的临时文件路径：同一目录下的隐藏文件，重命名不会跨文件系统
+    Temporary path used while an output file is being written: a hidden file in the same directory, so the rename never crosses file systems
+
+    进程被强制结束时残留的临时文件会在同一输出重新写入时被覆盖
+    A temporary file left behind by a killed process is overwritten when the same output is written again
+    """
+    folder, filename = os.path.split(output_path)
+    return os.path.join(folder, f".{filename}.part")
+
+
+def fit_size(size, max_output_size):
+    """
+    将尺寸等比缩小到不超过最大输出尺寸（不会放大）
+    Scale a size down proportionally so it fits within the maximum output size (never enlarges)
+
+    参数
+    Parameters
+        - size: 原始尺寸 (宽, 高) / Original size (width, height)
+        - max_output_size: 最大输出尺寸 (宽, 高)，None表示不限制 / Maximum output size (width, height), None means no limit
+    """
+    width, height = size
+    if max_output_size is None or (width <= max_output_size[0] and height <= max_output_size[1]):
+        return size
+    scale = min(max_output_size[0] / width, max_output_size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def load_region(img, box, output_size):
+    """
+    以尽量低的解码成本读取图片区域并缩放到输出尺寸
+    Read an image region at the lowest possible decoding cost and resample it to the output size
+
+    功能说明
+    Function Description
+        - JPEG：在解码前启用draft模式，让解码器直接以1/2、1/4或1/8分辨率进行DCT缩放解码
+        - JPEG: Enable draft mode before decoding so the decoder performs DCT scaling at 1/2, 1/4 or 1/8 resolution
+        - 其他格式：直接从区域重采样到输出尺寸，不生成全分辨率的中间裁剪
+        - Other formats: Resample straight from the region to the output size without a full-resolution intermediate crop
+        - 输出尺寸与区域尺寸相同时等同于普通裁剪
+        - Equivalent to a plain crop when the output size equals the region size
+
+    参数
+    Parameters
+        - img: 尚未加载像素的图片对象 / Image object whose pixels are not loaded yet
+        - box: 原始分辨率下的区域 (左, 上, 右, 下) / Region at native resolution (left, top, right, bottom)
+        - output_size: 输出尺寸 (宽, 高) / Output size (width, height)
+    """
+    left, top, right, bottom = box
+    if (right - left, bottom - top) == tuple(output_size):
+        return img.crop(box)
+
+    # 按缩放比例请求降分辨率解码/Request reduced-resolution decoding according to the scale
+    if img.format == 'JPEG':
+        width, height = img.size
+        scale = output_size[0] / (right - left)
+        img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+        # 将区域换算到降分辨率后的坐标/Map the region onto the reduced-resolution coordinates
+        scale_x, scale_y = img.size[0] / width, img.size[1] / height
+        box = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+
+    return img.resize(tuple(output_size), Image.Resampling.LANCZOS, box=box)
+
+
+def open_image(source, memory_budget=None):
+    """
+    打开图片（只读取文件头），source 可以是路径或预读的文件对象
+    Open an image (reads only the header), source may be a path or a prefetched file object
+
+    返回
+    Returns
+        - (图片对象, 是否按行带流式处理, 解码缩放倍数) / (image object, whether it is streamed in bands, decode scale)
+            解码后超过预算的未压缩图片按行带流式处理，只有这些图片跳过Pillow的解压炸弹检查
+            Uncompressed images whose decoded size exceeds the budget are streamed in bands, and only those skip Pillow's decompression-bomb check
+            超过预算的JPEG按1/2、1/4或1/8的DCT缩放解码，取能放入预算的最大尺寸，缩放倍数为2、4或8并打印警告；其他情况为1
+            A JPEG over the budget is decoded with 1/2, 1/4 or 1/8 DCT scaling, the largest size that fits the budget, with a decode scale of 2, 4 or 8 and a printed warning; 1 otherwise
+            其他压缩格式无法分块读取，打印警告后完整解码
+            Other compressed formats cannot be read in bands and are decoded in full after a printed warning
+    """
+    if memory_budget is None:
+        return Image.open(source), False, 1
+    # 分块模式按需导入，避免循环导入和NumPy的启动开销/Import tiled mode on demand, avoiding a circular import and the NumPy startup cost
+    from batch_image_tiles import RAW_BYTES_PER_PIXEL, decoded_size, open_unguarded, raw_strips
+    # 设置预算时不预读，source 总是路径/No prefetching with a budget, so source is always a path
+    try:
+        img = Image.open(source)
+    except Image.DecompressionBombError:
+        # 只有能按行带流式读取的未压缩图片才不受解压炸弹检查限制/Only uncompressed images that can be streamed in bands are exempt from the decompression-bomb check
+        img = open_unguarded(source)
+        if raw_strips(img) is None:
+            img.close()
+            raise
+    if decoded_size(img) <= memory_budget or raw_strips(img) is not None:
+        return img, decoded_size(img) > memory_budget, 1
+
+    if img.format == 'JPEG':
+        # 取解码后能放入预算的最小缩放倍数，1/8仍超出时使用1/8/Take the smallest scale whose decoded size fits the budget, falling back to 1/8 when even that does not fit
+        bytes_per_pixel = RAW_BYTES_PER_PIXEL.get(img.mode, 4)
+        scale = next((scale for scale in (2, 4, 8)
+                      if math.ceil(img.width / scale) * math.ceil(img.height / scale) * bytes_per_pixel <= memory_budget), 8)
+        full_size = img.size
+        img.draft(img.mode, (img.width // scale, img.height // scale))
+        still_over = decoded_size(img) > memory_budget
+        print(f"警告/Warning: {os.path.basename(source)} 超过内存预算，按1/{scale}解码/exceeds the memory budget, decoded at 1/{scale} "
+              f"({full_size[0]}x{full_size[1]} -> {img.width}x{img.height})"
+              + ("，仍超过预算/, still over the budget" if still_over else ""), file=sys.stderr)
+        return img, False, scale
+
+    print(f"警告/Warning: {os.path.basename(source)} 超过内存预算但不是未压缩格式，将完整解码/exceeds the memory budget but is not uncompressed, decoding it in full "
+          f"({img.format}, {img.width}x{img.height})", file=sys.stderr)
+    return img, False, 1
+
+
+def exif_orientation(img):
+    """
+    读取EXIF方向值（1~8），只解析文件头，不解码像素
+    Read the EXIF orientation value (1~8), parsing only the header without decoding pixels
+
+    PNG的eXIf块可能位于像素数据之后，读取它需要解码，因此文件头中没有EXIF的PNG视为方向1
+    A PNG eXIf chunk may follow the pixel data and reading it would need a decode, so a PNG without EXIF in its header counts as orientation 1
+    较新的Pillow在打开TIFF时已按方向校正尺寸并在加载时转置，此时返回1，避免重复转置
+    Newer Pillow versions already report the corrected size when opening a TIFF and transpose it on load, 1 is returned then so it is not transposed twice
+    """
+    if img.format == 'PNG' and 'exif' not in img.info:
+        return 1
+    if img.format == 'TIFF' and _pillow_orients_tiff():
+        return 1
+    orientation = img.getexif().get(ORIENTATION_TAG, 1)
+    return orientation if orientation in ORIENTATION_TRANSPOSES else 1
+
+
+@functools.lru_cache(maxsize=None)
+def _pillow_orients_tiff():
+    # 用一张2x1、方向为6的TIFF探测Pillow是否自行应用TIFF方向/Probe with a 2x1 TIFF of orientation 6 whether Pillow applies the TIFF orientation itself
+    buffer = BytesIO()
+    Image.new('L', (2, 1)).save(buffer, format='TIFF', tiffinfo={ORIENTATION_TAG: 6})
+    buffer.seek(0)
+    with Image.open(buffer) as probe:
+        return probe.size == (1, 2)
+
+
+def oriented_size(size, orientation):
+    """
+    按EXIF方向校正后的尺寸，方向5~8交换宽高
+    Size after correcting the EXIF orientation, orientations 5~8 swap width and height
+    """
+    return (size[1], size[0]) if orientation >= 5 else tuple(size)
+
+
+def apply_orientation(image, orientation):
+    """
+    按EXIF方向转置已解码的图片，方向1时原样返回
+    Transpose a decoded image according to the EXIF orientation, returned as-is for orientation 1
+    """
+    method = ORIENTATION_TRANSPOSES.get(orientation)
+    return image if method is None else image.transpose(method)
+
+
+def _transpose_point(method, x, y, width, height):
+    # 转置操作对宽高为 (width, height) 的图片中一点的映射/Where a transpose moves a point of an image of size (width, height)
+    return {
+        Image.Transpose.FLIP_LEFT_RIGHT: (width - x, y),
+        Image.Transpose.FLIP_TOP_BOTTOM: (x, height - y),
+        Image.Transpose.ROTATE_180: (width - x, height - y),
+        Image.Transpose.ROTATE_90: (y, width - x),
+        Image.Transpose.ROTATE_270: (height - y, x),
+        Image.Transpose.TRANSPOSE: (y, x),
+        Image.Transpose.TRANSVERSE: (height - y, width - x),
+    }[method]
+
+
+def load_oriented_region(img, orientation, box, output_size):
+    """
+    按方向校正后的坐标读取区域，与 load_region 一样以尽量低的成本解码
+    Read a region given in orientation-corrected coordinates, decoding as cheaply as load_region
+
+    功能说明
+    Function Description
+        - 将区域换算回文件中的原始坐标，用 load_region 读取（JPEG仍可降分辨率解码），再只转置这一块
+        - Map the region back to the stored coordinates, read it with load_region (JPEG can still decode at reduced resolution) and transpose only that region
+        - 方向1时等同于 load_region
+        - Equivalent to load_region for orientation 1
+
+    参数
+    Parameters
+        - img: 尚未加载像素的图片对象 / Image object whose pixels are not loaded yet
+        - orientation: exif_orientation 返回的方向值 / Orientation value returned by exif_orientation
+        - box: 方向校正后的区域 (左, 上, 右, 下) / Region (left, top, right, bottom) after orientation correction
+        - output_size: 方向校正后的输出尺寸 (宽, 高) / Output size (width, height) after orientation correction
+    """
+    method = ORIENTATION_TRANSPOSES.get(orientation)
+    if method is None:
+        return load_region(img, box, output_size)
+    # 逆转置：旋转90度与270度互逆，其余转置自逆/Inverse transpose: 90 and 270 degree rotations invert each other, the other transposes are their own inverse
+    inverse = {Image.Transpose.ROTATE_90: Image.Transpose.ROTATE_270, Image.Transpose.ROTATE_270: Image.Transpose.ROTATE_90}.get(method, method)
+    width, height = oriented_size(img.size, orientation)
+    corners = [_transpose_point(inverse, x, y, width, height) for x in (box[0], box[2]) for y in (box[1], box[3])]
+    source_box = (min(x for x, _ in corners), min(y for _, y in corners), max(x for x, _ in corners), max(y for _, y in corners))
+    return load_region(img, source_box, oriented_size(output_size, orientation)).transpose(method)
+
+
+def run_tasks(task_function, task_arguments, workers=1, max_in_flight=None):
+    """
+    有界并行任务执行器
+    Bounded Parallel Task Runner
+
+    功能说明
+    Function Description
+        - 按输入顺序依次产出 (参数, 结果, 异常) 三元组，结果顺序与进程调度无关
+        - Yield (arguments, result, error) triples in input order, independent of process scheduling
+        - workers 为 1 时在当前进程内顺序执行，不创建进程池
+        - Run serially in the current process when workers is 1, without creating a process pool
+        - 同时提交的任务数不超过 max_in_flight，输入可以是惰性生成器
+        - Keep at most max_in_flight tasks submitted at once, so the input can be a lazy generator
+        - 单个任务的异常被捕获并返回，不会中断整个批次
+        - Exceptions raised by a single task are captured and returned without aborting the batch
+
+    参数
+    Parameters
+        - task_function: 模块级函数（需可被pickle）/ Module-level function (must be picklable)
+        - task_arguments: 参数元组的可迭代对象 / Iterable of argument tuples
+        - workers: 进程数，默认为1（顺序执行），None表示使用全部CPU核心 / Number of processes, default is 1 (serial), None means all CPU cores
+        - max_in_flight: 最大在途任务数，默认为进程数的两倍 / Maximum number of in-flight tasks, default is twice the number of processes
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # 顺序执行/Serial execution
+    if workers <= 1:
+        for arguments in task_arguments:
+            try:
+                yield arguments, task_function(*arguments), None
+            except Exception as e:
+                yield arguments, None, e
+        return
+
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for arguments in task_arguments:
+            in_flight.append((arguments, executor.submit(task_function, *arguments)))
+            # 达到上限时先取回最早提交的任务/Collect the oldest task first once the limit is reached
+            if len(in_flight) >= max_in_flight:
+                yield _collect(*in_flight.popleft())
+        while in_flight:
+            yield _collect(*in_flight.popleft())
+
+
+def _collect(arguments, future):
+    # 等待任务完成并返回结果或异常/Wait for the task and return its result or exception
+    error = future.exception()
+    if error is not None:
+        return arguments, None, error
+    return arguments, future.result(), None
+
+
+def run_pipelined(compute_function, tasks, workers=1, prefetch=8):
+    """
+    读取、计算、写入三段流水线执行器
+    Read, Compute, Write Pipelined Runner
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        在网络存储上读取和写入的延迟很高，顺序执行时CPU在等待磁盘期间空闲
+        Read and write latency is high on network storage, and the CPU sits idle while waiting for the disk when everything runs in sequence
+        将读取和写入放到后台线程，使I/O延迟与解码/编码重叠
+        Moving reads and writes to background threads lets the I/O latency overlap with decoding/encoding
+
+    功能说明
+    Function Description
+        - 读取阶段：读取线程预读原始文件字节，最多领先 prefetch 个文件
+        - Read stage: reader threads prefetch the raw file bytes, at most prefetch files ahead
+        - 计算阶段：通过 run_tasks 在当前进程或进程池中从内存解码、处理并编码
+        - Compute stage: decode from memory, process and encode in the current process or the process pool through run_tasks
+        - 写入阶段：写入线程将编码后的字节写入磁盘，最多积压 prefetch 个文件
+        - Write stage: writer threads flush the encoded bytes to disk, with at most prefetch files queued
+        - 每个阶段都有上限，内存占用与图库大小无关；按输入顺序产出 (任务, 结果, 异常)，文件写入完成后才产出
+        - Every stage is bounded, so memory use does not depend on the gallery size; (task, result, error) triples are yielded in input order, only after the file is written
+
+    参数
+    Parameters
+        - compute_function: 单文件计算函数，签名为 (源文件或文件对象, 文件名, *参数)，返回 (输出文件名, 编码数据, 输出尺寸, 源格式, 分阶段耗时, 解码缩放倍数) / Single-file compute function with signature (source path or file object, filename, *parameters), returning (output filename, encoded data, output size, source format, stage timings, decode scale)
+        - tasks: (输入路径, 输出目录, *参数) 元组的可迭代对象 / Iterable of (input path, output directory, *parameters) tuples
+        - workers: 计算阶段的进程数，与 run_tasks 相同 / Number of processes for the compute stage, same as run_tasks
+        - prefetch: 预读和待写文件数上限 / Maximum number of prefetched and pending-write files
+    """
+    with ThreadPoolExecutor(max_workers=min(prefetch, IO_THREADS)) as reader, ThreadPoolExecutor(max_workers=IO_THREADS) as writer:
+        # 已交给计算阶段、尚未取回结果的任务，与 run_tasks 的输出顺序一致/Tasks handed to the compute stage whose results are not collected yet, in run_tasks output order
+        computing = deque()
+
+        def compute_arguments():
+            reads = deque()
+            for task in tasks:
+                reads.append((task, reader.submit(_read_file, task[0])))
+                # 超过预读上限时等待最早的读取/Wait for the oldest read once the prefetch limit is exceeded
+                if len(reads) > prefetch:
+                    yield _compute_arguments(compute_function, computing, *reads.popleft())
+            while reads:
+                yield _compute_arguments(compute_function, computing, *reads.popleft())
+
+        writes = deque()
+        for _, result, error in run_tasks(_compute_bytes, compute_arguments(), workers):
+            task = computing.popleft()
+            if error is not None:
+                writes.append((task, None, error))
+            else:
+                writes.append((task, result, writer.submit(_write_file, task[1], result[0], result[1])))
+            # 超过待写上限时等待最早的写入/Wait for the oldest write once the pending-write limit is exceeded
+            if len(writes) > prefetch:
+                yield _finish_write(*writes.popleft())
+        while writes:
+            yield _finish_write(*writes.popleft())
+
+
+def _read_file(input_path):
+    # 读取整个源文件并返回字节和耗时，在读取线程中执行/Read the whole source file and return the bytes and elapsed time, runs in a reader thread
+    start = time.perf_counter()
+    with open(input_path, 'rb') as source_file:
+        data = source_file.read()
+    return data, time.perf_counter() - start
+
+
+def _compute_arguments(compute_function, computing, task, read_future):
+    # 等待读取完成并组装计算参数，读取失败时把异常交给计算阶段按顺序汇报/Wait for the read and build the compute arguments, a read failure is passed to the compute stage to be reported in order
+    computing.append(task)
+    error = read_future.exception()
+    source = error if error is not None else read_future.result()
+    return (compute_function, source, task[0]) + tuple(task[2:])
+
+
+class _SourceBuffer(BytesIO):
+    """
+    预读的源文件字节，带有源文件路径，错误信息中显示路径而不是缓冲区对象
+    Prefetched source bytes carrying the source path, so error messages show the path instead of the buffer object
+    """
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+    def __repr__(self):
+        return repr(self.name)
+
+
+def _compute_bytes(compute_function, source, input_path, *parameters):
+    # 从内存中的字节计算单个文件，在工作进程中执行/Compute a single file from bytes in memory, runs in a worker process
+    if isinstance(source, Exception):
+        raise source
+    data, read_seconds = source
+    output_filename, output_data, output_size, source_format, stage_seconds, decode_scale = compute_function(
+        _SourceBuffer(data, input_path), os.path.basename(input_path), *parameters)
+    stage_seconds['read'] = read_seconds
+    return output_filename, output_data, output_size, source_format, stage_seconds, decode_scale
+
+
+def _write_file(output_folder, output_filename, data):
+    # 写入编码后的字节并返回耗时，尺寸阶梯的数据为 encode_srcset 返回的列表/Write the encoded bytes and return the elapsed time, size ladder data is the list returned by encode_srcset
+    start = time.perf_counter()
+    os.makedirs(output_folder, exist_ok=True)
+    if isinstance(data, list):
+        for derivative_filename, derivative_data, _, _ in data:
+            write_output(os.path.join(output_folder, derivative_filename), derivative_data)
+    else:
+        write_output(os.path.join(output_folder, output_filename), data)
+    return time.perf_counter() - start
+
+
+def _derivative_records(data):
+    # 尺寸阶梯各文件的 (文件名, 尺寸, 格式, 字节数)，不是尺寸阶梯时为None/(filename, size, format, byte count) of every size ladder file, None when not a size ladder
+    if not isinstance(data, list):
+        return None
+    return [(derivative_filename, size, image_format, len(derivative_data)) for derivative_filename, derivative_data, size, image_format in data]
+
+
+def _finish_write(task, result, write):
+    # 等待写入完成并返回 (任务, 结果, 异常)，结果中不再保留编码数据/Wait for the write and return (task, result, error), the encoded data is dropped from the result
+    if result is None:
+        return task, None, write
+    error = write.exception()
+    if error is not None:
+        return task, None, error
+    output_filename, data, output_size, source_format, stage_seconds, decode_scale = result
+    stage_seconds['write'] = write.result()
+    return task, (output_filename, output_size, source_format, stage_seconds, _derivative_records(data), decode_scale), None
+
+
+def process_file(compute_function, input_path, output_folder, *parameters):
+    """
+    直接处理单个文件：从磁盘读取、计算并写入，在工作进程中执行
+    Process a single file directly: read from disk, compute and write, runs in a worker process
+
+    返回
+    Returns
+        - (输出文件名, 输出尺寸, 源格式, 分阶段耗时, 尺寸阶梯各文件或None, 解码缩放倍数) / (output filename, output size, source format, stage timings, size ladder files or None, decode scale)
+    """
+    output_filename, data, output_size, source_format, stage_seconds, decode_scale = compute_function(input_path, os.path.basename(input_path), *parameters)
+    stage_seconds['write'] = _write_file(output_folder, output_filename, data)
+    return output_filename, output_size, source_format, stage_seconds, _derivative_records(data), decode_scale
+
+
+def plan_folder(plan_function, task_parameters, input_folder, output_folder, workers=1,
+                recursive=False, include=None, exclude=None, plan_path=None, verbosity='files'):
+    """
+    只读取文件头和EXIF，生成批处理计划而不解码像素
+    Build a batch plan from headers and EXIF only, without decoding pixels
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        在昂贵的解码之前验证大批量任务：每个输出的尺寸、文件名和是否流式处理，每个文件只需几毫秒
+        Validate a huge batch before any expensive decode: the size, filename and streaming of every output, in milliseconds per file
+
+    功能说明
+    Function Description
+        - 与 process_folder 使用相同的文件遍历和输出目录结构，不创建输出目录也不写入任何输出
+        - Uses the same file walk and output layout as process_folder, creates no output directory and writes no output
+        - 无法读取文件头的文件作为失败汇报，与正式处理时一致
+        - Files whose header cannot be read are reported as failures, as in the real run
+        - plan_path 为None时逐文件打印计划，否则写入JSON
+        - The plan is printed per file when plan_path is None, otherwise it is written as JSON
+
+    参数
+    Parameters
+        - plan_function: 单文件规划函数，签名与计算函数相同，返回包含 'outputs' 列表的字典 / Single-file plan function with the same signature as the compute function, returning a dict with an 'outputs' list
+        - plan_path: 计划JSON路径，默认为None表示打印 / Plan JSON path, default is None meaning print
+        - verbosity: 为'files'时逐文件打印 / Print per file when 'files'
+        - 其余参数与 process_folder 相同 / Other parameters are the same as process_folder
+
+    返回
+    Returns
+        - 处理失败的文件列表，每项为 (相对路径, 错误信息) / List of failed files, each item is (relative path, error message)
+    """
+    relative_paths = iter_image_files(input_folder, recursive, include, exclude, skip_folders=(output_folder,))
+    tasks = ((os.path.join(input_folder, relative_path), relative_path) + tuple(task_parameters) for relative_path in relative_paths)
+
+    start_time = time.perf_counter()
+    entries = []
+    failures = []
+    for (_, _, relative_path, *_), entry, error in run_tasks(_plan_file, ((plan_function,) + task for task in tasks), workers):
+        if error is not None:
+            failures.append((relative_path, str(error)))
+            entry = {'source': relative_path.replace(os.sep, '/'), 'error': f"{type(error).__name__}: {error}"}
+        entries.append(entry)
+        if plan_path is None and verbosity == 'files':
+            if 'error' in entry:
+                print(f"计划失败/Plan failed: {entry['source']}: {entry['error']}")
+            else:
+                print(f"{entry['source']} ({entry['size'][0]}x{entry['size'][1]}) -> {', '.join(output['file'] for output in entry['outputs'])}")
+    elapsed = time.perf_counter() - start_time
+
+    if plan_path is not None:
+        with open(plan_path, 'w', encoding='utf-8') as plan_file:
+            json.dump({'input_folder': input_folder, 'output_folder': output_folder, 'files': entries}, plan_file, ensure_ascii=False, indent=2)
+    per_file = elapsed / len(entries) * 1000 if entries else 0.0
+    print(f"计划完成: {len(entries)} 个文件，失败 {len(failures)} 个，{per_file:.2f} 毫秒/文件")
+    print(f"Plan completed: {len(entries)} files, {len(failures)} failed, {per_file:.2f} ms/file")
+    return failures
+
+
+def _plan_file(plan_function, input_path, relative_path, *parameters):
+    # 规划单个文件并补上相对路径，在工作进程中执行/Plan a single file and fill in relative paths, runs in a worker process
+    entry = plan_function(input_path, os.path.basename(input_path), *parameters)
+    folder = os.path.dirname(relative_path)
+    for output in entry['outputs']:
+        output['file'] = os.path.join(folder, output['file']).replace(os.sep, '/')
+    return {'source': relative_path.replace(os.sep, '/'), **entry}
+
+
+def plan_outputs(name_prefix, size, output_ext, image_format, srcset_widths=None, srcset_formats=()):
+    """
+    规划一个源文件的输出：单个文件，或尺寸阶梯的所有文件
+    Plan the outputs of one source file: a single file, or every file of the size ladder
+
+    返回
+    Returns
+        - [{'file', 'width', 'height', 'format'}]
+    """
+    if srcset_widths is None:
+        names = [(f"{name_prefix}_{size[0]}_{size[1]}{output_ext}", tuple(size), image_format)]
+    else:
+        names = srcset_names(size, name_prefix, srcset_widths, srcset_formats)
+    return [{'file': output_filename, 'width': width, 'height': height, 'format': output_format}
+            for output_filename, (width, height), output_format in names]
+
+
+def _update_srcset_manifest(output_folder, srcsets, duplicate_links=None):
+    # 合并本次运行的尺寸阶梯到 srcset.json，去掉文件已不存在的条目/Merge this run's size ladders into srcset.json, dropping entries whose files no longer exist
+    # duplicate_links 为 {重复文件: (原图, {原图输出: 链接})}，重复文件沿用原图的条目并改为指向链接/duplicate_links is {duplicate: (original, {original output: link})}, a duplicate reuses the original's entry pointing at its links
+    path = os.path.join(output_folder, SRCSET_MANIFEST_FILENAME)
+    entries = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as srcset_file:
+            try:
+                entries = json.load(srcset_file)
+            except ValueError:
+                entries = {}
+    entries.update(srcsets)
+    for relative_path, (original, links) in (duplicate_links or {}).items():
+        if original in entries and all(item['file'] in links for item in entries[original]):
+            entries[relative_path] = [dict(item, file=links[item['file']]) for item in entries[original]]
+    entries = {
+        relative_path: files for relative_path, files in entries.items()
+        if all(os.path.exists(os.path.join(output_folder, item['file'])) for item in files)
+    }
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as srcset_file:
+        json.dump({relative_path: entries[relative_path] for relative_path in sorted(entries)}, srcset_file, ensure_ascii=False, indent=2)
+    os.replace(temporary_path, path)
+
+
+def _recorded_outputs(entry):
+    # 清单记录中成功处理的输出：尺寸阶梯的所有文件或单个输出，失败或没有记录时为空/Outputs of a successful manifest record: every size ladder file or the single output, empty when failed or not recorded
+    if 'output' in entry and entry.get('status') != 'failed':
+        return entry.get('derivatives') or [entry['output']]
+    return []
+
+
+def _count_image_files(input_folder, recursive, include, exclude, output_folder):
+    """
+    统计待处理的图片数，用于进度显示的总数
+    Count the images to process, used as the total of the progress display
+    """
+    return sum(1 for _ in iter_image_files(input_folder, recursive, include, exclude, skip_folders=(output_folder,)))
+
+
+def process_folder(compute_function, task_parameters, input_folder, output_folder, operation_parameters,
+                   workers=1, incremental=False, content_hash=False, prune_stale=False,
+                   recursive=False, include=None, exclude=None, verbosity='files', event_log=None, observers=(),
+                   prefetch=0, deduplicate=None, duplicate_distance=None, duplicate_action='skip', resume=False):
+    """
+    批量处理文件夹的通用流程
+    Common Folder Batch Processing Flow
+
+    功能说明
+    Function Description
+        - 流式遍历输入文件，可选跳过增量清单中未变化的文件
+        - Stream input files, optionally skipping files that are unchanged according to the incremental manifest
+        - 通过 run_tasks 顺序或并行调用单文件处理函数，并按输入顺序汇报结果
+        - Call the single-file function serially or in parallel through run_tasks and report results in input order
+        - prefetch 大于0时通过 run_pipelined 在后台线程中预读和写入，使I/O与计算重叠
+        - When prefetch is greater than 0, reads and writes run in background threads through run_pipelined so I/O overlaps with compute
+        - 可选预处理：用感知哈希和BK树找出重复图片，只处理第一张，其余跳过或链接到其输出；原图处理失败时改为处理其重复文件
+        - Optional pre-pass: find duplicate images with perceptual hashes and a BK-tree, process only the first one and skip the others or link them to its output; when the original fails its duplicates are processed instead
+        - 计算函数返回尺寸阶梯（encode_srcset 的列表）时写入所有文件，并将各文件的尺寸、格式和字节数合并到输出目录的 srcset.json
+        - When the compute function returns a size ladder (the list from encode_srcset), every file is written and their dimensions, formats and byte sizes are merged into srcset.json in the output directory
+        - 每个文件完成或失败后立即记入输出目录的作业日志（.batch_manifest.jsonl），失败记录包含错误类型
+        - Every file is recorded in the job journal (.batch_manifest.jsonl) in the output directory as soon as it is done or has failed, failure records include the error class
+        - resume 为True时从作业日志继续：跳过已完成且未变化的文件，只处理失败和尚未处理的文件
+        - When resume is True the run continues from the job journal: files that are done and unchanged are skipped, only failed and not yet processed files are processed
+        - 收集处理失败的文件，可选删除过期输出
+        - Collect failed files and optionally prune stale outputs
+        - 通过 BatchInstrumentation 汇报每个文件的分阶段耗时、进度和汇总，进度显示的总数在后台遍历完成后给出
+        - Report per-file stage timings, progress and summaries through BatchInstrumentation, the progress total is given once a background walk finishes
+
+    参数
+    Parameters
+        - compute_function: 单文件计算函数，签名为 (源文件或文件对象, 文件名, *task_parameters)，返回 (输出文件名, 编码数据, 输出尺寸, 源格式, 分阶段耗时, 解码缩放倍数)，不写入磁盘；尺寸阶梯的输出文件名和尺寸为最大一级 / Single-file compute function with signature (source path or file object, filename, *task_parameters), returning (output filename, encoded data, output size, source format, stage timings, decode scale) without writing to disk; for a size ladder the output filename and size are those of the largest step
+        - task_parameters: 传给单文件处理函数的附加参数元组 / Tuple of extra parameters passed to the single-file function
+        - operation_parameters: 写入增量清单的处理参数字典 / Dict of processing parameters written to the incremental manifest
+        - prefetch: 流水线预读文件数，默认为0表示不使用流水线 / Number of files prefetched by the pipeline, default is 0 meaning no pipeline
+        - deduplicate: 重复检测使用的哈希算法（'ahash'、'dhash'、'phash'），默认为None表示不检测 / Hash method for duplicate detection ('ahash', 'dhash', 'phash'), default is None meaning no detection
+        - duplicate_distance: 视为重复的最大汉明距离，默认为None表示按算法取默认值（ahash 2、dhash 6、phash 10），0表示哈希完全相同 / Maximum Hamming distance treated as a duplicate, default is None meaning the per-method default (ahash 2, dhash 6, phash 10), 0 means identical hashes
+        - duplicate_action: 'skip' 跳过重复文件，'symlink' 在输出目录中创建指向原图各输出（含尺寸阶梯）的符号链接，并加入 srcset.json / 'skip' skips duplicates, 'symlink' creates symbolic links to each of the original's outputs (including the size ladder) in the output directory and adds them to srcset.json
+        - resume: 是否从上次中断或失败的作业继续，输出目录中必须已有作业日志，默认为False / Whether to continue an interrupted or failed job, the output directory must already contain a job journal, default is False
+        - 其余参数与 fixed_ratio_expand / fixed_ratio_crop 相同 / Other parameters are the same as fixed_ratio_expand / fixed_ratio_crop
+
+    返回
+    Returns
+        - (处理失败的文件列表, 未变化跳过的文件数, 重复文件数) / (list of failed files, number of skipped unchanged files, number of duplicates)
+    """
+    if deduplicate is not None:
+        # 在这里导入以避免循环导入/Imported here to avoid a circular import
+        from batch_image_dedup import DUPLICATE_ACTIONS, HASH_METHODS
+        if deduplicate not in HASH_METHODS:
+            raise ValueError(f"不支持的哈希算法/Unsupported hash method: {deduplicate}")
+        if duplicate_action not in DUPLICATE_ACTIONS:
+            raise ValueError(f"不支持的重复处理方式/Unsupported duplicate action: {duplicate_action}")
+
+    if resume and not os.path.exists(os.path.join(output_folder, MANIFEST_FILENAME)):
+        raise ValueError(f"输出目录中没有可继续的作业日志/No job journal to resume in the output directory: {output_folder}")
+
+    # 先组装插桩以校验详细程度，此时尚未写入磁盘/Assemble the instrumentation first to validate the verbosity, nothing is written to disk yet
+    instrumentation = build_instrumentation(verbosity, event_log, observers)
+    try:
+        return _process_folder(compute_function, task_parameters, input_folder, output_folder, operation_parameters, instrumentation,
+                               workers, incremental, content_hash, prune_stale, recursive, include, exclude, verbosity,
+                               prefetch, deduplicate, duplicate_distance, duplicate_action, resume)
+    finally:
+        # 出错时也关闭事件日志/Close the event log on errors as well
+        instrumentation.close()
+
+
+def _process_folder(compute_function, task_parameters, input_folder, output_folder, operation_parameters, instrumentation,
+                    workers, incremental, content_hash, prune_stale, recursive, include, exclude, verbosity,
+                    prefetch, deduplicate, duplicate_distance, duplicate_action, resume):
+    if deduplicate is not None:
+        from batch_image_dedup import find_duplicates, link_duplicate
+
+    # 创建输出文件夹/Create output directory
+    os.makedirs(output_folder, exist_ok=True)
+
+    # 加载清单（作业日志），所有运行都记录完成和失败的文件/Load the manifest (job journal), every run records done and failed files
+    manifest = BatchManifest(output_folder, operation_parameters, content_hash)
+    skip_current = incremental or resume
+    if resume:
+        done_count = sum(entry.get('status') != 'failed' for entry in manifest.entries.values())
+        failed_sources = manifest.failed_sources()
+        print(f"从作业日志继续: 已完成 {done_count} 个，重试失败 {len(failed_sources)} 个")
+        print(f"Resuming from the job journal: {done_count} done, retrying {len(failed_sources)} failed")
+
+    # 流式遍历图片文件（按文件头识别格式），跳过未变化的文件/Stream image files (identified by file header), skipping unchanged files
+    relative_paths = iter_image_files(input_folder, recursive, include, exclude, skip_folders=(output_folder,))
+    total = None
+    total_future = None
+    duplicates = {}
+    if deduplicate is not None:
+        # 重复检测需要先完成遍历，再按输入顺序计算哈希/Duplicate detection needs the complete walk, then hashes are computed in input order
+        relative_paths = list(relative_paths)
+        total = len(relative_paths)
+        duplicates = find_duplicates(input_folder, relative_paths, deduplicate, duplicate_distance, workers)
+    elif verbosity == 'progress':
+        # 进度显示的总数由后台线程单独遍历得到，处理不必等待遍历完成/The progress total comes from a separate walk in a background thread, so processing does not wait for the walk
+        counter = ThreadPoolExecutor(max_workers=1)
+        total_future = counter.submit(_count_image_files, input_folder, recursive, include, exclude, output_folder)
+        counter.shutdown(wait=False)
+
+    def run(paths):
+        tasks = (
+            (os.path.join(input_folder, relative_path), os.path.join(output_folder, os.path.dirname(relative_path))) + tuple(task_parameters)
+            for relative_path in paths
+            if not (skip_current and manifest.is_current(relative_path, os.path.join(input_folder, relative_path)))
+        )
+        if prefetch:
+            return run_pipelined(compute_function, tasks, workers, prefetch)
+        return ((arguments[1:], result, error) for arguments, result, error
+                in run_tasks(process_file, ((compute_function,) + task for task in tasks), workers))
+
+    def all_results():
+        yield from run(relative_path for relative_path in relative_paths if relative_path not in duplicates)
+        # 原图处理失败时没有可链接或跳过依据的输出，改为处理重复文件本身；此时原图的结果都已记入清单
+        # When the original failed there is no output to link to or skip for, so the duplicate itself is processed; the original's result is already recorded in the manifest by now
+        fallback = [relative_path for relative_path, original in duplicates.items() if not _recorded_outputs(manifest.entries.get(original, {}))]
+        for relative_path in fallback:
+            del duplicates[relative_path]
+        yield from run(fallback)
+
+    # 收集处理失败的文件和尺寸阶梯/Collect failed files and the size ladders
+    failures = []
+    srcsets = {}
+    instrumentation.start(total)
+    for task, result, error in all_results():
+        if total_future is not None and total_future.done():
+            if total_future.exception() is None:
+                instrumentation.set_total(total_future.result())
+            total_future = None
+        relative_path = os.path.relpath(task[0], input_folder)
+        if error is None:
+            output_filename, output_size, source_format, stage_seconds, derivatives, decode_scale = result
+            output_relative_path = os.path.join(os.path.dirname(relative_path), output_filename)
+            derivative_outputs = None
+            if derivatives is not None:
+                derivative_outputs = [os.path.join(os.path.dirname(relative_path), derivative[0]) for derivative in derivatives]
+                srcsets[relative_path.replace(os.sep, '/')] = [
+                    {'file': derivative_output.replace(os.sep, '/'), 'width': size[0], 'height': size[1], 'format': image_format, 'bytes': byte_count}
+                    for derivative_output, (_, size, image_format, byte_count) in zip(derivative_outputs, derivatives)
+                ]
+            manifest.record(relative_path, task[0], output_relative_path, derivative_outputs, decode_scale)
+            instrumentation.file_done(relative_path, output_filename, output_size, source_format, stage_seconds, decode_scale)
+        else:
+            failures.append((relative_path, str(error)))
+            manifest.record_failure(relative_path, task[0], error)
+            instrumentation.file_failed(relative_path, error)
+
+    # 删除过期输出并压缩清单/Prune stale outputs and compact the manifest
+    if skip_current and prune_stale:
+        for output_filename in manifest.prune():
+            print(f"已删除过期输出: {output_filename}")
+            print(f"Removed stale output: {output_filename}")
+    manifest.close()
+    skipped_count = manifest.skipped_count
+
+    # 在清理之后处理重复文件，避免新建的链接被当作过期输出删除/Handle duplicates after pruning so fresh links are not deleted as stale outputs
+    # 清单记录已包含本次运行的结果，原图的输出为尺寸阶梯的所有文件或单个输出/The manifest records already include this run, the original's outputs are every size ladder file or the single output
+    duplicate_links = {}
+    for relative_path, original in duplicates.items():
+        original_entry = manifest.entries.get(original, {})
+        original_outputs = _recorded_outputs(original_entry)
+        link = None
+        if duplicate_action == 'symlink' and original_outputs:
+            try:
+                links = link_duplicate(output_folder, relative_path, original, original_outputs)
+            except OSError as e:
+                failures.append((relative_path, str(e)))
+                instrumentation.file_failed(relative_path, e)
+                continue
+            link = links[0]
+            if 'derivatives' in original_entry:
+                duplicate_links[relative_path.replace(os.sep, '/')] = (
+                    original.replace(os.sep, '/'),
+                    {output.replace(os.sep, '/'): linked.replace(os.sep, '/') for output, linked in zip(original_outputs, links)})
+        instrumentation.file_duplicate(relative_path, original, link)
+
+    if srcsets or duplicate_links:
+        _update_srcset_manifest(output_folder, srcsets, duplicate_links)
+    instrumentation.finish(skipped_count)
+    return failures, skipped_count, len(duplicates)
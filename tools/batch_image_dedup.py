@@ -0,0 +1,211 @@
+from PIL import Image
+import math
+import os
+
+from batch_image_common import run_tasks
+
+# 感知哈希算法/Perceptual hash methods
+HASH_METHODS = ('ahash', 'dhash', 'phash')
+
+# 各哈希算法的默认最大汉明距离：重新编码（JPEG质量变化、转为WebP）后仍视为重复，不同图片之间的距离明显更大
+# Default maximum Hamming distance per hash method: re-encoded copies (changed JPEG quality, converted to WebP) still count as duplicates, while distinct images are clearly further apart
+DEFAULT_DISTANCES = {'ahash': 2, 'dhash': 6, 'phash': 10}
+
+# 重复文件的处理方式/How duplicate files are handled
+DUPLICATE_ACTIONS = ('skip', 'symlink')
+
+# 缩小解码后的短边至少为代理图边长的倍数，使JPEG的DCT缩放与其他格式的块平均几乎一致
+# Minimum short side after the reduced decode, as a multiple of the proxy side, so JPEG DCT scaling and the block averaging of other formats nearly agree
+REDUCE_MARGIN = 4
+
+
+def image_hash(source, method='dhash', hash_size=8):
+    """
+    计算图片的感知哈希
+    Compute the perceptual hash of an image
+
+    功能说明
+    Function Description
+        - 在缩小的灰度代理图上计算：先按相同倍数（1/2、1/4或1/8）缩小解码，JPEG使用降分辨率解码，其他格式用 reduce 按块平均，再用BOX缩小到代理图
+        - Computed on a downscaled grayscale proxy: the image is first reduced by the same factor (1/2, 1/4 or 1/8) for every format, with a reduced-resolution decode for JPEG and block averaging through reduce for other formats, then BOX-downscaled to the proxy
+        - 缩小后的短边至少为代理图边长的 REDUCE_MARGIN 倍，JPEG与其像素相同的PNG副本的哈希最多相差一两位，在各算法的默认距离之内；距离为0时只保证同一格式的相同图片匹配
+        - The reduced short side is at least REDUCE_MARGIN times the proxy side, so a JPEG and a pixel-identical PNG copy differ by at most a bit or two, within each method's default distance; a distance of 0 only guarantees matches within the same format
+        - 'ahash': 均值哈希，像素是否高于平均值 / Average hash, whether each pixel is above the mean
+        - 'dhash': 差值哈希，每个像素是否比右侧像素暗 / Difference hash, whether each pixel is darker than its right neighbour
+        - 'phash': DCT哈希，低频DCT系数是否高于中位数，对重新编码和轻微调色最稳定 / DCT hash, whether the low-frequency DCT coefficients are above the median, the most robust to re-encoding and slight color changes
+
+    参数
+    Parameters
+        - source: 图片路径或文件对象 / Image path or file object
+        - method: 哈希算法，默认为'dhash' / Hash method, default is 'dhash'
+        - hash_size: 哈希边长，哈希位数为其平方，默认为8（64位）/ Hash side length, the number of bits is its square, default is 8 (64 bits)
+
+    返回
+    Returns
+        - 整数形式的哈希 / Hash as an integer
+    """
+    if method not in HASH_METHODS:
+        raise ValueError(f"不支持的哈希算法/Unsupported hash method: {method}")
+    proxy_width, proxy_height = {
+        'ahash': (hash_size, hash_size),
+        'dhash': (hash_size + 1, hash_size),
+        'phash': (hash_size * 4, hash_size * 4),
+    }[method]
+
+    with Image.open(source) as img:
+        factor = 1
+        while factor < 8 and min(img.size) // (factor * 2) >= max(proxy_width, proxy_height) * REDUCE_MARGIN:
+            factor *= 2
+        reduced_size = (math.ceil(img.width / factor), math.ceil(img.height / factor))
+        # 只有JPEG支持降分辨率解码，其他格式完整解码后再按块平均/Only JPEG supports a reduced decode, other formats are fully decoded and then block-averaged
+        img.draft(img.mode, reduced_size)
+        grey = img.convert('L')
+    if grey.size != reduced_size:
+        grey = grey.reduce(factor)
+    proxy = grey.resize((proxy_width, proxy_height), Image.Resampling.BOX)
+    pixels = list(proxy.getdata())
+
+    if method == 'ahash':
+        mean = sum(pixels) / len(pixels)
+        bits = [pixel > mean for pixel in pixels]
+    elif method == 'dhash':
+        bits = [pixels[row * proxy_width + column] < pixels[row * proxy_width + column + 1]
+                for row in range(proxy_height) for column in range(hash_size)]
+    else:
+        bits = _dct_bits(pixels, proxy_width, hash_size)
+    return sum(1 << position for position, bit in enumerate(bits) if bit)
+
+
+def _dct_bits(pixels, side, hash_size):
+    # 二维DCT取左上角低频系数，与中位数比较；NumPy按需导入/2-D DCT, keep the top-left low-frequency block and compare it with the median; NumPy is imported on demand
+    import numpy as np
+    indices = np.arange(side)
+    basis = np.cos(np.pi * (2 * indices[None, :] + 1) * indices[:, None] / (2 * side))
+    block = np.asarray(pixels, dtype=np.float64).reshape(side, side)
+    coefficients = (basis @ block @ basis.T)[:hash_size, :hash_size].ravel()
+    # 直流分量只反映平均亮度，不参与中位数/The DC term only reflects the mean brightness, so it is left out of the median
+    return list(coefficients > np.median(coefficients[1:]))
+
+
+def hamming_distance(first_hash, second_hash):
+    """
+    两个哈希之间不同的位数
+    Number of differing bits between two hashes
+    """
+    return bin(first_hash ^ second_hash).count('1')
+
+
+class BKTree:
+    """
+    BK树：按汉明距离索引哈希，查询给定半径内的所有哈希时只访问少量节点
+    BK-tree: indexes hashes by Hamming distance, so a radius query visits only a small part of the tree
+
+    节点为 [哈希, 条目, {距离: 子节点}]，利用三角不等式剪枝：只有与查询距离在 [d-r, d+r] 内的子树需要访问
+    Nodes are [hash, item, {distance: child}], pruned with the triangle inequality: only subtrees whose edge distance is within [d-r, d+r] are visited
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, image_hash_value, item):
+        node = self.root
+        if node is None:
+            self.root = [image_hash_value, item, {}]
+            return
+        while True:
+            distance = hamming_distance(image_hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash_value, item, {}]
+                return
+            node = child
+
+    def search(self, image_hash_value, radius):
+        """
+        返回半径内的 (距离, 条目) 列表，按距离和条目排序
+        Return the list of (distance, item) within the radius, sorted by distance and item
+        """
+        matches = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming_distance(image_hash_value, node[0])
+            if distance <= radius:
+                matches.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    pending.append(child)
+        return sorted(matches)
+
+
+def find_duplicates(input_folder, relative_paths, method='dhash', max_distance=None, workers=1):
+    """
+    查找重复和近似重复的图片
+    Find duplicate and near-duplicate images
+
+    功能说明
+    Function Description
+        - 并行计算每个文件的感知哈希，按输入顺序插入BK树
+        - Compute the perceptual hash of every file in parallel and insert them into a BK-tree in input order
+        - 与已有哈希的汉明距离不超过 max_distance 的文件视为重复，对应最近（相同时最早）的原图
+        - A file within max_distance bits of an earlier hash is a duplicate of the closest (earliest on ties) original
+        - 无法计算哈希的文件不视为重复，留给正式处理时报告错误
+        - Files whose hash cannot be computed are not treated as duplicates, their errors are reported by the real processing
+
+    参数
+    Parameters
+        - input_folder: 输入目录 / Input directory
+        - relative_paths: 相对路径列表，顺序决定哪个文件被视为原图 / List of relative paths, the order decides which file counts as the original
+        - method: 哈希算法，见 image_hash / Hash method, see image_hash
+        - max_distance: 最大汉明距离，0表示哈希完全相同，默认为None表示使用 DEFAULT_DISTANCES 中该算法的默认值 / Maximum Hamming distance, 0 means identical hashes, default is None meaning the method's default from DEFAULT_DISTANCES
+        - workers: 计算哈希的进程数，与 run_tasks 相同 / Number of processes for hashing, same as run_tasks
+
+    返回
+    Returns
+        - {重复文件相对路径: 原图相对路径} / {duplicate relative path: original relative path}
+    """
+    if max_distance is None:
+        max_distance = DEFAULT_DISTANCES[method]
+    tree = BKTree()
+    duplicates = {}
+    tasks = ((os.path.join(input_folder, relative_path), method) for relative_path in relative_paths)
+    for position, ((input_path, _), image_hash_value, error) in enumerate(run_tasks(image_hash, tasks, workers)):
+        if error is not None:
+            continue
+        relative_path = os.path.relpath(input_path, input_folder)
+        matches = tree.search(image_hash_value, max_distance)
+        if matches:
+            # 条目为 (输入序号, 相对路径)，距离相同时取最早的/Items are (input position, relative path), the earliest wins on equal distance
+            duplicates[relative_path] = matches[0][1][1]
+        else:
+            tree.add(image_hash_value, (position, relative_path))
+    return duplicates
+
+
+def link_duplicate(output_folder, relative_path, original_relative_path, original_outputs):
+    """
+    在输出目录中为重复文件创建指向原图各输出的相对符号链接
+    Create relative symbolic links in the output directory from the duplicate to each of the original's outputs
+
+    链接名沿用输出命名规则：重复文件名加上原图输出名中原文件名之后的部分；尺寸阶梯的每个文件各有一个链接
+    Link names follow the output naming rule: the duplicate's name plus the part of the original's output name after the original name; every file of a size ladder gets its own link
+
+    返回
+    Returns
+        - 各链接相对于输出目录的路径，与 original_outputs 顺序相同 / Paths of the links relative to the output directory, in the order of original_outputs
+    """
+    original_name = os.path.splitext(os.path.basename(original_relative_path))[0]
+    duplicate_name = os.path.splitext(os.path.basename(relative_path))[0]
+    link_folder = os.path.join(output_folder, os.path.dirname(relative_path))
+    os.makedirs(link_folder, exist_ok=True)
+
+    link_relative_paths = []
+    for original_output in original_outputs:
+        suffix = os.path.basename(original_output)[len(original_name):]
+        link_relative_path = os.path.join(os.path.dirname(relative_path), duplicate_name + suffix)
+        link_path = os.path.join(output_folder, link_relative_path)
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(os.path.relpath(os.path.join(output_folder, original_output), link_folder), link_path)
+        link_relative_paths.append(link_relative_path)
+    return link_relative_paths
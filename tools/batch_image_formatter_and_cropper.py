@@ -1,7 +1,9 @@
-from PIL import Image
 import os
 
-def fixed_ratio_crop(input_folder, output_folder, crop_aspect_ratio=None, output_format=None):
+from batch_image_common import ANCHOR_MODES, center_crop_box, check_encode_options, check_srcset_options, encode_image, encode_srcset, exif_orientation, fit_size, load_oriented_region, open_image, oriented_size, plan_folder, plan_outputs, prepare_for_format, process_folder, resolve_output_format
+from batch_image_instrumentation import StageTimer
+
+def fixed_ratio_crop(input_folder, output_folder, crop_aspect_ratio=None, output_format=None, workers=1, max_output_size=None, incremental=False, content_hash=False, prune_stale=False, recursive=False, include=None, exclude=None, verbosity='files', event_log=None, observers=(), prefetch=0, encode_profile=None, target_file_size=None, anchor='center', memory_budget=None, deduplicate=None, duplicate_distance=None, duplicate_action='skip', srcset_widths=None, srcset_formats=('webp', 'jpeg'), dry_run=False, plan_path=None, resume=False):
     """
     批量图像格式转换与裁剪工具
     Batch Image Formatter and Cropper Tool
@@ -21,8 +23,10 @@ def fixed_ratio_crop(input_folder, output_folder, crop_aspect_ratio=None, output
         - Iterate through all image files in the specified folder
         - 支持保持原图比例或按指定比例裁剪
         - Support keeping original image ratio or cropping by specified ratio
-        - 从图片中心进行裁剪以保留主要内容
-        - Crop from the center of the image to preserve the main content
+        - 从图片中心进行裁剪以保留主要内容，或按图像能量自动选择裁剪位置
+        - Crop from the center of the image to preserve the main content, or choose the crop position automatically from the image energy
+        - 按EXIF方向校正后的尺寸计算裁剪框，手机竖拍照片沿正确的轴裁剪，输出不再带方向标记
+        - The crop box is computed on the size after EXIF orientation correction, so portrait phone photos are cropped along the right axis and outputs carry no orientation tag
         - 支持多种输入格式，可指定输出格式
         - Support multiple input formats, output format can be specified
         
@@ -44,6 +48,79 @@ def fixed_ratio_crop(input_folder, output_folder, crop_aspect_ratio=None, output
         - output_folder: 输出目录 / Output directory
         - crop_aspect_ratio: 裁剪宽高比，默认为None表示保持原比例 / Crop aspect ratio, default is None which means keeping the original ratio
         - output_format: 输出图片格式，默认为None表示保持原格式 / Output image format, default is None which means keeping the original format
+        - workers: 并行处理的进程数，默认为1表示顺序处理，None表示使用全部CPU核心 / Number of worker processes, default is 1 for serial processing, None means all CPU cores
+            文件按名称排序后分发，结果按相同顺序汇报，输出文件名与进程数无关
+            Files are dispatched in name order and reported in the same order, output filenames do not depend on the number of processes
+        - max_output_size: 最大输出尺寸 (宽, 高)，默认为None表示保持原分辨率 / Maximum output size (width, height), default is None which keeps the native resolution
+            裁剪结果超过该尺寸时等比缩小；JPEG输入直接以降分辨率解码，其他格式直接从裁剪区域重采样
+            Crops exceeding this size are scaled down proportionally; JPEG inputs are decoded at reduced resolution, other formats are resampled straight from the crop region
+            文件名中的宽高为实际输出尺寸
+            The width and height in the filename are the actual output dimensions
+        - incremental: 是否启用增量处理，默认为False / Whether to enable incremental processing, default is False
+            在输出目录中维护清单（.batch_manifest.jsonl），跳过未变化且参数相同的源文件
+            Maintains a manifest (.batch_manifest.jsonl) in the output directory and skips source files that are unchanged and were processed with the same parameters
+        - content_hash: 增量处理时是否额外比较内容哈希，默认为False / Whether incremental processing also compares content hashes, default is False
+        - prune_stale: 增量处理时是否删除过期输出，默认为False / Whether incremental processing deletes stale outputs, default is False
+        - recursive: 是否递归处理子目录，默认为False / Whether to process subdirectories recursively, default is False
+            输出目录中会镜像输入目录的子目录结构
+            The subdirectory structure of the input directory is mirrored in the output directory
+        - include: 包含的glob模式（字符串或列表），如 '*.jpg' 或 'trips/*'，默认为None表示全部 / Include glob patterns (string or list), e.g. '*.jpg' or 'trips/*', default is None meaning all
+        - exclude: 排除的glob模式（字符串或列表），如 '*_thumb*' / Exclude glob patterns (string or list), e.g. '*_thumb*'
+        - verbosity: 输出详细程度，默认为'files' / Output verbosity, default is 'files'
+            * 'files' - 逐文件打印处理结果/ Print the result of every file
+            * 'progress' - 单行进度显示（吞吐量和预计剩余时间）加分阶段耗时汇总/ Single-line progress display (throughput and ETA) plus a per-stage time summary
+            * 'summary' - 只打印分阶段和按格式的耗时汇总/ Only print the per-stage and per-format time summary
+            * 'quiet' - 不打印逐文件信息/ Print nothing per file
+        - event_log: JSON-lines事件日志路径，记录每个文件的 open/decode/transform/encode/write 耗时，默认为None / JSON-lines event log path recording open/decode/transform/encode/write time of each file, default is None
+        - observers: 自定义观察者列表，每个事件调用一次 observer(event) / List of custom observers, observer(event) is called for every event
+        - prefetch: 流水线预读文件数，默认为0表示逐个读取、处理、写入 / Number of files prefetched by the pipeline, default is 0 meaning each file is read, processed and written in turn
+            大于0时后台线程预读原始字节并在后台写入编码结果，使网络存储的I/O延迟与解码/编码重叠
+            When greater than 0, background threads prefetch the raw bytes and write the encoded results, so network storage I/O latency overlaps with decoding/encoding
+        - encode_profile: 编码配置，默认为None表示Pillow默认设置 / Encode profile, default is None meaning Pillow defaults
+            * 'fast' - 编码最快，文件较大/ Fastest encoding, larger files
+            * 'balanced' - 编码时间与文件大小折中/ Trade-off between encode time and file size
+            * 'smallest' - 文件最小（JPEG渐进式+优化、PNG最高压缩、WebP method 6），编码最慢/ Smallest files (progressive optimized JPEG, maximum PNG compression, WebP method 6), slowest encoding
+            * 'lossless' - 无损WebP、最高压缩PNG、高质量JPEG/ Lossless WebP, maximum compression PNG, high quality JPEG
+        - target_file_size: 目标文件大小（字节），默认为None / Target file size (bytes), default is None
+            JPEG和WebP输出在内存中二分搜索不超过该大小的最高质量后才写入；其他格式忽略此参数
+            JPEG and WebP outputs binary-search in memory for the highest quality within this size before writing; other formats ignore it
+        - anchor: 裁剪锚点，默认为'center' / Crop anchor, default is 'center'
+            * 'center' - 居中裁剪/ Centered crop
+            * 'energy' - 在缩小的灰度代理图上用积分图找出保留细节最多的窗口，适合主体偏离中心的图片/ Find the window that keeps the most detail using a summed-area table on a downscaled grayscale proxy, suited to off-center subjects
+        - memory_budget: 单个文件的内存预算（字节），默认为None表示不限制 / Memory budget per file (bytes), default is None meaning unlimited
+            解码后超过预算的未压缩图片（未压缩TIFF、BMP）通过内存映射按行带流式读取，并直接写入未压缩TIFF（输出扩展名为.tiff），峰值内存由预算而不是图片尺寸决定
+            Uncompressed images (uncompressed TIFF, BMP) whose decoded size exceeds the budget are read in bands of rows through a memory map and written straight to an uncompressed TIFF (output extension .tiff), so peak memory is set by the budget rather than the image size
+            压缩格式无法分块读取：超过预算的JPEG按1/2、1/4或1/8缩小解码以放入预算（输出尺寸随之缩小），打印警告并在 file_done 事件和清单中记录 decode_scale；其他格式打印警告后完整解码，不受预算限制，且仍受Pillow解压炸弹检查保护
+            Compressed formats cannot be read in bands: a JPEG over the budget is decoded downscaled by 1/2, 1/4 or 1/8 to fit it (the output shrinks accordingly), with a printed warning and decode_scale recorded in the file_done event and the manifest; other formats are decoded in full after a printed warning, are not bounded by the budget and stay under Pillow's decompression-bomb check
+            流式处理的文件不支持 max_output_size和能量锚点；设置预算时不使用 prefetch 预读
+            Streamed files do not support max_output_size or the energy anchor; prefetch is not used when a budget is set
+        - deduplicate: 处理前检测重复图片使用的感知哈希，默认为None表示不检测 / Perceptual hash used to detect duplicate images before processing, default is None meaning no detection
+            * 'ahash' - 均值哈希，最快/ Average hash, fastest
+            * 'dhash' - 差值哈希/ Difference hash
+            * 'phash' - DCT哈希，对重新编码最稳定/ DCT hash, most robust to re-encoding
+            哈希在缩小的灰度代理图上计算并用BK树索引，重复组中只处理输入顺序中的第一张
+            Hashes are computed on a downscaled grayscale proxy and indexed in a BK-tree, only the first image of each duplicate group in input order is processed
+        - duplicate_distance: 视为近似重复的最大汉明距离（64位哈希），默认为None表示按算法取能容忍重新编码的默认值（ahash 2、dhash 6、phash 10），0表示哈希完全相同 / Maximum Hamming distance (64-bit hash) treated as a near-duplicate, default is None meaning the per-method default that tolerates re-encoding (ahash 2, dhash 6, phash 10), 0 means identical hashes
+        - duplicate_action: 重复文件的处理方式，默认为'skip' / How duplicates are handled, default is 'skip'
+            * 'skip' - 跳过，不生成输出/ Skip without output
+            * 'symlink' - 在输出目录中创建指向原图各输出（含尺寸阶梯）的符号链接/ Create symbolic links to each of the original's outputs (including the size ladder) in the output directory
+        - srcset_widths: 响应式尺寸阶梯的宽度列表，如 [1600, 800, 400]，默认为None表示只输出一个文件 / Widths of the responsive size ladder, e.g. [1600, 800, 400], default is None meaning a single output file
+            裁剪后的图片只解码一次，从大到小逐级用Lanczos缩小，每一级编码为 srcset_formats 中的所有格式（output_format 不再使用）
+            The cropped image is decoded once and downscaled step by step from largest to smallest with Lanczos, every step is encoded in all srcset_formats (output_format is not used)
+            各文件的尺寸、格式和字节数写入输出目录的 srcset.json，供网页生成 srcset；不能与 memory_budget 同时使用
+            The dimensions, format and byte size of every file are written to srcset.json in the output directory for building srcset in HTML; cannot be combined with memory_budget
+        - srcset_formats: 尺寸阶梯的输出格式，默认为('webp', 'jpeg') / Output formats of the size ladder, default is ('webp', 'jpeg')
+        - dry_run: 是否只生成计划，默认为False / Whether to only build a plan, default is False
+            只读取文件头和EXIF，计算每个输出的裁剪框、尺寸和文件名并打印，不解码像素也不写入任何文件
+            Only headers and EXIF are read to compute the crop box, size and filename of every output, which are printed without decoding pixels or writing any file
+        - plan_path: 计划JSON的保存路径，默认为None / Path to save the plan as JSON, default is None
+            设置时同样只生成计划，结果写入该文件而不是逐文件打印
+            When set only the plan is built as well, and it is written to this file instead of printed per file
+        - resume: 是否从上次中断或失败的运行继续，见 fixed_ratio_expand，默认为False / Whether to continue an interrupted or failed run, see fixed_ratio_expand, default is False
+
+    返回
+    Returns
+        - 处理失败的文件列表，每项为 (相对路径, 错误信息) / List of failed files, each item is (relative path, error message)
         
     支持的格式
     Supported Formats
@@ -60,73 +137,29 @@ def fixed_ratio_crop(input_folder, output_folder, crop_aspect_ratio=None, output
           * "TIFF" - 标记图像文件格式/ Tagged Image File Format
           * "WebP" - 现代图像格式/ Modern image format
     """
-    # 创建输出文件夹/Create output directory
-    os.makedirs(output_folder, exist_ok=True)
-
-    # 计算宽高比/Calculate aspect ratio
-    ratio = crop_aspect_ratio
-
-    # 遍历输入文件夹中的所有文件/Iterate through all files in the input folder
-    for filename in os.listdir(input_folder):
-        # 检查是否为图片文件/Check if it's an image file
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')):
-            try:
-                # 打开图片/Open image
-                with Image.open(os.path.join(input_folder, filename)) as img:
-                    # 获取图片尺寸/Get image dimensions
-                    width, height = img.size
-                    current_ratio = width / height
-
-                    # 确定裁剪方向/Determine crop direction
-                    if current_ratio > ratio:
-                        # 图片过宽，裁剪左右/Crop left and right for overly wide images
-                        new_height = height
-                        new_width = int(height * ratio)
-                        left = (width - new_width) // 2
-                        crop_box = (left, 0, left + new_width, height)
-                    else:
-                        # 图片过高，裁剪上下/Crop top and bottom for overly tall images
-                        new_width = width
-                        new_height = int(width / ratio)
-                        top = (height - new_height) // 2
-                        crop_box = (0, top, width, top + new_height)
-
-                    # 执行裁剪/Perform cropping
-                    cropped = img.crop(crop_box)
-                    
-                    # 处理输出文件名和格式/Process output filename and format
-                    original_name, original_ext = os.path.splitext(filename)
-                    
-                    # 如果未指定输出格式，则保持原格式/If output format is not specified, keep the original format
-                    if output_format is None:
-                        output_ext = original_ext
-                        final_output_format = img.format
-                    else:
-                        output_ext = f".{output_format.lower()}"
-                        # 确保格式名称与PIL兼容/Ensure format name is compatible with PIL
-                        if output_format.lower() == 'jpg':
-                            final_output_format = 'JPEG'
-                        else:
-                            final_output_format = output_format.upper()
-                    
-                    # 使用原始文件名_crop_{宽度}_{高度}格式命名/Use original_filename_crop_{width}_{height} format for naming
-                    output_filename = f"{original_name}_crop_{new_width}_{new_height}{output_ext}"
-                    output_path = os.path.join(output_folder, output_filename)
-                    
-                    # 转换图像模式以支持某些格式/Convert image mode to support certain formats
-                    if final_output_format == "JPEG":
-                        # JPEG不支持透明度，需要转换为RGB模式/JPEG doesn't support transparency, need to convert to RGB mode
-                        if cropped.mode in ('RGBA', 'LA', 'P'):
-                            cropped = cropped.convert('RGB')
-                    
-                    # 保存裁剪后的图片/Save the cropped image
-                    cropped.save(output_path, format=final_output_format)
-                    print(f"已处理: {filename} -> 尺寸: {cropped.size}")
-                    print(f"Processed: {filename} -> Size: {cropped.size}")
-
-            except Exception as e:
-                print(f"处理失败: {filename} - {str(e)}")
-                print(f"Processing failed: {filename} - {str(e)}")
+    # 检查裁剪锚点/Check crop anchor
+    if anchor not in ANCHOR_MODES:
+        raise ValueError(f"不支持的裁剪锚点/Unsupported crop anchor: {anchor}")
+    check_encode_options(encode_profile, target_file_size)
+    check_srcset_options(srcset_widths, srcset_formats, memory_budget)
+    if memory_budget is not None:
+        # 预读会把整个文件读入内存，与内存预算冲突/Prefetching reads whole files into memory, which defeats the memory budget
+        prefetch = 0
+    task_parameters = (crop_aspect_ratio, output_format, max_output_size, encode_profile, target_file_size, anchor, memory_budget, srcset_widths, srcset_formats)
+    if dry_run or plan_path is not None:
+        # 只读取文件头和EXIF生成计划/Build the plan from headers and EXIF only
+        return plan_folder(_plan_crop, task_parameters, input_folder, output_folder, workers, recursive, include, exclude, plan_path, verbosity)
+    failures, skipped_count, duplicate_count = process_folder(
+        _crop_image, task_parameters,
+        input_folder, output_folder,
+        {
+            'operation': 'crop',
+            'crop_aspect_ratio': crop_aspect_ratio, 'output_format': output_format, 'max_output_size': max_output_size,
+            'encode_profile': encode_profile, 'target_file_size': target_file_size, 'anchor': anchor, 'memory_budget': memory_budget,
+            'srcset_widths': srcset_widths, 'srcset_formats': srcset_formats,
+        },
+        workers, incremental, content_hash, prune_stale, recursive, include, exclude, verbosity, event_log, observers, prefetch,
+        deduplicate, duplicate_distance, duplicate_action, resume)
 
     # 最终提示/Final prompt
     print("\n处理完成")
@@ -135,18 +168,149 @@ def fixed_ratio_crop(input_folder, output_folder, crop_aspect_ratio=None, output
     print(f"Input directory: {input_folder}")
     print(f"输出目录: {output_folder}")
     print(f"Output directory: {output_folder}")
-    print(f"裁剪比例: {crop_aspect_ratio:.2f}")
-    print(f"Crop ratio: {crop_aspect_ratio:.2f}")
+    if crop_aspect_ratio is None:
+        print("裁剪比例: 原比例")
+        print("Crop ratio: original")
+    else:
+        print(f"裁剪比例: {crop_aspect_ratio:.2f}")
+        print(f"Crop ratio: {crop_aspect_ratio:.2f}")
+    if incremental or resume:
+        print(f"未变化已跳过: {skipped_count} 个文件")
+        print(f"Skipped unchanged: {skipped_count} files")
+    if deduplicate is not None:
+        print(f"重复已{'链接' if duplicate_action == 'symlink' else '跳过'}: {duplicate_count} 个文件")
+        print(f"Duplicates {'linked' if duplicate_action == 'symlink' else 'skipped'}: {duplicate_count} files")
+    if failures:
+        print(f"处理失败: {len(failures)} 个文件")
+        print(f"Processing failed: {len(failures)} files")
+    return failures
+
+
+def _crop_image(source, filename, crop_aspect_ratio, output_format, max_output_size, encode_profile, target_file_size, anchor, memory_budget, srcset_widths, srcset_formats):
+    # 裁剪单个文件并返回输出文件名、编码数据、尺寸、源格式和分阶段耗时，在工作进程中执行/Crop a single file and return the output filename, encoded data, size, source format and stage timings, runs in a worker process
+    timer = StageTimer()
+
+    # 打开图片（只读取文件头），source 可以是路径或预读的文件对象/Open image (reads only the header), source may be a path or a prefetched file object
+    with timer.stage('open'):
+        img, tiled, decode_scale = open_image(source, memory_budget)
+    with img:
+        # 在EXIF方向校正后的坐标中计算居中裁剪框/Calculate the centered crop box in orientation-corrected coordinates
+        orientation, size, crop_box = _crop_geometry(img, crop_aspect_ratio)
+        if tiled:
+            return _tiled_crop(source, filename, img, crop_box, max_output_size, anchor, memory_budget, timer)
+        crop_width, crop_height = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+        new_width, new_height = fit_size((crop_width, crop_height), max_output_size)
+
+        if anchor == 'energy' and crop_box != (0, 0) + size:
+            # 整张图按输出比例只解码一次（JPEG在加载前降分辨率，并按方向校正），代理图和裁剪都取自这次解码
+            # Decode the whole image once at the output scale (JPEG at reduced resolution before loading, corrected for orientation), both the proxy and the crop come from this decode
+            with timer.stage('decode'):
+                scale = new_width / crop_width
+                decoded_size = (max(new_width, round(size[0] * scale)), max(new_height, round(size[1] * scale)))
+                decoded = load_oriented_region(img, orientation, (0, 0) + size, decoded_size)
+            # 按能量移动同尺寸的裁剪框，NumPy按需导入/Move the same-size crop box by energy, importing NumPy on demand
+            with timer.stage('transform'):
+                from batch_image_saliency import EnergyMap
+                energy_box, _ = EnergyMap(decoded).best_box(new_width, new_height)
+                cropped = decoded.crop(energy_box)
+        else:
+            # 执行裁剪，超过最大输出尺寸时以降分辨率解码并缩放/Perform cropping, decoding at reduced resolution and scaling when exceeding the maximum output size
+            with timer.stage('decode'):
+                cropped = load_oriented_region(img, orientation, crop_box, (new_width, new_height))
+
+        if srcset_widths is not None:
+            # 尺寸阶梯：从这一次解码逐级缩小并编码所有格式/Size ladder: downscale step by step from this single decode and encode every format
+            derivatives = encode_srcset(cropped, f"{os.path.splitext(filename)[0]}_crop", srcset_widths, srcset_formats, encode_profile, target_file_size, timer)
+            return derivatives[0][0], derivatives, derivatives[0][2], img.format, timer.seconds, decode_scale
+
+        # 处理输出文件名和格式/Process output filename and format
+        with timer.stage('transform'):
+            original_name, original_ext = os.path.splitext(filename)
+            output_ext, final_output_format = resolve_output_format(output_format, img.format, original_ext)
+            cropped = prepare_for_format(cropped, final_output_format)
+
+        # 编码裁剪后的图片/Encode the cropped image
+        with timer.stage('encode'):
+            data = encode_image(cropped, final_output_format, encode_profile, target_file_size)
+
+    # 使用原始文件名_crop_{宽度}_{高度}格式命名，由调用方写入/Name with original_filename_crop_{width}_{height} format, the caller writes the data
+    output_filename = f"{original_name}_crop_{new_width}_{new_height}{output_ext}"
+    return output_filename, data, cropped.size, img.format, timer.seconds, decode_scale
+
+
+def _crop_geometry(img, crop_aspect_ratio):
+    # 只读取文件头：返回 (EXIF方向, 校正后的尺寸, 居中裁剪框)，规划和实际处理共用/Header only: return (EXIF orientation, corrected size, centered crop box), shared by planning and the real run
+    orientation = exif_orientation(img)
+    size = oriented_size(img.size, orientation)
+    return orientation, size, center_crop_box(size, crop_aspect_ratio)
+
+
+def _plan_crop(source, filename, crop_aspect_ratio, output_format, max_output_size, encode_profile, target_file_size, anchor, memory_budget, srcset_widths, srcset_formats):
+    # 只读取文件头和EXIF规划单个文件的裁剪，在工作进程中执行/Plan the crop of a single file from its header and EXIF only, runs in a worker process
+    img, tiled, decode_scale = open_image(source, memory_budget)
+    with img:
+        orientation, size, crop_box = _crop_geometry(img, crop_aspect_ratio)
+        original_name, original_ext = os.path.splitext(filename)
+        crop_size = (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1])
+        if tiled:
+            # 与正式处理相同的检查，计划中即可发现无法流式处理的文件/The same checks as the real run, so files that cannot be streamed show up in the plan
+            from batch_image_tiles import check_streamable
+            _check_tiled_options(max_output_size, anchor)
+            check_streamable(img)
+            outputs = plan_outputs(f"{original_name}_crop", crop_size, '.tiff', 'TIFF')
+        else:
+            output_ext, final_output_format = resolve_output_format(output_format, img.format, original_ext)
+            outputs = plan_outputs(f"{original_name}_crop", fit_size(crop_size, max_output_size), output_ext, final_output_format, srcset_widths, srcset_formats)
+        return {
+            'format': img.format, 'size': list(size), 'orientation': orientation,
+            # 能量锚点的位置在正式处理时才确定，这里是居中的裁剪框/The energy anchor position is only known in the real run, this is the centered box
+            'crop_box': list(crop_box), 'anchor': anchor, 'streamed': tiled, 'decode_scale': decode_scale, 'outputs': outputs,
+        }
+
+
+def _check_tiled_options(max_output_size, anchor):
+    # 流式处理只支持原尺寸居中裁剪/Streaming only supports full-size centered crops
+    if max_output_size is not None or anchor != 'center':
+        raise ValueError("流式处理的文件不支持 max_output_size 和能量锚点/max_output_size and the energy anchor are not supported for streamed files")
+
+
+def _tiled_crop(source, filename, img, crop_box, max_output_size, anchor, memory_budget, timer):
+    # 超过内存预算的图片：返回按行带流式写入的数据对象，实际读写在写入阶段进行/Image over the memory budget: return a data object that streams in bands, the actual reading and writing happen in the write stage
+    _check_tiled_options(max_output_size, anchor)
+    from batch_image_tiles import TiledCrop
+    with timer.stage('transform'):
+        data = TiledCrop(source, img, crop_box, memory_budget)
+    new_width, new_height = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+    output_filename = f"{os.path.splitext(filename)[0]}_crop_{new_width}_{new_height}.tiff"
+    return output_filename, data, (new_width, new_height), img.format, timer.seconds, 1
 
 
 # 使用示例/Usage example
-# first
-fixed_ratio_crop(
-    input_folder='D:\\path\\to\\your\\photos\\input',
-    output_folder='D:\\path\\to\\your\\photos\\output',
-    crop_aspect_ratio=1,
-    output_format=None
-)
-# second
-fixed_ratio_crop("D:/path/to/your/jpg", "D:/path/to/your/jpg/2png", None, "PNG")
-fixed_ratio_crop("D:/path/to/your/mixed_img", "D:/path/to/your/mixed_img/2png", None, "png") # 大小写不敏感/Case-insensitive
+# 放在主模块保护下，避免导入或工作进程启动时执行/Guarded so that importing or starting worker processes does not run it
+if __name__ == "__main__":
+    # first
+    fixed_ratio_crop(
+        input_folder='D:\\path\\to\\your\\photos\\input',
+        output_folder='D:\\path\\to\\your\\photos\\output',
+        crop_aspect_ratio=1,
+        output_format=None
+    )
+    # second
+    fixed_ratio_crop("D:/path/to/your/jpg", "D:/path/to/your/jpg/2png", None, "PNG")
+    fixed_ratio_crop("D:/path/to/your/mixed_img", "D:/path/to/your/mixed_img/2png", None, "png") # 大小写不敏感/Case-insensitive
+    # third: 使用全部CPU核心并行处理/Process in parallel on all CPU cores
+    fixed_ratio_crop("D:/path/to/your/huge_gallery", "D:/path/to/your/huge_gallery/square", 1, "JPEG", workers=None)
+    # fourth: 网络存储上预读和后台写入/Prefetch reads and write in the background on network storage
+    fixed_ratio_crop("//nas/photos/raw", "//nas/photos/4x3", 4/3, workers=None, prefetch=16)
+    # fifth: 快速编码/Fast encoding
+    fixed_ratio_crop("D:/path/to/your/screenshots", "D:/path/to/your/screenshots/square", 1, "PNG", encode_profile='fast')
+    # sixth: 主体偏离中心时按能量选择裁剪位置/Choose the crop position by energy for off-center subjects
+    fixed_ratio_crop("D:/path/to/your/wildlife", "D:/path/to/your/wildlife/square", 1, anchor='energy')
+    # seventh: 超大扫描件按行带流式处理，内存不超过512MB/Stream huge scans in bands within 512 MB of memory
+    fixed_ratio_crop("D:/path/to/your/scans", "D:/path/to/your/scans/square", 1, memory_budget=512 * 2**20)
+    # eighth: 重新编码的重复图片只处理一次，其余链接到同一输出/Process re-encoded duplicates once and link the rest to the same output
+    fixed_ratio_crop("D:/path/to/your/messy_downloads", "D:/path/to/your/messy_downloads/square", 1, deduplicate='phash', duplicate_distance=4, duplicate_action='symlink')
+    # ninth: 网站用的响应式尺寸阶梯，一次解码输出WebP和JPEG各三种宽度/Responsive size ladder for the website, three widths in WebP and JPEG from one decode
+    fixed_ratio_crop("D:/path/to/your/blog_photos", "D:/path/to/your/blog_photos/srcset", 16/9, srcset_widths=[1600, 800, 400], srcset_formats=('webp', 'jpeg'), encode_profile='balanced')
+    # tenth: 处理前只读取文件头检查计划（手机照片按EXIF方向计算）/Check the plan from headers only before processing (phone photos use their EXIF orientation)
+    fixed_ratio_crop("D:/path/to/your/phone_photos", "D:/path/to/your/phone_photos/4x5", 4/5, plan_path="D:/path/to/your/phone_photos/plan.json")
@@ -1,7 +1,9 @@
-from PIL import Image
 import os
 
-def fixed_ratio_expand(input_folder, output_folder, target_aspect_ratio, background_color=(255, 255, 255), output_format=None):
+from batch_image_common import FILL_MODES, apply_orientation, check_encode_options, check_srcset_options, encode_image, encode_srcset, exif_orientation, expand_layout, fit_size, load_oriented_region, new_canvas, open_image, oriented_size, plan_folder, plan_outputs, prepare_for_format, process_folder, resolve_color, resolve_output_format
+from batch_image_instrumentation import StageTimer
+
+def fixed_ratio_expand(input_folder, output_folder, target_aspect_ratio, background_color=(255, 255, 255), output_format=None, workers=1, max_output_size=None, incremental=False, content_hash=False, prune_stale=False, recursive=False, include=None, exclude=None, fill_mode='color', use_numpy=False, verbosity='files', event_log=None, observers=(), prefetch=0, encode_profile=None, target_file_size=None, memory_budget=None, deduplicate=None, duplicate_distance=None, duplicate_action='skip', srcset_widths=None, srcset_formats=('webp', 'jpeg'), dry_run=False, plan_path=None, resume=False):
     """
     批量图像格式转换与扩充工具
     Batch Image Formatter and Expander Tool
@@ -23,6 +25,8 @@ def fixed_ratio_expand(input_folder, output_folder, target_aspect_ratio, backgro
         - Support keeping original image content unchanged and expanding to specified ratio
         - 从图片中心进行扩充，将原图居中放置
         - Expand from the center of the image, placing the original image in the center
+        - 按EXIF方向校正后的尺寸计算画布，手机竖拍照片沿正确的轴扩充，输出不再带方向标记
+        - The canvas is computed on the size after EXIF orientation correction, so portrait phone photos are expanded along the right axis and outputs carry no orientation tag
         - 支持自定义填充背景颜色
         - Support custom background color for filling
         - 支持多种输入格式，可指定输出格式
@@ -55,6 +59,87 @@ def fixed_ratio_expand(input_folder, output_folder, target_aspect_ratio, backgro
                 3. 十六进制字符串：如 '#FF0000' 表示红色
                 3. Hexadecimal string: e.g. '#FF0000' for red
         - output_format: 输出图片格式，默认为None表示保持原格式 / Output image format, default is None which means keeping the original format
+        - workers: 并行处理的进程数，默认为1表示顺序处理，None表示使用全部CPU核心 / Number of worker processes, default is 1 for serial processing, None means all CPU cores
+            文件按名称排序后分发，结果按相同顺序汇报，输出文件名与进程数无关
+            Files are dispatched in name order and reported in the same order, output filenames do not depend on the number of processes
+        - max_output_size: 最大输出尺寸 (宽, 高)，默认为None表示保持原分辨率 / Maximum output size (width, height), default is None which keeps the native resolution
+            扩充后的画布超过该尺寸时等比缩小；JPEG输入直接以降分辨率解码，节省CPU和内存
+            The expanded canvas is scaled down proportionally when it exceeds this size; JPEG inputs are decoded at reduced resolution directly, saving CPU and memory
+            文件名中的宽高为实际输出尺寸
+            The width and height in the filename are the actual output dimensions
+        - incremental: 是否启用增量处理，默认为False / Whether to enable incremental processing, default is False
+            在输出目录中维护清单（.batch_manifest.jsonl），跳过未变化且参数相同的源文件
+            Maintains a manifest (.batch_manifest.jsonl) in the output directory and skips source files that are unchanged and were processed with the same parameters
+        - content_hash: 增量处理时是否额外比较内容哈希，默认为False / Whether incremental processing also compares content hashes, default is False
+        - prune_stale: 增量处理时是否删除过期输出，默认为False / Whether incremental processing deletes stale outputs, default is False
+        - recursive: 是否递归处理子目录，默认为False / Whether to process subdirectories recursively, default is False
+            输出目录中会镜像输入目录的子目录结构
+            The subdirectory structure of the input directory is mirrored in the output directory
+        - include: 包含的glob模式（字符串或列表），如 '*.jpg' 或 'trips/*'，默认为None表示全部 / Include glob patterns (string or list), e.g. '*.jpg' or 'trips/*', default is None meaning all
+        - exclude: 排除的glob模式（字符串或列表），如 '*_thumb*' / Exclude glob patterns (string or list), e.g. '*_thumb*'
+        - fill_mode: 填充模式，默认为'color' / Fill mode, default is 'color'
+            * 'color' - 用背景颜色填充/ Fill with the background color
+            * 'edge' - 复制原图边缘像素/ Replicate the edge pixels of the original
+            * 'blur' - 用放大并模糊的原图填充/ Fill with an enlarged and blurred copy of the original
+        - use_numpy: 是否使用NumPy画布路径，默认为False；'edge'和'blur'模式总是使用NumPy / Whether to use the NumPy canvas path, default is False; 'edge' and 'blur' always use NumPy
+            NumPy路径在每个进程中复用同尺寸的画布，并只对填充区域进行向量化写入，适合大批量同尺寸图片
+            The NumPy path reuses same-size canvases within each process and only writes the padding with vectorized writes, suited to large batches of same-size images
+        - verbosity: 输出详细程度，默认为'files' / Output verbosity, default is 'files'
+            * 'files' - 逐文件打印处理结果/ Print the result of every file
+            * 'progress' - 单行进度显示（吞吐量和预计剩余时间）加分阶段耗时汇总/ Single-line progress display (throughput and ETA) plus a per-stage time summary
+            * 'summary' - 只打印分阶段和按格式的耗时汇总/ Only print the per-stage and per-format time summary
+            * 'quiet' - 不打印逐文件信息/ Print nothing per file
+        - event_log: JSON-lines事件日志路径，记录每个文件的 open/decode/transform/encode/write 耗时，默认为None / JSON-lines event log path recording open/decode/transform/encode/write time of each file, default is None
+        - observers: 自定义观察者列表，每个事件调用一次 observer(event) / List of custom observers, observer(event) is called for every event
+        - prefetch: 流水线预读文件数，默认为0表示逐个读取、处理、写入 / Number of files prefetched by the pipeline, default is 0 meaning each file is read, processed and written in turn
+            大于0时后台线程预读原始字节并在后台写入编码结果，使网络存储的I/O延迟与解码/编码重叠
+            When greater than 0, background threads prefetch the raw bytes and write the encoded results, so network storage I/O latency overlaps with decoding/encoding
+        - encode_profile: 编码配置，默认为None表示Pillow默认设置 / Encode profile, default is None meaning Pillow defaults
+            * 'fast' - 编码最快，文件较大/ Fastest encoding, larger files
+            * 'balanced' - 编码时间与文件大小折中/ Trade-off between encode time and file size
+            * 'smallest' - 文件最小（JPEG渐进式+优化、PNG最高压缩、WebP method 6），编码最慢/ Smallest files (progressive optimized JPEG, maximum PNG compression, WebP method 6), slowest encoding
+            * 'lossless' - 无损WebP、最高压缩PNG、高质量JPEG/ Lossless WebP, maximum compression PNG, high quality JPEG
+        - target_file_size: 目标文件大小（字节），默认为None / Target file size (bytes), default is None
+            JPEG和WebP输出在内存中二分搜索不超过该大小的最高质量后才写入；其他格式忽略此参数
+            JPEG and WebP outputs binary-search in memory for the highest quality within this size before writing; other formats ignore it
+        - memory_budget: 单个文件的内存预算（字节），默认为None表示不限制 / Memory budget per file (bytes), default is None meaning unlimited
+            解码后超过预算的未压缩图片（未压缩TIFF、BMP）通过内存映射按行带流式读取，并直接写入未压缩TIFF（输出扩展名为.tiff），峰值内存由预算而不是图片尺寸决定
+            Uncompressed images (uncompressed TIFF, BMP) whose decoded size exceeds the budget are read in bands of rows through a memory map and written straight to an uncompressed TIFF (output extension .tiff), so peak memory is set by the budget rather than the image size
+            压缩格式无法分块读取：超过预算的JPEG按1/2、1/4或1/8缩小解码以放入预算（输出尺寸随之缩小），打印警告并在 file_done 事件和清单中记录 decode_scale；其他格式打印警告后完整解码，不受预算限制，且仍受Pillow解压炸弹检查保护
+            Compressed formats cannot be read in bands: a JPEG over the budget is decoded downscaled by 1/2, 1/4 or 1/8 to fit it (the output shrinks accordingly), with a printed warning and decode_scale recorded in the file_done event and the manifest; other formats are decoded in full after a printed warning, are not bounded by the budget and stay under Pillow's decompression-bomb check
+            流式处理的文件不支持 max_output_size 和 'blur' 填充；设置预算时不使用 prefetch 预读
+            Streamed files do not support max_output_size or the 'blur' fill; prefetch is not used when a budget is set
+        - deduplicate: 处理前检测重复图片使用的感知哈希，默认为None表示不检测 / Perceptual hash used to detect duplicate images before processing, default is None meaning no detection
+            * 'ahash' - 均值哈希，最快/ Average hash, fastest
+            * 'dhash' - 差值哈希/ Difference hash
+            * 'phash' - DCT哈希，对重新编码最稳定/ DCT hash, most robust to re-encoding
+            哈希在缩小的灰度代理图上计算并用BK树索引，重复组中只处理输入顺序中的第一张
+            Hashes are computed on a downscaled grayscale proxy and indexed in a BK-tree, only the first image of each duplicate group in input order is processed
+        - duplicate_distance: 视为近似重复的最大汉明距离（64位哈希），默认为None表示按算法取能容忍重新编码的默认值（ahash 2、dhash 6、phash 10），0表示哈希完全相同 / Maximum Hamming distance (64-bit hash) treated as a near-duplicate, default is None meaning the per-method default that tolerates re-encoding (ahash 2, dhash 6, phash 10), 0 means identical hashes
+        - duplicate_action: 重复文件的处理方式，默认为'skip' / How duplicates are handled, default is 'skip'
+            * 'skip' - 跳过，不生成输出/ Skip without output
+            * 'symlink' - 在输出目录中创建指向原图各输出（含尺寸阶梯）的符号链接/ Create symbolic links to each of the original's outputs (including the size ladder) in the output directory
+        - srcset_widths: 响应式尺寸阶梯的宽度列表，如 [1600, 800, 400]，默认为None表示只输出一个文件 / Widths of the responsive size ladder, e.g. [1600, 800, 400], default is None meaning a single output file
+            扩充后的图片只合成一次，从大到小逐级用Lanczos缩小，每一级编码为 srcset_formats 中的所有格式（output_format 不再使用）
+            The expanded image is composed once and downscaled step by step from largest to smallest with Lanczos, every step is encoded in all srcset_formats (output_format is not used)
+            各文件的尺寸、格式和字节数写入输出目录的 srcset.json，供网页生成 srcset；不能与 memory_budget 同时使用
+            The dimensions, format and byte size of every file are written to srcset.json in the output directory for building srcset in HTML; cannot be combined with memory_budget
+        - srcset_formats: 尺寸阶梯的输出格式，默认为('webp', 'jpeg') / Output formats of the size ladder, default is ('webp', 'jpeg')
+        - dry_run: 是否只生成计划，默认为False / Whether to only build a plan, default is False
+            只读取文件头和EXIF，计算每个输出的画布、粘贴位置、尺寸和文件名并打印，不解码像素也不写入任何文件
+            Only headers and EXIF are read to compute the canvas, paste position, size and filename of every output, which are printed without decoding pixels or writing any file
+        - plan_path: 计划JSON的保存路径，默认为None / Path to save the plan as JSON, default is None
+            设置时同样只生成计划，结果写入该文件而不是逐文件打印
+            When set only the plan is built as well, and it is written to this file instead of printed per file
+        - resume: 是否从上次中断或失败的运行继续，默认为False / Whether to continue an interrupted or failed run, default is False
+            每次运行都在输出目录的作业日志（.batch_manifest.jsonl）中记录完成和失败的文件及错误类型；继续时跳过已完成且未变化的文件，只处理失败和尚未处理的文件
+            Every run records done and failed files with their error class in the job journal (.batch_manifest.jsonl) in the output directory; resuming skips files that are done and unchanged and only processes failed and not yet processed files
+            输出文件先写入临时文件再原子重命名，中断的运行不会留下写了一半的输出
+            Outputs are written to a temporary file and atomically renamed, so an interrupted run never leaves a half-written output
+
+    返回
+    Returns
+        - 处理失败的文件列表，每项为 (相对路径, 错误信息) / List of failed files, each item is (relative path, error message)
         
     支持的格式
     Supported Formats
@@ -71,80 +156,33 @@ def fixed_ratio_expand(input_folder, output_folder, target_aspect_ratio, backgro
           * "TIFF" - 标记图像文件格式/ Tagged Image File Format
           * "WebP" - 现代图像格式/ Modern image format
     """
-    # 创建输出文件夹/Create output directory
-    os.makedirs(output_folder, exist_ok=True)
-
-    # 遍历输入文件夹中的所有文件/Iterate through all files in the input folder
-    for filename in os.listdir(input_folder):
-        # 检查是否为图片文件/Check if it's an image file
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')):
-            try:
-                # 打开图片/Open image
-                with Image.open(os.path.join(input_folder, filename)) as img:
-                    # 获取图片尺寸/Get image dimensions
-                    width, height = img.size
-                    current_ratio = width / height
-
-                    # 确定扩充后的尺寸/Determine expanded dimensions
-                    if current_ratio > target_aspect_ratio:
-                        # 原图更宽，扩充高度/Original image is wider, expand height
-                        new_width = width
-                        new_height = int(width / target_aspect_ratio)
-                        # 计算原图放置位置/Calculate position to place original image
-                        paste_y = (new_height - height) // 2
-                        paste_x = 0
-                    else:
-                        # 原图更高，扩充宽度/Original image is taller, expand width
-                        new_height = height
-                        new_width = int(height * target_aspect_ratio)
-                        # 计算原图放置位置/Calculate position to place original image
-                        paste_x = (new_width - width) // 2
-                        paste_y = 0
-
-                    # 判断图片模式以支持透明度/Determine image mode to support transparency
-                    if img.mode in ('RGBA', 'LA'):
-                        # 对于带透明度的图片，使用RGBA模式/For images with transparency, use RGBA mode
-                        expanded = Image.new('RGBA', (new_width, new_height), background_color + (255,))
-                    else:
-                        # 对于不透明图片，使用RGB模式/For opaque images, use RGB mode
-                        expanded = Image.new('RGB', (new_width, new_height), background_color)
-
-                    # 将原图粘贴到新画布中心/Paste the original image to the center of the new canvas
-                    expanded.paste(img, (paste_x, paste_y))
-                    
-                    # 处理输出文件名和格式/Process output filename and format
-                    original_name, original_ext = os.path.splitext(filename)
-                    
-                    # 如果未指定输出格式，则保持原格式/If output format is not specified, keep the original format
-                    if output_format is None:
-                        output_ext = original_ext
-                        final_output_format = img.format
-                    else:
-                        output_ext = f".{output_format.lower()}"
-                        # 确保格式名称与PIL兼容/Ensure format name is compatible with PIL
-                        if output_format.lower() == 'jpg':
-                            final_output_format = 'JPEG'
-                        else:
-                            final_output_format = output_format.upper()
-                    
-                    # 使用原始文件名_expand_{宽度}_{高度}格式命名/Use original_filename_expand_{width}_{height} format for naming
-                    output_filename = f"{original_name}_expand_{new_width}_{new_height}{output_ext}"
-                    output_path = os.path.join(output_folder, output_filename)
-                    
-                    # 转换图像模式以支持某些格式/Convert image mode to support certain formats
-                    if final_output_format == "JPEG":
-                        # JPEG不支持透明度，需要转换为RGB模式/JPEG doesn't support transparency, need to convert to RGB mode
-                        if expanded.mode in ('RGBA', 'LA', 'P'):
-                            expanded = expanded.convert('RGB')
-                    
-                    # 保存扩充后的图片/Save the expanded image
-                    expanded.save(output_path, format=final_output_format)
-                    print(f"已处理: {filename} -> 尺寸: {expanded.size}")
-                    print(f"Processed: {filename} -> Size: {expanded.size}")
-
-            except Exception as e:
-                print(f"处理失败: {filename} - {str(e)}")
-                print(f"Processing failed: {filename} - {str(e)}")
+    # 检查填充模式/Check fill mode
+    if fill_mode not in FILL_MODES:
+        raise ValueError(f"不支持的填充模式/Unsupported fill mode: {fill_mode}")
+    check_encode_options(encode_profile, target_file_size)
+    check_srcset_options(srcset_widths, srcset_formats, memory_budget)
+    if memory_budget is not None:
+        # 预读会把整个文件读入内存，与内存预算冲突/Prefetching reads whole files into memory, which defeats the memory budget
+        prefetch = 0
+
+    # 颜色只在开始前解析一次/Resolve the color only once up front
+    rgba_background_color = resolve_color(background_color)
+    task_parameters = (target_aspect_ratio, rgba_background_color, output_format, max_output_size, fill_mode, use_numpy, encode_profile, target_file_size, memory_budget, srcset_widths, srcset_formats)
+    if dry_run or plan_path is not None:
+        # 只读取文件头和EXIF生成计划/Build the plan from headers and EXIF only
+        return plan_folder(_plan_expand, task_parameters, input_folder, output_folder, workers, recursive, include, exclude, plan_path, verbosity)
+    failures, skipped_count, duplicate_count = process_folder(
+        _expand_image, task_parameters,
+        input_folder, output_folder,
+        {
+            'operation': 'expand',
+            'target_aspect_ratio': target_aspect_ratio, 'background_color': background_color,
+            'output_format': output_format, 'max_output_size': max_output_size, 'fill_mode': fill_mode,
+            'encode_profile': encode_profile, 'target_file_size': target_file_size, 'memory_budget': memory_budget,
+            'srcset_widths': srcset_widths, 'srcset_formats': srcset_formats,
+        },
+        workers, incremental, content_hash, prune_stale, recursive, include, exclude, verbosity, event_log, observers, prefetch,
+        deduplicate, duplicate_distance, duplicate_action, resume)
 
     # 最终提示/Final prompt
     print("\n处理完成")
@@ -157,23 +195,157 @@ def fixed_ratio_expand(input_folder, output_folder, target_aspect_ratio, backgro
     print(f"Target ratio: {target_aspect_ratio:.2f}")
     print(f"背景颜色: {background_color}")
     print(f"Background color: {background_color}")
+    if incremental or resume:
+        print(f"未变化已跳过: {skipped_count} 个文件")
+        print(f"Skipped unchanged: {skipped_count} files")
+    if deduplicate is not None:
+        print(f"重复已{'链接' if duplicate_action == 'symlink' else '跳过'}: {duplicate_count} 个文件")
+        print(f"Duplicates {'linked' if duplicate_action == 'symlink' else 'skipped'}: {duplicate_count} files")
+    if failures:
+        print(f"处理失败: {len(failures)} 个文件")
+        print(f"Processing failed: {len(failures)} files")
+    return failures
+
+
+def _expand_image(source, filename, target_aspect_ratio, background_color, output_format, max_output_size, fill_mode, use_numpy, encode_profile, target_file_size, memory_budget, srcset_widths, srcset_formats):
+    # 扩充单个文件并返回输出文件名、编码数据、尺寸、源格式和分阶段耗时，在工作进程中执行/Expand a single file and return the output filename, encoded data, size, source format and stage timings, runs in a worker process
+    timer = StageTimer()
+
+    # 打开图片（只读取文件头），source 可以是路径或预读的文件对象/Open image (reads only the header), source may be a path or a prefetched file object
+    with timer.stage('open'):
+        img, tiled, decode_scale = open_image(source, memory_budget)
+    with img:
+        # 获取EXIF方向校正后的尺寸并确定扩充后的尺寸/Get the orientation-corrected dimensions and determine expanded dimensions
+        orientation, (width, height), (new_width, new_height, paste_x, paste_y) = _expand_geometry(img, target_aspect_ratio)
+        if tiled:
+            return _tiled_expand(source, filename, img, (new_width, new_height), (paste_x, paste_y),
+                                 background_color, fill_mode, max_output_size, memory_budget, timer)
+
+        # 按最大输出尺寸缩放画布和原图，原图以尽量低的分辨率解码/Scale canvas and original to the maximum output size, decoding the original at the lowest sufficient resolution
+        with timer.stage('decode'):
+            output_width, output_height = fit_size((new_width, new_height), max_output_size)
+            if (output_width, output_height) != (new_width, new_height):
+                # 每个轴按适配后的画布单独缩放，并限制在画布内，取整不会让原图比画布大1像素
+                # Scale each axis by the fitted canvas and clamp to it, so rounding never leaves the original 1px larger than the canvas
+                scaled_size = (min(output_width, max(1, round(width * output_width / new_width))),
+                               min(output_height, max(1, round(height * output_height / new_height))))
+                new_width, new_height = output_width, output_height
+                paste_x = max(0, (new_width - scaled_size[0]) // 2)
+                paste_y = max(0, (new_height - scaled_size[1]) // 2)
+                source = load_oriented_region(img, orientation, (0, 0, width, height), scaled_size)
+            else:
+                img.load()
+                source = apply_orientation(img, orientation)
+
+        with timer.stage('transform'):
+            if use_numpy or fill_mode != 'color':
+                # NumPy路径按需导入，复用画布并向量化填充/Import the NumPy path on demand, reusing canvases and filling with vectorized writes
+                from batch_image_canvas import expand_array
+                expanded = expand_array(source, (new_width, new_height), (paste_x, paste_y), background_color, fill_mode, cache_key='expand')
+            else:
+                # 将原图粘贴到新画布中心/Paste the original image to the center of the new canvas
+                expanded = new_canvas(img.mode, (new_width, new_height), background_color)
+                expanded.paste(source, (paste_x, paste_y))
+
+        if srcset_widths is not None:
+            # 尺寸阶梯：从这一次合成的画布逐级缩小并编码所有格式/Size ladder: downscale step by step from this single composed canvas and encode every format
+            derivatives = encode_srcset(expanded, f"{os.path.splitext(filename)[0]}_expand", srcset_widths, srcset_formats, encode_profile, target_file_size, timer)
+            return derivatives[0][0], derivatives, derivatives[0][2], img.format, timer.seconds, decode_scale
+
+        with timer.stage('transform'):
+            # 处理输出文件名和格式/Process output filename and format
+            original_name, original_ext = os.path.splitext(filename)
+            output_ext, final_output_format = resolve_output_format(output_format, img.format, original_ext)
+            expanded = prepare_for_format(expanded, final_output_format)
+
+        # 编码扩充后的图片/Encode the expanded image
+        with timer.stage('encode'):
+            data = encode_image(expanded, final_output_format, encode_profile, target_file_size)
+
+    # 使用原始文件名_expand_{宽度}_{高度}格式命名，由调用方写入/Name with original_filename_expand_{width}_{height} format, the caller writes the data
+    output_filename = f"{original_name}_expand_{new_width}_{new_height}{output_ext}"
+    return output_filename, data, expanded.size, img.format, timer.seconds, decode_scale
+
+
+def _expand_geometry(img, target_aspect_ratio):
+    # 只读取文件头：返回 (EXIF方向, 校正后的尺寸, 扩充布局)，规划和实际处理共用/Header only: return (EXIF orientation, corrected size, expansion layout), shared by planning and the real run
+    orientation = exif_orientation(img)
+    size = oriented_size(img.size, orientation)
+    return orientation, size, expand_layout(size, target_aspect_ratio)
+
+
+def _plan_expand(source, filename, target_aspect_ratio, background_color, output_format, max_output_size, fill_mode, use_numpy, encode_profile, target_file_size, memory_budget, srcset_widths, srcset_formats):
+    # 只读取文件头和EXIF规划单个文件的扩充，在工作进程中执行/Plan the expansion of a single file from its header and EXIF only, runs in a worker process
+    img, tiled, decode_scale = open_image(source, memory_budget)
+    with img:
+        orientation, size, (new_width, new_height, paste_x, paste_y) = _expand_geometry(img, target_aspect_ratio)
+        original_name, original_ext = os.path.splitext(filename)
+        if tiled:
+            # 与正式处理相同的检查，计划中即可发现无法流式处理的文件/The same checks as the real run, so files that cannot be streamed show up in the plan
+            from batch_image_tiles import check_streamable
+            _check_tiled_options(max_output_size)
+            check_streamable(img)
+            outputs = plan_outputs(f"{original_name}_expand", (new_width, new_height), '.tiff', 'TIFF')
+        else:
+            output_ext, final_output_format = resolve_output_format(output_format, img.format, original_ext)
+            outputs = plan_outputs(f"{original_name}_expand", fit_size((new_width, new_height), max_output_size), output_ext, final_output_format, srcset_widths, srcset_formats)
+        return {
+            'format': img.format, 'size': list(size), 'orientation': orientation,
+            'canvas': [new_width, new_height], 'paste': [paste_x, paste_y], 'streamed': tiled, 'decode_scale': decode_scale, 'outputs': outputs,
+        }
+
+
+def _check_tiled_options(max_output_size):
+    # 流式处理只支持原尺寸输出/Streaming only supports full-size output
+    if max_output_size is not None:
+        raise ValueError("流式处理的文件不支持 max_output_size/max_output_size is not supported for streamed files")
+
+
+def _tiled_expand(source, filename, img, canvas_size, paste_position, background_color, fill_mode, max_output_size, memory_budget, timer):
+    # 超过内存预算的图片：返回按行带流式写入的数据对象，实际读写在写入阶段进行/Image over the memory budget: return a data object that streams in bands, the actual reading and writing happen in the write stage
+    _check_tiled_options(max_output_size)
+    from batch_image_tiles import TiledExpand
+    with timer.stage('transform'):
+        data = TiledExpand(source, img, canvas_size, paste_position, background_color, fill_mode, memory_budget)
+    output_filename = f"{os.path.splitext(filename)[0]}_expand_{canvas_size[0]}_{canvas_size[1]}.tiff"
+    return output_filename, data, canvas_size, img.format, timer.seconds, 1
 
 
 # 使用示例/Usage example
-# first
-fixed_ratio_expand(
-    input_folder="c:\\path\\to\\your\\gallery\\1",
-    output_folder="c:\\path\\to\\your\\gallery\\2",
-    target_aspect_ratio=4/3,
-    background_color='#2181A1'
-)
-# second
-fixed_ratio_expand(
-    input_folder='d:\\path\\to\\your\\favorite_img\\img',
-    output_folder='d:\\path\\to\\your\\favorite_img\\png',
-    target_aspect_ratio=9/16,
-    background_color=(0, 0, 0),
-    output_format='png'
-)
-# third
-fixed_ratio_expand('D:/path/to/your/mixed_img', 'D:/path/to/your/mixed_img/2JPEG', 1, 'white', 'JPEG')
+# 放在主模块保护下，避免导入或工作进程启动时执行/Guarded so that importing or starting worker processes does not run it
+if __name__ == "__main__":
+    # first
+    fixed_ratio_expand(
+        input_folder="c:\\path\\to\\your\\gallery\\1",
+        output_folder="c:\\path\\to\\your\\gallery\\2",
+        target_aspect_ratio=4/3,
+        background_color='#2181A1'
+    )
+    # second
+    fixed_ratio_expand(
+        input_folder='d:\\path\\to\\your\\favorite_img\\img',
+        output_folder='d:\\path\\to\\your\\favorite_img\\png',
+        target_aspect_ratio=9/16,
+        background_color=(0, 0, 0),
+        output_format='png'
+    )
+    # third
+    fixed_ratio_expand('D:/path/to/your/mixed_img', 'D:/path/to/your/mixed_img/2JPEG', 1, 'white', 'JPEG')
+    # fourth: 使用全部CPU核心并行处理/Process in parallel on all CPU cores
+    fixed_ratio_expand('D:/path/to/your/huge_gallery', 'D:/path/to/your/huge_gallery/4x3', 4/3, workers=None)
+    # fifth: 用模糊的原图填充/Fill with a blurred copy of the original
+    fixed_ratio_expand('D:/path/to/your/phone_shots', 'D:/path/to/your/phone_shots/16x9', 16/9, fill_mode='blur')
+    # sixth: 网络存储上预读和后台写入/Prefetch reads and write in the background on network storage
+    fixed_ratio_expand('//nas/photos/raw', '//nas/photos/square', 1, workers=None, prefetch=16)
+    # seventh: 网页用WebP，每张不超过200KB/WebP for the web, at most 200 KB each
+    fixed_ratio_expand('D:/path/to/your/blog', 'D:/path/to/your/blog/webp', 16/9, output_format='webp', encode_profile='smallest', target_file_size=200_000)
+    # eighth: 超大扫描件按行带流式处理，内存不超过512MB/Stream huge scans in bands within 512 MB of memory
+    fixed_ratio_expand('D:/path/to/your/scans', 'D:/path/to/your/scans/4x3', 4/3, memory_budget=512 * 2**20)
+    # ninth: 跳过重复图片/Skip duplicate images
+    fixed_ratio_expand('D:/path/to/your/messy_downloads', 'D:/path/to/your/messy_downloads/4x3', 4/3, deduplicate='dhash')
+    # tenth: 网站用的响应式尺寸阶梯，一次合成输出WebP和JPEG各三种宽度/Responsive size ladder for the website, three widths in WebP and JPEG from one composition
+    fixed_ratio_expand('D:/path/to/your/blog_posts', 'D:/path/to/your/blog_posts/srcset', 1, srcset_widths=[1200, 600, 300], srcset_formats=('webp', 'jpeg'))
+    # eleventh: 处理前只读取文件头打印计划/Print the plan from headers only before processing
+    fixed_ratio_expand('D:/path/to/your/phone_photos', 'D:/path/to/your/phone_photos/square', 1, dry_run=True)
+    # twelfth: 被中断的长时间运行从作业日志继续，只重试失败和未处理的文件/Continue an interrupted long run from the job journal, retrying only failed and unprocessed files
+    fixed_ratio_expand('D:/path/to/your/archive', 'D:/path/to/your/archive/4x3', 4/3, workers=None, resume=True)
@@ -0,0 +1,271 @@
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+# 单文件处理的各个阶段/Stages of single-file processing
+STAGES = ('read', 'open', 'decode', 'transform', 'encode', 'write')
+
+# 输出详细程度/Output verbosity levels
+VERBOSITY_LEVELS = ('files', 'progress', 'summary', 'quiet')
+
+
+class StageTimer:
+    """
+    分阶段计时器，在工作进程中使用，结果随处理结果一起返回主进程
+    Per-stage timer used in worker processes, the timings are returned to the main process together with the result
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+
+class BatchInstrumentation:
+    """
+    批处理插桩
+    Batch Instrumentation
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        用结构化事件代替每个文件两行的控制台输出，便于判断一次运行受限于解码、编码还是磁盘
+        Replace two console lines per file with structured events, so it is easy to tell whether a run is bound by decoding, encoding or disk
+
+    功能说明
+    Function Description
+        - 每个文件处理完成或失败时生成一个事件字典，依次交给所有观察者
+        - An event dict is produced when each file finishes or fails and is passed to every observer in turn
+        - 观察者为任意可调用对象 observer(event)，可以自行扩展
+        - Observers are any callables observer(event), so they can be extended freely
+        - 事件类型：batch_start、batch_total、file_done、file_failed、file_duplicate、batch_end
+        - Event types: batch_start, batch_total, file_done, file_failed, file_duplicate, batch_end
+        - 开始时总数可以未知，后台遍历完成后再通过 batch_total 事件给出
+        - The total may be unknown at the start and is given later by a batch_total event once the background walk finishes
+        - file_done 事件包含 open/decode/transform/encode/write 各阶段耗时，流水线模式下还包含预读的 read 耗时
+        - file_done events contain the time spent in the open/decode/transform/encode/write stages, plus the prefetch read time in pipelined mode
+        - file_done 事件的 decode_scale 为解码缩放倍数，JPEG因内存预算被缩小解码时为2、4或8，否则为1
+        - The decode_scale of a file_done event is 2, 4 or 8 when a JPEG was decoded downscaled to fit the memory budget, 1 otherwise
+        - batch_end 事件包含按阶段和按源格式汇总的耗时
+        - The batch_end event contains time totals per stage and per source format
+
+    参数
+    Parameters
+        - observers: 观察者列表 / List of observers
+    """
+
+    def __init__(self, observers=()):
+        self.observers = list(observers)
+        self.start_time = None
+        self.done_count = 0
+        self.failed_count = 0
+        self.duplicate_count = 0
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.format_stats = {}
+
+    def start(self, total=None):
+        self.start_time = time.perf_counter()
+        self._emit({'event': 'batch_start', 'total': total})
+
+    def set_total(self, total):
+        self._emit({'event': 'batch_total', 'total': total})
+
+    def file_done(self, relative_path, output_filename, output_size, source_format, stage_seconds, decode_scale=1):
+        self.done_count += 1
+        file_seconds = sum(stage_seconds.values())
+        for stage, seconds in stage_seconds.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        format_stats = self.format_stats.setdefault(source_format or 'unknown', {'files': 0, 'seconds': 0.0})
+        format_stats['files'] += 1
+        format_stats['seconds'] += file_seconds
+        self._emit({
+            'event': 'file_done', 'source': relative_path, 'output': output_filename,
+            'size': list(output_size), 'format': source_format, 'decode_scale': decode_scale,
+            'stages': {stage: round(seconds, 6) for stage, seconds in stage_seconds.items()},
+            'seconds': round(file_seconds, 6),
+        })
+
+    def file_failed(self, relative_path, error):
+        self.failed_count += 1
+        self._emit({'event': 'file_failed', 'source': relative_path, 'error_class': type(error).__name__, 'error': str(error)})
+
+    def file_duplicate(self, relative_path, original, link):
+        self.duplicate_count += 1
+        self._emit({'event': 'file_duplicate', 'source': relative_path, 'original': original, 'link': link})
+
+    def finish(self, skipped_count=0):
+        self._emit({
+            'event': 'batch_end', 'done': self.done_count, 'failed': self.failed_count, 'skipped': skipped_count,
+            'duplicates': self.duplicate_count,
+            'seconds': round(time.perf_counter() - self.start_time, 6),
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stage_seconds.items()},
+            'formats': {image_format: {'files': stats['files'], 'seconds': round(stats['seconds'], 6)}
+                        for image_format, stats in sorted(self.format_stats.items())},
+        })
+
+    def close(self):
+        """
+        关闭持有文件的观察者，批处理中途出错时也要调用
+        Close observers that hold files, must also be called when the batch stops on an error
+        """
+        for observer in self.observers:
+            close = getattr(observer, 'close', None)
+            if close is not None:
+                close()
+
+    def _emit(self, event):
+        event['time'] = round(time.time(), 3)
+        for observer in self.observers:
+            observer(event)
+
+
+class FilePrinter:
+    """
+    逐文件打印处理结果（原有的中英文输出）
+    Print the result of each file (the original bilingual output)
+    """
+
+    def __call__(self, event):
+        if event['event'] == 'file_done':
+            print(f"已处理: {event['source']} -> 尺寸: {tuple(event['size'])}")
+            print(f"Processed: {event['source']} -> Size: {tuple(event['size'])}")
+        elif event['event'] == 'file_failed':
+            print(f"处理失败: {event['source']} -> 错误: {event['error']}")
+            print(f"Failed: {event['source']} -> Error: {event['error']}")
+        elif event['event'] == 'file_duplicate':
+            print(f"重复: {event['source']} -> 原图: {event['original']}")
+            print(f"Duplicate: {event['source']} -> Original: {event['original']}")
+
+
+class JsonLinesLog:
+    """
+    将所有事件写入JSON-lines文件，文件在第一个事件时才打开
+    Write all events to a JSON-lines file, the file is only opened on the first event
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __call__(self, event):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(event, ensure_ascii=False) + '\n')
+        if event['event'] == 'batch_end':
+            self.close()
+        else:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProgressDisplay:
+    """
+    单行刷新的进度显示：已处理数、吞吐量，已知总数时显示预计剩余时间
+    Single-line progress display: processed count, throughput, and ETA when the total is known
+
+    参数
+    Parameters
+        - stream: 输出流，默认为标准错误 / Output stream, default is standard error
+        - interval: 最短刷新间隔（秒），避免控制台输出拖慢处理 / Minimum refresh interval (seconds), so console output does not slow processing down
+    """
+
+    def __init__(self, stream=None, interval=0.5):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.total = None
+        self.count = 0
+        self.failed = 0
+        self.start_time = None
+        self.last_refresh = 0.0
+
+    def __call__(self, event):
+        if event['event'] == 'batch_start':
+            self.total = event['total']
+            self.start_time = time.perf_counter()
+            return
+        if event['event'] == 'batch_total':
+            self.total = event['total']
+            return
+        if event['event'] == 'batch_end':
+            self._refresh(force=True)
+            self.stream.write('\n')
+            return
+        self.count += 1
+        self.failed += event['event'] == 'file_failed'
+        self._refresh()
+
+    def _refresh(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_refresh < self.interval:
+            return
+        self.last_refresh = now
+        elapsed = max(now - self.start_time, 1e-9)
+        rate = self.count / elapsed
+        line = f"已处理/Processed {self.count}"
+        if self.total:
+            line += f"/{self.total}"
+        line += f" | {rate:.1f} 图片/秒 images/s | 失败/failed {self.failed}"
+        if self.total and rate > 0:
+            remaining = (self.total - self.count) / rate
+            line += f" | 剩余/ETA {int(remaining // 60):02d}:{int(remaining % 60):02d}"
+        self.stream.write('\r' + line)
+        self.stream.flush()
+
+
+class SummaryPrinter:
+    """
+    批处理结束时打印按阶段和按源格式的耗时汇总
+    Print time totals per stage and per source format at the end of the batch
+    """
+
+    def __call__(self, event):
+        if event['event'] != 'batch_end':
+            return
+        total = sum(event['stages'].values()) or 1e-9
+        print("\n分阶段耗时/Time per stage:")
+        for stage, seconds in event['stages'].items():
+            print(f"  {stage:<10} {seconds:10.3f} s  {seconds / total:6.1%}")
+        print("按源格式/Per source format:")
+        for image_format, stats in event['formats'].items():
+            average = stats['seconds'] / stats['files'] * 1000
+            print(f"  {image_format:<10} {stats['files']:6d} 个文件/files  {stats['seconds']:10.3f} s  {average:8.1f} ms/file")
+        print(f"总耗时/Wall time: {event['seconds']:.3f} s, "
+              f"{event['done'] / max(event['seconds'], 1e-9):.1f} 图片/秒 images/s")
+
+
+def build_instrumentation(verbosity='files', event_log=None, observers=()):
+    """
+    按详细程度组装插桩，不打开任何文件，可在创建输出目录之前调用以校验参数
+    Assemble the instrumentation according to the verbosity, no file is opened so it can be called before the output directory is created to validate the arguments
+
+    参数
+    Parameters
+        - verbosity: 输出详细程度 / Output verbosity
+            * 'files' - 逐文件打印（默认，与以前相同）/ Print every file (default, same as before)
+            * 'progress' - 单行进度显示加阶段汇总 / Single-line progress display plus stage summary
+            * 'summary' - 只打印阶段汇总 / Only print the stage summary
+            * 'quiet' - 不打印逐文件信息 / Print nothing per file
+        - event_log: JSON-lines事件日志路径，默认为None表示不记录 / JSON-lines event log path, default is None meaning no log
+        - observers: 附加的自定义观察者 / Additional custom observers
+    """
+    if verbosity not in VERBOSITY_LEVELS:
+        raise ValueError(f"不支持的详细程度/Unsupported verbosity: {verbosity}")
+    built_in = {
+        'files': [FilePrinter()],
+        'progress': [ProgressDisplay(), SummaryPrinter()],
+        'summary': [SummaryPrinter()],
+        'quiet': [],
+    }[verbosity]
+    if event_log is not None:
+        built_in.append(JsonLinesLog(event_log))
+    return BatchInstrumentation(built_in + list(observers))
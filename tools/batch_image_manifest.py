@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+
+# 清单文件名，保存在输出文件夹中/Manifest filename, stored in the output folder
+MANIFEST_FILENAME = '.batch_manifest.jsonl'
+
+
+class BatchManifest:
+    """
+    增量处理清单与作业日志
+    Incremental Processing Manifest and Job Journal
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        重复运行批处理时只处理新增或变化的图片，使运行时间与变化量成正比，而不是与整个图库成正比
+        Only process new or changed images when a batch is re-run, so the run time is proportional to the change set rather than the whole gallery
+        长时间运行的批处理被中断后，可以从日志继续，只重试失败和尚未处理的文件
+        A long batch that was interrupted can continue from the journal, retrying only the failed and not yet processed files
+
+    功能说明
+    Function Description
+        - 清单为JSON-lines文件，每行记录一个源文件：相对路径、大小、修改时间、可选的内容哈希、处理参数和输出文件名
+        - The manifest is a JSON-lines file, each line records one source file: relative path, size, mtime, optional content hash, processing parameters and output filename
+        - 源文件大小和修改时间未变、处理参数相同且输出文件仍存在时跳过该文件
+        - A file is skipped when its size and mtime are unchanged, the parameters are the same and the output file still exists
+        - 启用内容哈希时，修改时间变化但内容相同的文件（如被复制或touch）也会被跳过
+        - With content hashing enabled, files whose mtime changed but content did not (e.g. copied or touched) are skipped as well
+        - 每处理完一个文件立即追加一行，中途中断也不会丢失已完成的记录
+        - A line is appended as soon as each file is done, so completed records survive an interrupted run
+        - 处理失败的文件记录为 status='failed'，包含错误类型和错误信息，这样的记录永远不算作未变化
+        - Failed files are recorded with status='failed', the error class and the error message, and such records never count as unchanged
+        - 可选删除过期输出：源文件已不存在，或同一源文件以不同参数重新生成后留下的旧输出
+        - Stale outputs can optionally be pruned: outputs whose source no longer exists, or older outputs left behind after a source was regenerated with different parameters
+
+    参数
+    Parameters
+        - output_folder: 输出目录 / Output directory
+        - parameters: 处理参数字典，任何参数变化都会使已有记录失效 / Dict of processing parameters, any change invalidates existing records
+        - content_hash: 是否计算内容哈希，默认为False / Whether to compute content hashes, default is False
+    """
+
+    def __init__(self, output_folder, parameters, content_hash=False):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_FILENAME)
+        self.parameters = json.dumps(parameters, sort_keys=True)
+        self.content_hash = content_hash
+        self.skipped_count = 0
+        self.entries = {}
+        self.stale_outputs = set()
+        self.seen_sources = set()
+
+        # 读取已有清单，同一源文件以最后一行为准/Load the existing manifest, the last line wins for the same source
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 忽略中断时写了一半的行/Ignore a line half-written by an interrupted run
+                        continue
+                    self._replace(entry)
+        self._append_file = open(self.path, 'a', encoding='utf-8')
+
+    def is_current(self, relative_path, source_path):
+        """
+        判断源文件是否已按相同参数处理过且未变化，记录的所有输出（包括尺寸阶梯）都必须仍然存在
+        Check whether the source file was already processed with the same parameters and is unchanged, every recorded output (including the size ladder) must still exist
+        """
+        self.seen_sources.add(relative_path)
+        entry = self.entries.get(relative_path)
+        if (entry is None or entry.get('status') == 'failed' or entry['parameters'] != self.parameters
+                or not all(os.path.exists(os.path.join(self.output_folder, output)) for output in _entry_outputs(entry))):
+            return False
+
+        stat = os.stat(source_path)
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            self.skipped_count += 1
+            return True
+        # 修改时间变化时用内容哈希确认/Confirm with the content hash when the mtime changed
+        if (self.content_hash and entry.get('hash') and entry['size'] == stat.st_size
+                and entry['hash'] == _file_hash(source_path)):
+            self.record(relative_path, source_path, entry['output'], entry.get('derivatives'), entry.get('decode_scale', 1))
+            self.skipped_count += 1
+            return True
+        return False
+
+    def record(self, relative_path, source_path, output_filename, derivatives=None, decode_scale=1):
+        """
+        记录一个已成功处理的源文件
+        Record a successfully processed source file
+
+        derivatives 为尺寸阶梯的所有输出文件名，清理过期输出时一并处理
+        derivatives lists every output filename of a size ladder, they are pruned together with the output
+        decode_scale 大于1表示源文件因内存预算被缩小解码，记录在条目中
+        A decode_scale above 1 means the source was decoded downscaled because of the memory budget, it is kept in the entry
+        """
+        stat = os.stat(source_path)
+        entry = {
+            'source': relative_path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': _file_hash(source_path) if self.content_hash else None,
+            'parameters': self.parameters,
+            'status': 'done',
+            'output': output_filename,
+        }
+        if derivatives:
+            entry['derivatives'] = derivatives
+        if decode_scale != 1:
+            entry['decode_scale'] = decode_scale
+        self._append(entry)
+
+    def record_failure(self, relative_path, source_path, error):
+        """
+        记录一个处理失败的源文件及其错误类型
+        Record a source file that failed to process, with its error class
+
+        保留上一次成功记录的输出文件名，失败不会让旧输出脱离清理范围
+        The output filenames of the previous successful record are kept, so a failure never puts old outputs out of reach of pruning
+        """
+        previous = self.entries.get(relative_path, {})
+        entry = {
+            'source': relative_path,
+            'size': None,
+            'mtime_ns': None,
+            'hash': None,
+            'parameters': self.parameters,
+            'status': 'failed',
+            'error_class': type(error).__name__,
+            'error': str(error),
+        }
+        if os.path.exists(source_path):
+            stat = os.stat(source_path)
+            entry['size'], entry['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+        for key in ('output', 'derivatives'):
+            if key in previous:
+                entry[key] = previous[key]
+        self._append(entry)
+
+    def failed_sources(self):
+        """
+        返回日志中最近一次处理失败的源文件相对路径列表
+        Return the relative paths of the source files whose latest record in the journal is a failure
+        """
+        return sorted(relative_path for relative_path, entry in self.entries.items() if entry.get('status') == 'failed')
+
+    def prune(self):
+        """
+        删除过期输出并返回被删除的输出文件名列表，本次运行中未经过 is_current 检查的源文件视为已删除
+        Delete stale outputs and return the list of deleted output filenames, sources not checked by is_current in this run are treated as removed
+        """
+        for relative_path in list(self.entries):
+            if relative_path not in self.seen_sources:
+                self.stale_outputs.update(_entry_outputs(self.entries.pop(relative_path)))
+        # 仍被当前记录引用的输出不能删除/Outputs still referenced by a current record must be kept
+        self.stale_outputs -= {output for entry in self.entries.values() for output in _entry_outputs(entry)}
+
+        removed = []
+        for output_filename in sorted(self.stale_outputs):
+            output_path = os.path.join(self.output_folder, output_filename)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+                removed.append(output_filename)
+        self.stale_outputs.clear()
+        return removed
+
+    def close(self):
+        """
+        压缩清单为每个源文件一行并关闭
+        Compact the manifest to one line per source file and close it
+        """
+        self._append_file.close()
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as manifest_file:
+            for relative_path in sorted(self.entries):
+                manifest_file.write(json.dumps(self.entries[relative_path], ensure_ascii=False) + '\n')
+        os.replace(temporary_path, self.path)
+
+    def _append(self, entry):
+        # 更新内存中的记录并立即追加到文件/Update the in-memory record and append it to the file immediately
+        self._replace(entry)
+        self._append_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._append_file.flush()
+
+    def _replace(self, entry):
+        # 同一源文件的旧输出名不同时标记为过期/Mark the previous outputs of the same source as stale when their names differ
+        previous = self.entries.get(entry['source'])
+        if previous is not None:
+            self.stale_outputs.update(set(_entry_outputs(previous)) - set(_entry_outputs(entry)))
+        self.entries[entry['source']] = entry
+
+
+def _entry_outputs(entry):
+    # 条目的所有输出文件名，包括尺寸阶梯/All output filenames of an entry, including the size ladder
+    # 从未成功过的失败记录没有输出/A failure record that never succeeded has no output
+    return ([entry['output']] if 'output' in entry else []) + entry.get('derivatives', [])
+
+
+def _file_hash(path):
+    # 分块计算BLAKE2b内容哈希/Compute the BLAKE2b content hash in chunks
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,382 @@
+from PIL import Image
+import argparse
+import os
+
+from batch_image_common import ANCHOR_MODES, ENCODE_PROFILES, FILL_MODES, apply_orientation, check_encode_options, check_srcset_options, center_crop_box, encode_image, encode_srcset, exif_orientation, expand_layout, fit_size, new_canvas, oriented_size, plan_folder, plan_outputs, prepare_for_format, process_folder, resolve_color, resolve_output_format
+from batch_image_dedup import DUPLICATE_ACTIONS, HASH_METHODS
+from batch_image_instrumentation import VERBOSITY_LEVELS, StageTimer
+
+
+class CropStage:
+    """
+    裁剪阶段：与 fixed_ratio_crop 使用相同的裁剪框计算和锚点模式
+    Crop stage: uses the same crop box calculation and anchor modes as fixed_ratio_crop
+    """
+    name = 'crop'
+
+    def __init__(self, crop_aspect_ratio=None, anchor='center'):
+        if anchor not in ANCHOR_MODES:
+            raise ValueError(f"不支持的裁剪锚点/Unsupported crop anchor: {anchor}")
+        self.crop_aspect_ratio = crop_aspect_ratio
+        self.anchor = anchor
+
+    def __call__(self, image):
+        crop_box = center_crop_box(image.size, self.crop_aspect_ratio)
+        if self.anchor == 'energy' and crop_box != (0, 0) + image.size:
+            # NumPy路径按需导入/Import the NumPy path on demand
+            from batch_image_saliency import EnergyMap
+            crop_box, _ = EnergyMap(image).best_box(crop_box[2] - crop_box[0], crop_box[3] - crop_box[1])
+        return image.crop(crop_box)
+
+    def output_size(self, size):
+        # 只根据尺寸计算输出尺寸，用于规划/Output size computed from the size alone, used for planning
+        crop_box = center_crop_box(size, self.crop_aspect_ratio)
+        return crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+
+    def describe(self):
+        return {'stage': self.name, 'crop_aspect_ratio': self.crop_aspect_ratio, 'anchor': self.anchor}
+
+
+class ExpandStage:
+    """
+    向外扩充阶段：与 fixed_ratio_expand 使用相同的画布计算
+    Outward expansion stage: uses the same canvas calculation as fixed_ratio_expand
+    """
+    name = 'expand'
+
+    def __init__(self, target_aspect_ratio, background_color=(255, 255, 255), fill_mode='color'):
+        if fill_mode not in FILL_MODES:
+            raise ValueError(f"不支持的填充模式/Unsupported fill mode: {fill_mode}")
+        self.target_aspect_ratio = target_aspect_ratio
+        self.background_color = resolve_color(background_color)
+        self.fill_mode = fill_mode
+
+    def __call__(self, image):
+        new_width, new_height, paste_x, paste_y = expand_layout(image.size, self.target_aspect_ratio)
+        if self.fill_mode != 'color':
+            # NumPy路径按需导入/Import the NumPy path on demand
+            from batch_image_canvas import expand_array
+            # 每个阶段使用自己的画布，同尺寸的另一个扩充阶段不会覆盖本阶段的结果/Each stage uses its own canvas, so another expand stage of the same size never overwrites this stage's result
+            return expand_array(image, (new_width, new_height), (paste_x, paste_y), self.background_color, self.fill_mode, cache_key=self)
+        expanded = new_canvas(image.mode, (new_width, new_height), self.background_color)
+        expanded.paste(image, (paste_x, paste_y))
+        return expanded
+
+    def output_size(self, size):
+        return expand_layout(size, self.target_aspect_ratio)[:2]
+
+    def describe(self):
+        return {'stage': self.name, 'target_aspect_ratio': self.target_aspect_ratio,
+                'background_color': self.background_color, 'fill_mode': self.fill_mode}
+
+
+class ResizeStage:
+    """
+    缩小阶段：等比缩小到不超过最大尺寸（不会放大）
+    Downscale stage: scale down proportionally to fit the maximum size (never enlarges)
+    """
+    name = 'resize'
+
+    def __init__(self, max_output_size):
+        self.max_output_size = max_output_size
+
+    def __call__(self, image):
+        output_size = fit_size(image.size, self.max_output_size)
+        if output_size == image.size:
+            return image
+        return image.resize(output_size, Image.Resampling.LANCZOS)
+
+    def output_size(self, size):
+        return fit_size(size, self.max_output_size)
+
+    def describe(self):
+        return {'stage': self.name, 'max_output_size': self.max_output_size}
+
+
+class ConvertStage:
+    """
+    颜色模式转换阶段，如 'RGB'、'L'
+    Color mode conversion stage, e.g. 'RGB', 'L'
+    """
+    name = 'convert'
+
+    def __init__(self, mode):
+        self.mode = mode
+
+    def __call__(self, image):
+        return image if image.mode == self.mode else image.convert(self.mode)
+
+    def output_size(self, size):
+        return tuple(size)
+
+    def describe(self):
+        return {'stage': self.name, 'mode': self.mode}
+
+
+def fixed_ratio_pipeline(input_folder, output_folder, stages, output_format=None, workers=1, incremental=False, content_hash=False, prune_stale=False, recursive=False, include=None, exclude=None, verbosity='files', event_log=None, observers=(), prefetch=0, encode_profile=None, target_file_size=None, deduplicate=None, duplicate_distance=None, duplicate_action='skip', srcset_widths=None, srcset_formats=('webp', 'jpeg'), dry_run=False, plan_path=None, resume=False):
+    """
+    批量图像组合处理管线
+    Batch Image Composable Pipeline
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        将裁剪、扩充、缩小和格式转换串联为一次处理：每个文件只解码一次、编码一次
+        Chain cropping, expansion, downscaling and format conversion into one pass: each file is decoded once and encoded once
+        避免依次运行多个工具时多次解码/编码的开销，以及JPEG每次重新编码带来的画质损失
+        Avoids the repeated decode/encode cost of running several tools one after another, and the JPEG generation loss of re-encoding at every hop
+
+    功能说明
+    Function Description
+        - 各阶段在内存中的已解码图片上按顺序执行
+        - Stages run in order on the decoded image in memory
+        - 可用阶段：CropStage、ExpandStage、ResizeStage、ConvertStage
+        - Available stages: CropStage, ExpandStage, ResizeStage, ConvertStage
+        - 最后按 output_format 一次编码保存
+        - Finally the result is encoded and saved once according to output_format
+        - 第一个阶段之前先按EXIF方向校正图片
+        - The image is corrected for its EXIF orientation before the first stage
+
+    输出文件命名规则
+    Output File Naming Rules
+        输出文件命名格式：原始文件名_{各阶段名称}_{宽度}_{高度}.输出格式
+        Output file naming format: original_filename_{stage names}_{width}_{height}.output_format
+        示例："image_crop_expand_800_600.jpg"
+        Example: "image_crop_expand_800_600.jpg"
+
+    参数
+    Parameters
+        - input_folder: 输入图片目录 / Input image directory
+        - output_folder: 输出目录 / Output directory
+        - stages: 阶段列表，按顺序执行 / List of stages, executed in order
+        - output_format: 输出图片格式，默认为None表示保持原格式 / Output image format, default is None which means keeping the original format
+        - prefetch: 流水线预读文件数，默认为0表示不使用流水线 / Number of files prefetched by the pipeline, default is 0 meaning no pipeline
+        - encode_profile, target_file_size: 编码配置和目标文件大小，见 fixed_ratio_expand / Encode profile and target file size, see fixed_ratio_expand
+        - deduplicate, duplicate_distance, duplicate_action: 重复检测，见 fixed_ratio_expand / Duplicate detection, see fixed_ratio_expand
+        - srcset_widths, srcset_formats: 响应式尺寸阶梯，在所有阶段之后生成，见 fixed_ratio_expand / Responsive size ladder, built after all stages, see fixed_ratio_expand
+        - dry_run, plan_path: 只读取文件头和EXIF生成计划，见 fixed_ratio_expand；各阶段需提供 output_size 方法 / Build a plan from headers and EXIF only, see fixed_ratio_expand; every stage needs an output_size method
+        - resume: 是否从上次中断或失败的运行继续，见 fixed_ratio_expand / Whether to continue an interrupted or failed run, see fixed_ratio_expand
+        - 其余参数与 fixed_ratio_expand / fixed_ratio_crop 相同 / Other parameters are the same as fixed_ratio_expand / fixed_ratio_crop
+
+    返回
+    Returns
+        - 处理失败的文件列表，每项为 (相对路径, 错误信息) / List of failed files, each item is (relative path, error message)
+    """
+    check_encode_options(encode_profile, target_file_size)
+    check_srcset_options(srcset_widths, srcset_formats)
+    task_parameters = (stages, output_format, encode_profile, target_file_size, srcset_widths, srcset_formats)
+    if dry_run or plan_path is not None:
+        # 只读取文件头和EXIF生成计划/Build the plan from headers and EXIF only
+        return plan_folder(_plan_pipeline, task_parameters, input_folder, output_folder, workers, recursive, include, exclude, plan_path, verbosity)
+    failures, skipped_count, duplicate_count = process_folder(
+        _pipeline_image, task_parameters,
+        input_folder, output_folder,
+        {
+            'operation': 'pipeline',
+            'stages': [stage.describe() for stage in stages], 'output_format': output_format,
+            'encode_profile': encode_profile, 'target_file_size': target_file_size,
+            'srcset_widths': srcset_widths, 'srcset_formats': srcset_formats,
+        },
+        workers, incremental, content_hash, prune_stale, recursive, include, exclude, verbosity, event_log, observers, prefetch,
+        deduplicate, duplicate_distance, duplicate_action, resume)
+
+    # 最终提示/Final prompt
+    print("\n处理完成")
+    print("Processing completed")
+    print(f"输入目录: {input_folder}")
+    print(f"Input directory: {input_folder}")
+    print(f"输出目录: {output_folder}")
+    print(f"Output directory: {output_folder}")
+    print(f"处理阶段: {' -> '.join(stage.name for stage in stages)}")
+    print(f"Stages: {' -> '.join(stage.name for stage in stages)}")
+    if incremental or resume:
+        print(f"未变化已跳过: {skipped_count} 个文件")
+        print(f"Skipped unchanged: {skipped_count} files")
+    if deduplicate is not None:
+        print(f"重复已{'链接' if duplicate_action == 'symlink' else '跳过'}: {duplicate_count} 个文件")
+        print(f"Duplicates {'linked' if duplicate_action == 'symlink' else 'skipped'}: {duplicate_count} files")
+    if failures:
+        print(f"处理失败: {len(failures)} 个文件")
+        print(f"Processing failed: {len(failures)} files")
+    return failures
+
+
+def _pipeline_image(source, filename, stages, output_format, encode_profile, target_file_size, srcset_widths, srcset_formats):
+    # 对单个文件执行全部阶段并返回输出文件名、编码数据、尺寸、源格式和分阶段耗时，在工作进程中执行/Run all stages on a single file and return the output filename, encoded data, size, source format and stage timings, runs in a worker process
+    timer = StageTimer()
+
+    # 打开图片（只读取文件头），source 可以是路径或预读的文件对象/Open image (reads only the header), source may be a path or a prefetched file object
+    with timer.stage('open'):
+        img = Image.open(source)
+    with img:
+        with timer.stage('decode'):
+            img.load()
+
+        # 先按EXIF方向校正，再依次执行各阶段/Correct the EXIF orientation first, then run the stages in order
+        with timer.stage('transform'):
+            image = apply_orientation(img, exif_orientation(img))
+            for stage in stages:
+                image = stage(image)
+
+        if srcset_widths is not None:
+            # 尺寸阶梯：从各阶段的结果逐级缩小并编码所有格式/Size ladder: downscale step by step from the result of the stages and encode every format
+            stage_names = '_'.join(stage.name for stage in stages)
+            derivatives = encode_srcset(image, f"{os.path.splitext(filename)[0]}_{stage_names}", srcset_widths, srcset_formats, encode_profile, target_file_size, timer)
+            return derivatives[0][0], derivatives, derivatives[0][2], img.format, timer.seconds, 1
+
+        with timer.stage('transform'):
+            # 处理输出文件名和格式/Process output filename and format
+            original_name, original_ext = os.path.splitext(filename)
+            output_ext, final_output_format = resolve_output_format(output_format, img.format, original_ext)
+            image = prepare_for_format(image, final_output_format)
+
+        # 一次编码/Encode once
+        with timer.stage('encode'):
+            data = encode_image(image, final_output_format, encode_profile, target_file_size)
+
+    stage_names = '_'.join(stage.name for stage in stages)
+    output_filename = f"{original_name}_{stage_names}_{image.width}_{image.height}{output_ext}"
+    return output_filename, data, image.size, img.format, timer.seconds, 1
+
+
+def _plan_pipeline(source, filename, stages, output_format, encode_profile, target_file_size, srcset_widths, srcset_formats):
+    # 只读取文件头和EXIF，按各阶段的 output_size 规划单个文件，在工作进程中执行/Plan a single file from its header and EXIF only through each stage's output_size, runs in a worker process
+    with Image.open(source) as img:
+        orientation = exif_orientation(img)
+        size = oriented_size(img.size, orientation)
+        output_size = size
+        for stage in stages:
+            output_size = stage.output_size(output_size)
+        original_name, original_ext = os.path.splitext(filename)
+        output_ext, final_output_format = resolve_output_format(output_format, img.format, original_ext)
+        stage_names = '_'.join(stage.name for stage in stages)
+        outputs = plan_outputs(f"{original_name}_{stage_names}", output_size, output_ext, final_output_format, srcset_widths, srcset_formats)
+        return {'format': img.format, 'size': list(size), 'orientation': orientation, 'outputs': outputs}
+
+
+def parse_ratio(text):
+    """
+    解析宽高比文本，支持 '4/3'、'16:9' 和 '1.5'
+    Parse aspect ratio text, supporting '4/3', '16:9' and '1.5'
+    """
+    for separator in ('/', ':'):
+        if separator in text:
+            numerator, denominator = text.split(separator, 1)
+            return float(numerator) / float(denominator)
+    return float(text)
+
+
+def parse_file_size(text):
+    """
+    解析文件大小文本，支持 '200000'、'200k'、'1.5M'
+    Parse file size text, supporting '200000', '200k' and '1.5M'
+    """
+    units = {'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+    text = text.strip().lower().rstrip('b')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_widths(text):
+    """
+    解析逗号分隔的宽度列表，如 '1600,800,400'
+    Parse a comma-separated list of widths, e.g. '1600,800,400'
+    """
+    return [int(width) for width in text.split(',') if width.strip()]
+
+
+def parse_names(text):
+    """
+    解析逗号分隔的名称列表，如 'webp,jpeg'
+    Parse a comma-separated list of names, e.g. 'webp,jpeg'
+    """
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+def parse_size(text):
+    """
+    解析尺寸文本，如 '1920x1080'
+    Parse size text, e.g. '1920x1080'
+    """
+    width, height = text.lower().split('x', 1)
+    return int(width), int(height)
+
+
+class _AppendStage(argparse.Action):
+    # 将各阶段参数按命令行中的顺序记录/Record stage options in command-line order
+    def __call__(self, parser, namespace, values, option_string=None):
+        stages = getattr(namespace, 'stages', None) or []
+        stages.append((self.dest, values))
+        namespace.stages = stages
+
+
+def main(argv=None, prog=None):
+    """
+    命令行入口：按命令行中的顺序组合各阶段
+    Command-line entry: stages are chained in the order given on the command line
+
+    prog 为用法信息中显示的程序名，默认为脚本文件名；mine-img 传入 'mine-img pipeline'
+    prog is the program name shown in the usage message, the script filename by default; mine-img passes 'mine-img pipeline'
+
+    示例/Examples
+        python batch_image_pipeline.py D:/photos/in D:/photos/out --crop 4/3 --expand 1 --background "#2181A1" --format webp
+        python batch_image_pipeline.py D:/photos/in D:/photos/out --crop 16:9 --resize 1920x1080 --format jpg --workers 8
+        python batch_image_pipeline.py D:/photos/in D:/photos/web --resize 1600x1600 --format webp --profile smallest --target-size 200k
+        python batch_image_pipeline.py D:/photos/in D:/photos/site --crop 16:9 --srcset 1600,800,400 --srcset-formats webp,jpeg
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="批量图像组合处理管线/Batch image composable pipeline")
+    parser.add_argument('input_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--crop', type=parse_ratio, action=_AppendStage, help="居中裁剪到宽高比/Center crop to aspect ratio, e.g. 4/3")
+    parser.add_argument('--expand', type=parse_ratio, action=_AppendStage, help="向外扩充到宽高比/Expand outward to aspect ratio, e.g. 1")
+    parser.add_argument('--resize', type=parse_size, action=_AppendStage, help="缩小到最大尺寸/Downscale to maximum size, e.g. 1920x1080")
+    parser.add_argument('--mode', action=_AppendStage, help="转换颜色模式/Convert color mode, e.g. RGB")
+    parser.add_argument('--anchor', default='center', choices=ANCHOR_MODES, help="裁剪锚点/Crop anchor")
+    parser.add_argument('--background', default='white', help="扩充背景颜色/Expansion background color")
+    parser.add_argument('--fill', default='color', choices=FILL_MODES, help="扩充填充模式/Expansion fill mode")
+    parser.add_argument('--format', dest='output_format', help="输出格式/Output format")
+    parser.add_argument('--workers', type=int, default=1, help="进程数，0表示全部CPU核心/Number of processes, 0 means all CPU cores")
+    parser.add_argument('--profile', choices=sorted(ENCODE_PROFILES), help="编码配置/Encode profile")
+    parser.add_argument('--target-size', type=parse_file_size, help="目标文件大小，如 200k/Target file size, e.g. 200k")
+    parser.add_argument('--dedup', choices=HASH_METHODS, help="处理前检测重复图片/Detect duplicate images before processing")
+    parser.add_argument('--dedup-distance', type=int, help="视为重复的最大汉明距离，默认按算法容忍重新编码：ahash 2、dhash 6、phash 10/Maximum Hamming distance treated as a duplicate, by default tolerant of re-encoding per method: ahash 2, dhash 6, phash 10")
+    parser.add_argument('--dedup-action', default='skip', choices=DUPLICATE_ACTIONS, help="重复文件的处理方式/How duplicates are handled")
+    parser.add_argument('--srcset', type=parse_widths, help="响应式尺寸阶梯的宽度，如 1600,800,400/Responsive size ladder widths, e.g. 1600,800,400")
+    parser.add_argument('--srcset-formats', type=parse_names, default=['webp', 'jpeg'], help="尺寸阶梯的输出格式/Size ladder output formats, e.g. webp,jpeg")
+    parser.add_argument('--prefetch', type=int, default=0, help="流水线预读文件数，0表示不使用流水线/Number of files prefetched by the pipeline, 0 disables it")
+    parser.add_argument('--recursive', action='store_true', help="递归处理子目录/Process subdirectories recursively")
+    parser.add_argument('--include', action='append', help="只处理文件名或相对路径匹配的文件，可重复，如 '*.jpg'/Only process files whose name or relative path matches, repeatable, e.g. '*.jpg'")
+    parser.add_argument('--exclude', action='append', help="跳过文件名或相对路径匹配的文件，可重复，如 'drafts/*'/Skip files whose name or relative path matches, repeatable, e.g. 'drafts/*'")
+    parser.add_argument('--incremental', action='store_true', help="跳过清单中记录为未变化的文件/Skip files the manifest records as unchanged")
+    parser.add_argument('--content-hash', action='store_true', help="修改时间变化时按内容哈希判断文件是否变化/Use a content hash to decide whether a file changed when its mtime did")
+    parser.add_argument('--prune-stale', action='store_true', help="增量处理时删除源文件已不存在或已重新生成的过期输出/With incremental processing, delete stale outputs whose source is gone or was regenerated")
+    parser.add_argument('--resume', action='store_true', help="从作业日志继续，只重试失败和未处理的文件/Continue from the job journal, retrying only failed and unprocessed files")
+    parser.add_argument('--verbosity', default='files', choices=VERBOSITY_LEVELS, help="输出详细程度/Output verbosity")
+    parser.add_argument('--event-log', help="JSON-lines事件日志路径/JSON-lines event log path")
+    parser.add_argument('--dry-run', action='store_true', help="只读取文件头打印计划/Only read headers and print the plan")
+    parser.add_argument('--plan', dest='plan_path', help="只读取文件头并将计划写入JSON/Only read headers and write the plan to JSON")
+    arguments = parser.parse_args(argv)
+
+    stage_types = {
+        'crop': lambda ratio: CropStage(ratio, arguments.anchor),
+        'expand': lambda ratio: ExpandStage(ratio, arguments.background, arguments.fill),
+        'resize': ResizeStage,
+        'mode': ConvertStage,
+    }
+    stages = [stage_types[kind](value) for kind, value in getattr(arguments, 'stages', None) or []]
+    if not stages:
+        parser.error("至少需要一个阶段/At least one stage is required: --crop, --expand, --resize or --mode")
+
+    failures = fixed_ratio_pipeline(
+        arguments.input_folder, arguments.output_folder, stages, arguments.output_format,
+        arguments.workers or None, arguments.incremental, arguments.content_hash, arguments.prune_stale,
+        arguments.recursive, arguments.include, arguments.exclude, arguments.verbosity, arguments.event_log,
+        prefetch=arguments.prefetch, encode_profile=arguments.profile, target_file_size=arguments.target_size,
+        deduplicate=arguments.dedup, duplicate_distance=arguments.dedup_distance, duplicate_action=arguments.dedup_action,
+        srcset_widths=arguments.srcset, srcset_formats=arguments.srcset_formats,
+        dry_run=arguments.dry_run, plan_path=arguments.plan_path, resume=arguments.resume)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
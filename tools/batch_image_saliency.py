@@ -0,0 +1,121 @@
+from PIL import Image
+from io import BytesIO
+import numpy as np
+
+from batch_image_common import apply_orientation, exif_orientation, oriented_size
+
+# 能量图代理图像的最大边长/Maximum side length of the energy map proxy image
+PROXY_SIDE_PIXEL = 256
+
+
+class EnergyMap:
+    """
+    基于梯度能量的裁剪锚点
+    Gradient-Energy Crop Anchor
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        居中裁剪会切掉偏离中心的主体，需要再手动修正一遍
+        Centered crops cut off off-center subjects, which then need a second manual pass
+        在缩小的灰度代理图上找出保留能量（细节）最多的裁剪窗口
+        Find the crop window that keeps the most energy (detail) on a downscaled grayscale proxy
+
+    功能说明
+    Function Description
+        - 代理图最大边长为 proxy_side_pixel，JPEG直接以降分辨率解码
+        - The proxy's longest side is proxy_side_pixel, JPEG inputs are decoded at reduced resolution directly
+        - 能量为相邻像素灰度差的绝对值之和
+        - The energy is the sum of absolute gray-level differences between neighbouring pixels
+        - 用积分图（累加面积表）一次性计算所有窗口位置的能量，耗时与代理图像素数成正比，与窗口大小无关
+        - A summed-area table gives the energy of every window position at once, in time proportional to the proxy's pixel count and independent of the window size
+        - 能量相同的位置中选择最靠近中心的，纯色图片的结果与居中裁剪相同
+        - Among positions with equal energy the one closest to the center is chosen, so flat images crop exactly like the centered crop
+
+    参数
+    Parameters
+        - source: 图片路径、文件对象或已打开的图片对象 / Image path, file object or opened image object
+            路径和文件对象按EXIF方向校正，已打开的图片对象视为已校正
+            Paths and file objects are corrected for the EXIF orientation, opened image objects are taken as already corrected
+        - proxy_side_pixel: 代理图最大边长，默认为256 / Maximum side length of the proxy, default is 256
+    """
+
+    def __init__(self, source, proxy_side_pixel=PROXY_SIDE_PIXEL):
+        proxy, self.size = _proxy_image(source, proxy_side_pixel)
+        self.scale = (proxy.width / self.size[0], proxy.height / self.size[1])
+
+        # 水平和垂直梯度的绝对值/Absolute horizontal and vertical gradients
+        gray = np.asarray(proxy, dtype=np.float64)
+        energy = np.zeros_like(gray)
+        energy[:, :-1] += np.abs(np.diff(gray, axis=1))
+        energy[:-1, :] += np.abs(np.diff(gray, axis=0))
+
+        # 积分图多一行一列零，便于按 S[y2,x2]-S[y1,x2]-S[y2,x1]+S[y1,x1] 计算窗口和/The summed-area table has a leading zero row and column so window sums are S[y2,x2]-S[y1,x2]-S[y2,x1]+S[y1,x1]
+        self.table = np.zeros((gray.shape[0] + 1, gray.shape[1] + 1))
+        self.table[1:, 1:] = energy.cumsum(axis=0).cumsum(axis=1)
+        self.total = self.table[-1, -1]
+
+    def best_box(self, crop_width_pixel, crop_height_pixel):
+        """
+        找出给定尺寸下保留能量最多的裁剪框
+        Find the crop box of the given size that retains the most energy
+
+        返回
+        Returns
+            - (原始分辨率下的裁剪框 (左, 上, 右, 下), 保留能量比例 0~1) / (crop box (left, top, right, bottom) at native resolution, retained energy fraction 0~1)
+        """
+        width, height = self.size
+        rows, columns = self.table.shape[0] - 1, self.table.shape[1] - 1
+        window_width = min(columns, max(1, round(crop_width_pixel * self.scale[0])))
+        window_height = min(rows, max(1, round(crop_height_pixel * self.scale[1])))
+
+        # 所有窗口位置的能量/Energy of every window position
+        table = self.table
+        sums = (table[window_height:, window_width:] - table[:rows + 1 - window_height, window_width:]
+                - table[window_height:, :columns + 1 - window_width] + table[:rows + 1 - window_height, :columns + 1 - window_width])
+
+        # 能量最大的位置中取最靠近中心的/Take the position closest to the center among those with the most energy
+        best_rows, best_columns = np.nonzero(sums >= sums.max() - 1e-9 * max(self.total, 1.0))
+        center_row, center_column = (sums.shape[0] - 1) / 2, (sums.shape[1] - 1) / 2
+        nearest = np.argmin((best_rows - center_row) ** 2 + (best_columns - center_column) ** 2)
+        proxy_top, proxy_left = best_rows[nearest], best_columns[nearest]
+        retained = sums[proxy_top, proxy_left] / self.total if self.total > 0 else crop_width_pixel * crop_height_pixel / (width * height)
+
+        # 按窗口中心映射回原始分辨率/Map back to native resolution by the window center
+        center_x = (proxy_left + window_width / 2) / self.scale[0]
+        center_y = (proxy_top + window_height / 2) / self.scale[1]
+        left = min(max(0, round(center_x - crop_width_pixel / 2)), width - crop_width_pixel)
+        top = min(max(0, round(center_y - crop_height_pixel / 2)), height - crop_height_pixel)
+        return (left, top, left + crop_width_pixel, top + crop_height_pixel), float(retained)
+
+    def retained_energy(self, box):
+        """
+        计算原始分辨率下任意裁剪框保留的能量比例 0~1
+        Compute the retained energy fraction 0~1 of any crop box at native resolution
+        """
+        left, top, right, bottom = box
+        if self.total <= 0:
+            return (right - left) * (bottom - top) / (self.size[0] * self.size[1])
+        rows, columns = self.table.shape[0] - 1, self.table.shape[1] - 1
+        x1, x2 = (min(columns, max(0, round(value * self.scale[0]))) for value in (left, right))
+        y1, y2 = (min(rows, max(0, round(value * self.scale[1]))) for value in (top, bottom))
+        table = self.table
+        return float((table[y2, x2] - table[y1, x2] - table[y2, x1] + table[y1, x1]) / self.total)
+
+
+def _proxy_image(source, proxy_side_pixel):
+    # 生成灰度代理图，返回 (代理图, 源尺寸)/Build the grayscale proxy, returning (proxy, source size)
+    if isinstance(source, Image.Image):
+        source_size = source.size
+        proxy = source.convert('L')
+    else:
+        if isinstance(source, BytesIO):
+            # 使用独立的读取位置，不影响原图片对象/Use an independent read position so the original image object is unaffected
+            source = BytesIO(source.getvalue())
+        with Image.open(source) as img:
+            orientation = exif_orientation(img)
+            source_size = oriented_size(img.size, orientation)
+            # JPEG以降分辨率解码，其他格式忽略/JPEG decodes at reduced resolution, other formats ignore this
+            img.draft('L', (proxy_side_pixel, proxy_side_pixel))
+            proxy = apply_orientation(img.convert('L'), orientation)
+    proxy.thumbnail((proxy_side_pixel, proxy_side_pixel), Image.Resampling.BOX)
+    return proxy, source_size
@@ -0,0 +1,293 @@
+from PIL import Image
+import mmap
+import numpy as np
+import struct
+
+from batch_image_common import ORIENTATION_TAG, canvas_mode
+
+# 未压缩像素格式每像素的字节数，用于计算行跨度/Bytes per pixel of uncompressed raw modes, used to compute the row stride
+RAW_BYTES_PER_PIXEL = {
+    'L': 1, 'P': 1, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'RGBX': 4, 'BGRA': 4, 'BGRX': 4,
+    'LA': 2, 'CMYK': 4, 'I;16': 2, 'I;16B': 2, 'I': 4, 'F': 4,
+}
+
+# 流式输出TIFF支持的模式与 (每像素采样数, 光度解释)/Modes supported by the streamed TIFF output with (samples per pixel, photometric interpretation)
+TIFF_OUTPUT_MODES = {'L': (1, 1), 'RGB': (3, 2), 'RGBA': (4, 2)}
+
+# 经典TIFF的偏移量上限/Offset limit of classic TIFF
+TIFF_MAX_BYTES = 2 ** 32 - 1
+
+
+def open_unguarded(source):
+    """
+    打开图片但不触发Pillow的解压炸弹检查：分块模式下内存由预算限制，而不是由图片尺寸限制
+    Open an image without Pillow's decompression-bomb check: in tiled mode memory is bounded by the budget rather than the image size
+    """
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        return Image.open(source)
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+
+def decoded_size(img):
+    """
+    估计完整解码后占用的字节数
+    Estimate the number of bytes taken by the fully decoded image
+    """
+    return img.width * img.height * RAW_BYTES_PER_PIXEL.get(img.mode, 4)
+
+
+def output_mode(source_mode):
+    """
+    流式输出的颜色模式：灰度保持灰度，带透明度的为RGBA，其余为RGB
+    Color mode of the streamed output: grayscale stays grayscale, images with transparency become RGBA, everything else RGB
+    """
+    if source_mode == 'L':
+        return 'L'
+    return 'RGBA' if source_mode in ('RGBA', 'LA') else 'RGB'
+
+
+class BandReader:
+    """
+    按行带读取未压缩图片（未压缩TIFF、BMP、PPM等），通过内存映射只访问需要的行
+    Read an uncompressed image (uncompressed TIFF, BMP, PPM, ...) in bands of rows, touching only the required rows through a memory map
+
+    参数
+    Parameters
+        - path: 图片路径 / Image path
+        - img: 已打开（未加载像素）的图片对象 / Opened image object whose pixels are not loaded
+        - mode: 读出的颜色模式，默认为None表示按 output_mode 选择 / Color mode of the rows read, default is None meaning chosen by output_mode
+    """
+
+    def __init__(self, path, img, mode=None):
+        self.strips = check_streamable(img)
+        self.mode = img.mode
+        self.palette = img.getpalette() if img.mode == 'P' else None
+        self.width = img.width
+        self.output_mode = mode or output_mode(img.mode)
+        with open(path, 'rb') as source_file:
+            self.file_map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # 文件被截断时无法按偏移读取/A truncated file cannot be read by offset
+        last_top, last_bottom, last_offset, _, last_stride, _ = self.strips[-1]
+        if last_offset + (last_bottom - last_top) * last_stride > len(self.file_map):
+            raise OSError(f"图片文件被截断/Image file is truncated: {path}")
+
+    def read(self, top, bottom):
+        """
+        读取 [top, bottom) 行，返回 (行数, 宽度, 通道数) 的数组，颜色模式为 output_mode
+        Read rows [top, bottom) and return an array of shape (rows, width, channels) in output_mode
+        """
+        bands = []
+        for strip_top, strip_bottom, offset, rawmode, stride, orientation in self.strips:
+            first, last = max(top, strip_top), min(bottom, strip_bottom)
+            if first >= last:
+                continue
+            # 自下而上存储时文件中的行序相反/Rows are in reverse order in the file when stored bottom-up
+            if orientation < 0:
+                start = offset + (strip_bottom - last) * stride
+            else:
+                start = offset + (first - strip_top) * stride
+            chunk = self.file_map[start:start + (last - first) * stride]
+            self._release(start, len(chunk))
+            band = Image.frombuffer(self.mode, (self.width, last - first), chunk, 'raw', rawmode, stride, orientation)
+            if self.palette is not None:
+                band.putpalette(self.palette)
+            if band.mode != self.output_mode:
+                band = band.convert(self.output_mode)
+            bands.append(np.asarray(band).reshape(last - first, self.width, -1))
+        return bands[0] if len(bands) == 1 else np.concatenate(bands)
+
+    def close(self):
+        self.file_map.close()
+
+    def _release(self, start, length):
+        # 已读过的页面不再需要，通知系统回收，使常驻内存不随文件大小增长/Pages already read are no longer needed, let the system reclaim them so resident memory does not grow with the file size
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            aligned_start = start - start % mmap.PAGESIZE
+            self.file_map.madvise(mmap.MADV_DONTNEED, aligned_start, start + length - aligned_start)
+
+
+def check_streamable(img):
+    """
+    检查图片能否分块读取并返回行带列表，不能时抛出 MemoryError
+    Check that the image can be read in bands and return its strips, raising MemoryError otherwise
+
+    行带按文件中的存储方向读取，因此带EXIF方向的图片抛出 ValueError
+    Bands are read in stored orientation, so images with an EXIF orientation raise ValueError
+    """
+    if img.getexif().get(ORIENTATION_TAG, 1) != 1:
+        raise ValueError("流式处理不支持带EXIF方向的图片/Images with an EXIF orientation are not supported for streamed files")
+    strips = raw_strips(img)
+    if strips is None:
+        raise MemoryError(
+            f"图片超过内存预算且不是未压缩格式，无法分块读取/Image exceeds the memory budget and is not uncompressed, so it cannot be read in bands "
+            f"({img.format}, {img.width}x{img.height})")
+    return strips
+
+
+def raw_strips(img):
+    """
+    返回未压缩图片的行带列表 (上, 下, 偏移, 原始模式, 行跨度, 方向)，不是整行未压缩存储时返回None
+    Return the list of row strips (top, bottom, offset, raw mode, stride, orientation) of an uncompressed image, or None when it is not stored as full-width uncompressed rows
+    """
+    strips = []
+    for tile in img.tile:
+        codec_name, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if codec_name != 'raw' or extents[0] != 0 or extents[2] != img.width:
+            return None
+        rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+        if not stride:
+            if rawmode not in RAW_BYTES_PER_PIXEL:
+                return None
+            stride = img.width * RAW_BYTES_PER_PIXEL[rawmode]
+        strips.append((extents[1], extents[3], offset, rawmode, stride, orientation or 1))
+    strips.sort()
+    # 行带必须覆盖整张图片/The strips must cover the whole image
+    if not strips or strips[0][0] != 0 or strips[-1][1] != img.height or any(
+            previous[1] != following[0] for previous, following in zip(strips, strips[1:])):
+        return None
+    return strips
+
+
+def band_rows(row_bytes, memory_budget):
+    """
+    按内存预算计算每个行带的行数，留出转换和拼接时临时数组的余量
+    Compute the number of rows per band from the memory budget, leaving room for temporary arrays during conversion and assembly
+    """
+    return max(1, memory_budget // (3 * max(1, row_bytes)))
+
+
+def write_tiff_header(output_file, size, mode):
+    """
+    写入单条带未压缩TIFF的文件头，之后按从上到下的顺序直接追加像素行
+    Write the header of a single-strip uncompressed TIFF, pixel rows are then appended top to bottom
+    """
+    width, height = size
+    samples_per_pixel, photometric = TIFF_OUTPUT_MODES[mode]
+    data_bytes = width * height * samples_per_pixel
+
+    entries = [
+        (256, 4, 1, width),                 # ImageWidth
+        (257, 4, 1, height),                # ImageLength
+        (258, 3, samples_per_pixel, None),  # BitsPerSample
+        (259, 3, 1, 1),                     # Compression: none
+        (262, 3, 1, photometric),           # PhotometricInterpretation
+        (273, 4, 1, None),                  # StripOffsets
+        (277, 3, 1, samples_per_pixel),     # SamplesPerPixel
+        (278, 4, 1, height),                # RowsPerStrip
+        (279, 4, 1, data_bytes),            # StripByteCounts
+        (284, 3, 1, 1),                     # PlanarConfiguration: chunky
+    ]
+    if mode == 'RGBA':
+        entries.append((338, 3, 1, 2))      # ExtraSamples: unassociated alpha
+
+    # 文件头、IFD、BitsPerSample数组，然后是像素数据/Header, IFD, BitsPerSample array, then the pixel data
+    ifd_bytes = 2 + 12 * len(entries) + 4
+    bits_offset = 8 + ifd_bytes
+    data_offset = bits_offset + 2 * samples_per_pixel
+    if data_offset + data_bytes > TIFF_MAX_BYTES:
+        raise ValueError(f"输出超过经典TIFF的4GB上限/Output exceeds the 4 GB limit of classic TIFF: {width}x{height} {mode}")
+
+    header = bytearray(b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', len(entries)))
+    for tag, field_type, count, value in entries:
+        if tag == 258:
+            value_bytes = struct.pack('<HH', 8, 0) if count == 1 else struct.pack('<I', bits_offset)
+        elif tag == 273:
+            value_bytes = struct.pack('<I', data_offset)
+        elif field_type == 3:
+            value_bytes = struct.pack('<HH', value, 0)
+        else:
+            value_bytes = struct.pack('<I', value)
+        header += struct.pack('<HHI', tag, field_type, count) + value_bytes
+    header += struct.pack('<I', 0)
+    header += struct.pack(f'<{samples_per_pixel}H', *([8] * samples_per_pixel))
+    output_file.write(header)
+
+
+class TiledCrop:
+    """
+    分块裁剪：按行带读取裁剪区域并直接写入未压缩TIFF，作为 write_output 的数据在写入阶段执行
+    Tiled crop: read the crop region in bands of rows and write it straight to an uncompressed TIFF, runs in the write stage as the data passed to write_output
+    """
+
+    def __init__(self, path, img, crop_box, memory_budget):
+        self.path = path
+        self.crop_box = tuple(crop_box)
+        self.memory_budget = memory_budget
+        self.mode = output_mode(img.mode)
+        # 提前检查是否可以分块读取/Check up front whether the image can be read in bands
+        check_streamable(img)
+
+    def __call__(self, output_file):
+        left, top, right, bottom = self.crop_box
+        with open_unguarded(self.path) as img:
+            reader = BandReader(self.path, img)
+        try:
+            channels = TIFF_OUTPUT_MODES[self.mode][0]
+            rows = band_rows((reader.width + right - left) * channels, self.memory_budget)
+            write_tiff_header(output_file, (right - left, bottom - top), self.mode)
+            for band_top in range(top, bottom, rows):
+                band = reader.read(band_top, min(bottom, band_top + rows))
+                output_file.write(np.ascontiguousarray(band[:, left:right]).tobytes())
+        finally:
+            reader.close()
+
+
+class TiledExpand:
+    """
+    分块扩充：按行带生成扩充后的画布并直接写入未压缩TIFF，支持 'color' 和 'edge' 填充
+    Tiled expansion: build the expanded canvas in bands of rows and write it straight to an uncompressed TIFF, supporting 'color' and 'edge' fills
+    """
+
+    def __init__(self, path, img, canvas_size, paste_position, background_color, fill_mode, memory_budget):
+        if fill_mode not in ('color', 'edge'):
+            raise ValueError(f"分块模式不支持该填充模式/Fill mode not supported in tiled mode: {fill_mode}")
+        self.path = path
+        self.source_size = img.size
+        self.canvas_size = tuple(canvas_size)
+        self.paste_position = tuple(paste_position)
+        self.background_color = tuple(background_color)
+        self.fill_mode = fill_mode
+        self.memory_budget = memory_budget
+        # 与内存中的扩充使用相同的画布模式/Use the same canvas mode as the in-memory expansion
+        self.mode = canvas_mode(img.mode)
+        check_streamable(img)
+
+    def __call__(self, output_file):
+        width, height = self.source_size
+        canvas_width, canvas_height = self.canvas_size
+        paste_x, paste_y = self.paste_position
+        with open_unguarded(self.path) as img:
+            reader = BandReader(self.path, img, self.mode)
+        try:
+            channels = TIFF_OUTPUT_MODES[self.mode][0]
+            color = np.array(Image.new('RGBA', (1, 1), self.background_color).convert(self.mode)).reshape(channels)
+            rows = band_rows((width + canvas_width) * channels, self.memory_budget)
+            # 边缘填充时输出列对应的源列/Source column of every output column for the edge fill
+            columns = np.clip(np.arange(canvas_width) - paste_x, 0, width - 1)
+            write_tiff_header(output_file, self.canvas_size, self.mode)
+            for band_top in range(0, canvas_height, rows):
+                band_bottom = min(canvas_height, band_top + rows)
+                output_file.write(self._band(reader, band_top, band_bottom, paste_x, paste_y, columns, color).tobytes())
+        finally:
+            reader.close()
+
+    def _band(self, reader, band_top, band_bottom, paste_x, paste_y, columns, color):
+        # 生成输出的 [band_top, band_bottom) 行/Build output rows [band_top, band_bottom)
+        width, height = self.source_size
+        canvas_width = self.canvas_size[0]
+        if self.fill_mode == 'edge':
+            # 上下填充复制首尾行，左右填充复制首尾列/Top and bottom padding repeat the first and last rows, left and right padding repeat the first and last columns
+            source_rows = np.clip(np.arange(band_top, band_bottom) - paste_y, 0, height - 1)
+            first, last = int(source_rows[0]), int(source_rows[-1]) + 1
+            source = reader.read(first, last)
+            return np.ascontiguousarray(source[source_rows - first][:, columns])
+
+        band = np.empty((band_bottom - band_top, canvas_width, len(color)), dtype=np.uint8)
+        band[...] = color
+        first, last = max(band_top, paste_y), min(band_bottom, paste_y + height)
+        if first < last:
+            band[first - band_top:last - band_top, paste_x:paste_x + width] = reader.read(first - paste_y, last - paste_y)
+        return band
@@ -0,0 +1,329 @@
+from PIL import Image
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from batch_image_formatter_and_cropper import fixed_ratio_crop
+from batch_image_formatter_and_expander import fixed_ratio_expand
+from batch_image_pipeline import CropStage, ExpandStage, ResizeStage, fixed_ratio_pipeline
+from image_center_cropper_with_stepwise_reduction import compute_crop_schedule, crop
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，峰值内存记为None/Windows has no resource module, peak memory is recorded as None
+    resource = None
+
+# 合成图库中使用的 (模式, 可用格式)/(mode, usable formats) used in the synthetic corpus
+CORPUS_MODES = (
+    ('RGB', ('JPEG', 'PNG', 'BMP', 'TIFF', 'WEBP')),
+    ('RGBA', ('PNG', 'TIFF', 'WEBP')),
+    ('P', ('PNG', 'BMP', 'TIFF')),
+    ('L', ('JPEG', 'PNG', 'BMP', 'TIFF', 'WEBP')),
+)
+CORPUS_ASPECT_RATIOS = (1, 4/3, 3/4, 16/9, 9/16, 3/2, 2/3, 21/9)
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'BMP': '.bmp', 'TIFF': '.tiff', 'WEBP': '.webp'}
+
+# 默认基准用例：(用例名称, 工具, 选项)/Default benchmark cases: (case name, tool, options)
+DEFAULT_CASES = (
+    ('expand', 'expand', {'target_aspect_ratio': 1}),
+    ('expand-workers', 'expand', {'target_aspect_ratio': 1, 'workers': None}),
+    ('expand-1080', 'expand', {'target_aspect_ratio': 1, 'max_output_size': (1080, 1080)}),
+    ('expand-numpy', 'expand', {'target_aspect_ratio': 1, 'use_numpy': True}),
+    ('expand-blur', 'expand', {'target_aspect_ratio': 16/9, 'fill_mode': 'blur'}),
+    ('crop', 'crop', {'crop_aspect_ratio': 1}),
+    ('crop-workers', 'crop', {'crop_aspect_ratio': 1, 'workers': None}),
+    ('crop-prefetch', 'crop', {'crop_aspect_ratio': 1, 'prefetch': 8}),
+    ('crop-workers-prefetch', 'crop', {'crop_aspect_ratio': 1, 'workers': None, 'prefetch': 16}),
+    ('crop-1080', 'crop', {'crop_aspect_ratio': 16/9, 'max_output_size': (1920, 1080)}),
+    ('crop-png', 'crop', {'crop_aspect_ratio': 1, 'output_format': 'png'}),
+    ('crop-fast', 'crop', {'crop_aspect_ratio': 1, 'encode_profile': 'fast'}),
+    ('crop-smallest', 'crop', {'crop_aspect_ratio': 1, 'encode_profile': 'smallest'}),
+    ('crop-webp-200k', 'crop', {'crop_aspect_ratio': 1, 'output_format': 'webp', 'target_file_size': 200_000}),
+    ('crop-srcset', 'crop', {'crop_aspect_ratio': 1, 'srcset_widths': [1600, 800, 400], 'srcset_formats': ('webp', 'jpeg')}),
+    ('pipeline', 'pipeline', {'stages': [('crop', 4/3), ('expand', 1), ('resize', (1080, 1080))], 'output_format': 'webp'}),
+    ('stepwise', 'stepwise', {'width_step_pixel': 40, 'crop_aspect_ratio': 16/9, 'min_size_ratio': 0.05, 'min_pixel_limit': 100}),
+    ('stepwise-workers', 'stepwise', {'width_step_pixel': 40, 'crop_aspect_ratio': 16/9, 'min_size_ratio': 0.05, 'min_pixel_limit': 100, 'workers': None}),
+    ('stepwise-multiframe', 'stepwise', {'width_step_pixel': 40, 'crop_aspect_ratio': 16/9, 'min_size_ratio': 0.05, 'min_pixel_limit': 100, 'output_mode': 'multiframe'}),
+)
+
+
+def generate_corpus(corpus_folder, image_count=48, min_side_pixel=400, max_side_pixel=2400, seed=0):
+    """
+    生成合成图库
+    Generate a Synthetic Corpus
+
+    功能说明
+    Function Description
+        - 按固定随机种子生成混合格式、尺寸、模式（RGB/RGBA/P/L）和宽高比的图片，结果可重复
+        - Generate images of mixed formats, sizes, modes (RGB/RGBA/P/L) and aspect ratios from a fixed seed, so results are reproducible
+        - 图片内容为渐变叠加噪声，编码代价接近真实照片而不是纯色图
+        - Image content is a gradient blended with noise, so encoding cost is closer to real photos than to flat colors
+        - 另外生成一张大图 stepwise/source.jpg 供逐步裁剪工具使用
+        - Also generates one large image stepwise/source.jpg for the stepwise cropper
+
+    参数
+    Parameters
+        - corpus_folder: 图库目录 / Corpus directory
+        - image_count: 图片数量（默认48）/ Number of images (default 48)
+        - min_side_pixel / max_side_pixel: 长边像素范围 / Range of the long side in pixels
+        - seed: 随机种子（默认0）/ Random seed (default 0)
+    """
+    generator = random.Random(seed)
+    images_folder = os.path.join(corpus_folder, 'images')
+    os.makedirs(images_folder, exist_ok=True)
+
+    for index in range(image_count):
+        mode, formats = CORPUS_MODES[index % len(CORPUS_MODES)]
+        image_format = generator.choice(formats)
+        aspect_ratio = generator.choice(CORPUS_ASPECT_RATIOS)
+        long_side = generator.randint(min_side_pixel, max_side_pixel)
+        size = (long_side, round(long_side / aspect_ratio)) if aspect_ratio >= 1 else (round(long_side * aspect_ratio), long_side)
+        image = _synthetic_image(size, mode, generator)
+        image.save(os.path.join(images_folder, f"synthetic_{index:04d}{FORMAT_EXTENSIONS[image_format]}"), format=image_format)
+
+    stepwise_folder = os.path.join(corpus_folder, 'stepwise')
+    os.makedirs(stepwise_folder, exist_ok=True)
+    _synthetic_image((max_side_pixel * 2, max_side_pixel * 4 // 3), 'RGB', generator).save(
+        os.path.join(stepwise_folder, 'source.jpg'), format='JPEG')
+
+
+def _synthetic_image(size, mode, generator):
+    # 渐变叠加噪声，再转换为目标模式/Gradient blended with noise, then converted to the target mode
+    gradient = Image.radial_gradient('L').resize(size)
+    noise = Image.effect_noise(size, generator.uniform(20, 60))
+    channels = [Image.blend(gradient, noise, generator.uniform(0.2, 0.6)) for _ in range(3)]
+    image = Image.merge('RGB', [channels[0], channels[1].transpose(Image.Transpose.FLIP_LEFT_RIGHT), channels[2].transpose(Image.Transpose.FLIP_TOP_BOTTOM)])
+    if mode == 'RGBA':
+        image.putalpha(gradient)
+        return image
+    if mode == 'P':
+        return image.convert('P', palette=Image.Palette.ADAPTIVE)
+    return image.convert(mode)
+
+
+def run_case(tool, options, corpus_folder, output_folder):
+    """
+    在当前进程中运行一个基准用例并返回测量结果
+    Run one benchmark case in the current process and return the measurements
+
+    返回
+    Returns
+        - 包含图片数、耗时、每秒图片数、分阶段耗时和峰值内存的字典 / Dict with image count, seconds, images per second, stage timings and peak memory
+    """
+    images_folder = os.path.join(corpus_folder, 'images')
+    options = dict(options)
+
+    # 批处理工具通过插桩事件汇报各阶段耗时，逐步裁剪工具直接返回/Batch tools report stage timings through instrumentation events, the stepwise cropper returns them directly
+    batch_end_events = []
+    stage_seconds = None
+
+    def collect_batch_end(event):
+        if event['event'] == 'batch_end':
+            batch_end_events.append(event)
+
+    if tool != 'stepwise':
+        options.update(verbosity='quiet', observers=[collect_batch_end])
+
+    # 工具的最终提示不计入控制台开销/The tools' final messages are discarded so console output does not dominate
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        if tool == 'expand':
+            fixed_ratio_expand(images_folder, output_folder, **options)
+            image_count = len(os.listdir(images_folder))
+        elif tool == 'crop':
+            fixed_ratio_crop(images_folder, output_folder, **options)
+            image_count = len(os.listdir(images_folder))
+        elif tool == 'pipeline':
+            stage_types = {'crop': CropStage, 'expand': ExpandStage, 'resize': ResizeStage}
+            stages = [stage_types[kind](value) for kind, value in options.pop('stages')]
+            fixed_ratio_pipeline(images_folder, output_folder, stages, **options)
+            image_count = len(os.listdir(images_folder))
+        elif tool == 'stepwise':
+            source_path = os.path.join(output_folder, 'source.jpg')
+            shutil.copy(os.path.join(corpus_folder, 'stepwise', 'source.jpg'), source_path)
+            # 以生成的裁剪数计数/Count the number of generated crops
+            with Image.open(source_path) as source_image:
+                schedule = compute_crop_schedule(
+                    *source_image.size, options['width_step_pixel'], options['crop_aspect_ratio'],
+                    options['min_size_ratio'], options['min_pixel_limit'])[0]
+            image_count = len(schedule)
+            start = time.perf_counter()
+            stage_seconds = {stage: round(seconds, 6) for stage, seconds in crop(input_image_path=source_path, **options).items()}
+        else:
+            raise ValueError(f"未知工具/Unknown tool: {tool}")
+        seconds = time.perf_counter() - start
+    if batch_end_events:
+        stage_seconds = batch_end_events[0]['stages']
+
+    return {
+        'images': image_count,
+        'seconds': round(seconds, 4),
+        'images_per_second': round(image_count / seconds, 3) if seconds else None,
+        'stage_seconds': stage_seconds,
+        'format_seconds': batch_end_events[0]['formats'] if batch_end_events else None,
+        'peak_rss_kb': _peak_rss_kb(),
+        'peak_worker_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss if resource else None,
+    }
+
+
+def _peak_rss_kb():
+    # Linux 上优先读取 VmHWM：ru_maxrss 会在 exec 后保留父进程的峰值/On Linux prefer VmHWM: ru_maxrss keeps the parent's peak across exec
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # macOS 上 ru_maxrss 的单位是字节/On macOS ru_maxrss is in bytes
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_benchmarks(results_path='benchmark_results.jsonl', cases=DEFAULT_CASES, image_count=48, max_side_pixel=2400, seed=0):
+    """
+    批处理工具基准测试
+    Batch Tools Benchmark
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        在合成图库上测量各工具和选项组合的吞吐量、分阶段耗时和峰值内存，并保存为机器可读的结果，便于发现性能回退
+        Measure throughput, per-stage time and peak memory of each tool and option combination on a synthetic corpus, and store machine-readable results so regressions show up
+
+    功能说明
+    Function Description
+        - 在临时目录中生成合成图库，结束后删除
+        - Generate the synthetic corpus in a temporary directory and delete it afterwards
+        - 每个用例在独立子进程中运行，峰值内存互不影响
+        - Each case runs in its own subprocess so peak memory measurements do not affect each other
+        - 结果以JSON-lines追加到结果文件，每行包含环境信息和提交版本
+        - Results are appended to the results file as JSON lines, each with environment info and commit
+        - 与结果文件中同一用例、相同图库参数（图片数、长边上限、随机种子）的上一次结果比较，吞吐量下降超过10%时提示
+        - Compare against the previous result of the same case with the same corpus parameters (image count, max side, seed) in the results file and report throughput drops of more than 10%
+
+    参数
+    Parameters
+        - results_path: 结果文件路径（默认benchmark_results.jsonl）/ Results file path (default benchmark_results.jsonl)
+        - cases: 基准用例列表 / List of benchmark cases
+        - image_count: 合成图片数量（默认48）/ Number of synthetic images (default 48)
+        - max_side_pixel: 合成图片长边上限（默认2400）/ Upper bound of the synthetic long side (default 2400)
+        - seed: 随机种子（默认0）/ Random seed (default 0)
+    """
+    previous = _load_previous_results(results_path)
+    environment = _environment()
+
+    with tempfile.TemporaryDirectory(prefix='mine_benchmark_') as work_folder:
+        corpus_folder = os.path.join(work_folder, 'corpus')
+        generate_corpus(corpus_folder, image_count, max_side_pixel=max_side_pixel, seed=seed)
+
+        for case_name, tool, options in cases:
+            output_folder = os.path.join(work_folder, case_name)
+            os.makedirs(output_folder)
+            # 在独立子进程中运行用例/Run the case in its own subprocess
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-case', json.dumps([tool, options]), corpus_folder, output_folder],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if completed.returncode != 0:
+                print(f"用例失败/Case failed: {case_name}\n{completed.stderr}")
+                continue
+            measurement = json.loads(completed.stdout.strip().splitlines()[-1])
+            shutil.rmtree(output_folder)
+
+            record = dict(environment, case=case_name, tool=tool, options=options,
+                          image_count=image_count, max_side_pixel=max_side_pixel, seed=seed, **measurement)
+            with open(results_path, 'a', encoding='utf-8') as results_file:
+                results_file.write(json.dumps(record) + '\n')
+
+            print(f"{case_name}: {record['images_per_second']} 图片/秒 images/s, "
+                  f"{record['seconds']} 秒/s, 峰值内存/peak RSS {record['peak_rss_kb']} KB")
+            _report_regression(case_name, previous.get(_baseline_key(record)), record)
+
+
+def _report_regression(case_name, previous_record, record, threshold=0.1):
+    # 吞吐量较上次下降超过阈值时提示/Report when throughput dropped by more than the threshold since last time
+    if not previous_record or not previous_record.get('images_per_second') or not record['images_per_second']:
+        return
+    change = record['images_per_second'] / previous_record['images_per_second'] - 1
+    if change < -threshold:
+        print(f"  性能回退/Regression: {case_name} 吞吐量/throughput {change:+.1%} "
+              f"(上次/previous {previous_record.get('commit')})")
+
+
+def _baseline_key(record):
+    # 只有同一用例在相同图库上的结果可以比较/Only results of the same case on the same corpus are comparable
+    return record['case'], record.get('image_count'), record.get('max_side_pixel'), record.get('seed')
+
+
+def _load_previous_results(results_path):
+    # 每个用例和图库参数取结果文件中的最后一条/Take the last record of each case and corpus parameters in the results file
+    previous = {}
+    if os.path.exists(results_path):
+        with open(results_path, encoding='utf-8') as results_file:
+            for line in results_file:
+                record = json.loads(line)
+                previous[_baseline_key(record)] = record
+    return previous
+
+
+def _environment():
+    # 记录环境信息，便于比较不同机器或版本的结果/Record environment info so results across machines or versions can be compared
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    import PIL
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': numpy_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批处理工具基准测试/Batch tools benchmark")
+    parser.add_argument('--results', default='benchmark_results.jsonl', help="结果文件/Results file")
+    parser.add_argument('--images', type=int, default=48, help="合成图片数量/Number of synthetic images")
+    parser.add_argument('--max-side', type=int, default=2400, help="合成图片长边上限/Upper bound of the synthetic long side")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', help="逗号分隔的用例名称/Comma-separated case names")
+    parser.add_argument('--run-case', nargs=3, metavar=('CASE', 'CORPUS', 'OUTPUT'), help=argparse.SUPPRESS)
+    arguments = parser.parse_args(argv)
+
+    # 子进程模式：运行单个用例并输出JSON/Subprocess mode: run a single case and print JSON
+    if arguments.run_case:
+        case, corpus_folder, output_folder = arguments.run_case
+        tool, options = json.loads(case)
+        print(json.dumps(run_case(tool, options, corpus_folder, output_folder)))
+        return 0
+
+    cases = DEFAULT_CASES
+    if arguments.cases:
+        selected = set(arguments.cases.split(','))
+        cases = [case for case in DEFAULT_CASES if case[0] in selected]
+    run_benchmarks(arguments.results, cases, arguments.images, arguments.max_side, arguments.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
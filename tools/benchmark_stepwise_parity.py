@@ -0,0 +1,297 @@
+from PIL import Image
+import argparse
+import contextlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from image_center_cropper_with_stepwise_reduction import STOP_AREA, STOP_SIZE, crop, crop_schedule_array
+
+# R实现与本文件位于同一目录/The R implementation lives in the same directory as this file
+R_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_center_cropper_with_stepwise_reduction.R')
+
+# 对照用例：(用例名称, 源尺寸, 宽度步长, 宽高比, 最小尺寸比例, 最小像素限制)/Parity cases: (case name, source size, width step, aspect ratio, minimum size ratio, minimum pixel limit)
+PARITY_CASES = (
+    ('landscape-16x9', (1200, 900), 40, 16/9, 0.05, 100),
+    ('portrait-1x1', (700, 1000), 25, 1, 0.1, 100),
+    ('odd-4x3', (1001, 577), 33, 4/3, 0.05, 50),
+    ('half-step-3x2', (960, 720), 12.5, 3/2, 0.1, 64),
+    ('fine-step-21x9', (1400, 600), 7, 21/9, 0.25, 100),
+    ('too-small', (120, 90), 10, 1, 0.1, 100),
+)
+
+# 加载R文件中的库和函数定义（跳过文件末尾的使用示例），计时后调用 crop()
+# Load the library and function definitions from the R file (skipping the usage examples at its end), then time a crop() call
+R_DRIVER = r'''
+arguments <- commandArgs(trailingOnly = TRUE)
+for (statement in parse(arguments[1])) {
+  if (is.call(statement) && as.character(statement[[1]]) %in% c("library", "<-")) eval(statement, globalenv())
+}
+image_path <- arguments[2]
+decode_seconds <- system.time(image_info(image_read(image_path)))[["elapsed"]]
+total_seconds <- system.time(crop(as.numeric(arguments[3]), image_path, as.numeric(arguments[4]), as.numeric(arguments[5]), as.numeric(arguments[6])))[["elapsed"]]
+cat(sprintf("PARITY_TIMINGS %.6f %.6f\n", decode_seconds, total_seconds))
+'''
+
+# 两个实现共用的输出文件名：原始文件名_crop{序号}_{宽度}_{高度}_{面积比例}.png/Output filename shared by both implementations: original_filename_crop{index}_{width}_{height}_{area_ratio}.png
+OUTPUT_PATTERN = re.compile(r'_crop(\d+)_([^_]+)_([^_]+)_([^_]+)\.png$')
+STOP_PATTERN = re.compile(r'^Stop generating image (\d+), reasons: (.*)$', re.MULTILINE)
+
+
+def generate_parity_image(image_path, size, seed=0):
+    """
+    生成对照用的无损PNG图片：渐变叠加噪声，每个像素都不同，错位一个像素的裁剪也能被发现
+    Generate a lossless PNG for the parity check: a gradient blended with noise so every pixel differs and a crop off by one pixel is caught
+    """
+    generator = np.random.default_rng(seed)
+    width, height = size
+    gradient = np.add.outer(np.linspace(0, 160, height), np.linspace(0, 80, width))
+    pixels = gradient[:, :, None] + generator.integers(0, 96, (height, width, 3))
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8), 'RGB').save(image_path, format='PNG')
+
+
+def run_python(image_path, width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit):
+    """
+    运行Python实现，返回 (序列, 终止信息, 输出文件, 分阶段耗时)
+    Run the Python implementation, returning (schedule, stop info, output files, stage timings)
+    """
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        stage_seconds = crop(width_step_pixel, image_path, crop_aspect_ratio, min_size_ratio, min_pixel_limit)
+    stage_seconds['total'] = time.perf_counter() - start
+
+    with Image.open(image_path) as source_image:
+        schedule_array = crop_schedule_array(*source_image.size, width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit)
+    schedule = [tuple(row) for row in zip(*(schedule_array[field][:-1].tolist() for field in ('index', 'width', 'height', 'area_ratio')))]
+    stop = schedule_array[-1]
+    stop_reasons = {kind for kind, flag in (('size', STOP_SIZE), ('area', STOP_AREA)) if stop['stop'] & flag}
+    return schedule, (int(stop['index']), stop_reasons), _output_files(image_path), stage_seconds
+
+
+def run_r(image_path, width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit, rscript='Rscript'):
+    """
+    通过 Rscript 运行R实现，返回 (序列, 终止信息, 输出文件, 分阶段耗时)
+    Run the R implementation through Rscript, returning (schedule, stop info, output files, stage timings)
+
+    序列从输出文件名解析，终止信息从R打印的英文提示解析；R的 crop() 自己解码图片，因此'crop'阶段为总耗时减去单独测得的解码时间
+    The schedule is parsed from the output filenames and the stop info from the English message R prints; R's crop() decodes the image itself, so the 'crop' stage is the total minus the separately measured decode time
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.R', delete=False, encoding='utf-8') as driver_file:
+        driver_file.write(R_DRIVER)
+    try:
+        # 宽高比以repr传递，R解析后得到完全相同的双精度数/The aspect ratio is passed as its repr, which R parses to the exact same double
+        completed = subprocess.run(
+            [rscript, driver_file.name, R_SOURCE_PATH, image_path,
+             repr(width_step_pixel), repr(crop_aspect_ratio), repr(min_size_ratio), repr(min_pixel_limit)],
+            capture_output=True, text=True)
+    finally:
+        os.remove(driver_file.name)
+    timings = re.search(r'^PARITY_TIMINGS (\S+) (\S+)$', completed.stdout, re.MULTILINE)
+    if completed.returncode != 0 or timings is None:
+        raise RuntimeError(f"R实现运行失败/The R implementation failed:\n{completed.stderr.strip()}")
+
+    output_files = _output_files(image_path)
+    schedule = [(index, width, height, area_ratio) for (index, width, height, area_ratio), _ in sorted(output_files.items())]
+    stop_match = STOP_PATTERN.search(completed.stdout)
+    stop = None
+    if stop_match:
+        reasons = stop_match.group(2)
+        stop_reasons = {kind for kind, markers in (('size', ('Width/height limit', 'min(width, height)')), ('area', ('Area ratio limit', 'area ratio')))
+                        if any(marker in reasons for marker in markers)}
+        stop = (int(stop_match.group(1)), stop_reasons)
+    decode_seconds, total_seconds = float(timings.group(1)), float(timings.group(2))
+    return schedule, stop, output_files, {'decode': decode_seconds, 'crop': total_seconds - decode_seconds, 'total': total_seconds}
+
+
+def _output_files(image_path):
+    # 按文件名解析输出目录中的裁剪：{(序号, 宽度, 高度, 面积比例): 路径}/Parse the crops in the output directory by filename: {(index, width, height, area_ratio): path}
+    output_directory = f"{os.path.splitext(image_path)[0]}_output"
+    output_files = {}
+    for filename in os.listdir(output_directory):
+        match = OUTPUT_PATTERN.search(filename)
+        if match:
+            index, width, height, area_ratio = match.groups()
+            # R对整数和小数的格式与Python不同（如 1 与 1.0、1e+05），统一按数值解析/R formats numbers differently from Python (e.g. 1 vs 1.0, 1e+05), so everything is parsed as numbers
+            output_files[(int(index), int(float(width)), int(float(height)), float(area_ratio))] = os.path.join(output_directory, filename)
+    return output_files
+
+
+def check_pixels(source_pixels, output_files):
+    """
+    检查每个输出与源图片的居中裁剪逐像素相同，返回不一致的文件名列表
+    Check that every output is pixel-identical to the centered crop of the source, returning the list of mismatching filenames
+    """
+    source_height, source_width = source_pixels.shape[:2]
+    mismatches = []
+    for (_, width, height, _), output_path in sorted(output_files.items()):
+        left, top = (source_width - width) // 2, (source_height - height) // 2
+        with Image.open(output_path) as output_image:
+            output_pixels = np.asarray(output_image.convert('RGB'))
+        if not np.array_equal(output_pixels, source_pixels[top:top + height, left:left + width]):
+            mismatches.append(os.path.basename(output_path))
+    return mismatches
+
+
+def run_parity(cases=PARITY_CASES, seed=0, rscript=None, results_path=None):
+    """
+    逐步裁剪的Python/R对照与速度比较
+    Stepwise Cropper Python/R Parity and Speed Comparison
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        仓库中的逐步裁剪工具有Python和R两个实现，需要确认两者给出相同的裁剪序列和像素，并比较吞吐量，以决定生产环境中使用哪个实现
+        The repository ships the stepwise cropper in both Python and R, so both must be confirmed to produce the same crop schedule and pixels, and their throughput compared to decide which one runs in production
+
+    功能说明
+    Function Description
+        - 在临时目录中按固定种子生成无损PNG图片，每个用例的两个实现各使用一份副本，输出目录互不干扰
+        - Generate lossless PNG images from a fixed seed in a temporary directory, each implementation gets its own copy per case so their output directories do not collide
+        - 比较裁剪序列（序号、尺寸、面积比例）和终止位置及原因
+        - Compare the crop schedule (index, size, area ratio) and the stop position and reasons
+        - 逐像素比较每个输出与源图片的居中裁剪，两个实现都与同一参考一致即互相一致
+        - Compare every output pixel by pixel with the centered crop of the source, both implementations matching the same reference means they match each other
+        - 汇报分阶段耗时和每张裁剪的平均耗时
+        - Report per-stage timings and the average time per crop
+        - 找不到 Rscript 时跳过R对照并明确提示，只检查和计时Python实现，结果中 r_skipped 为True
+        - When Rscript cannot be found the R comparison is skipped with a clear message, only the Python implementation is checked and timed and r_skipped is True in the results
+
+    参数
+    Parameters
+        - cases: 对照用例列表，格式同 PARITY_CASES / List of parity cases, same format as PARITY_CASES
+        - seed: 随机种子（默认0）/ Random seed (default 0)
+        - rscript: Rscript 可执行文件路径，默认为None表示在PATH中查找 / Path to the Rscript executable, default is None meaning it is looked up on PATH
+        - results_path: 结果JSON-lines文件路径，默认为None表示不保存 / Path of the JSON-lines results file, default is None meaning nothing is saved
+
+    返回
+    Returns
+        - 每个用例一个结果字典的列表 / List of one result dict per case
+    """
+    rscript_name = rscript or 'Rscript'
+    rscript = shutil.which(rscript_name)
+    if rscript is None:
+        print(f"跳过R对照：未找到 {rscript_name}，只检查Python实现；安装R和magick包，或用 --rscript 指定路径")
+        print(f"Skipping the R comparison: {rscript_name} not found, checking the Python implementation only; install R with the magick package or pass --rscript")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='mine_parity_') as work_folder:
+        for case_index, (case_name, size, width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit) in enumerate(cases):
+            parameters = (width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit)
+            source_path = os.path.join(work_folder, f"{case_name}.png")
+            generate_parity_image(source_path, size, seed + case_index)
+            with Image.open(source_path) as source_image:
+                source_pixels = np.asarray(source_image.convert('RGB'))
+
+            # 每个实现使用独立的源文件副本/Each implementation works on its own copy of the source
+            python_path = os.path.join(work_folder, 'python', f"{case_name}.png")
+            os.makedirs(os.path.dirname(python_path), exist_ok=True)
+            shutil.copy(source_path, python_path)
+            python_schedule, python_stop, python_files, python_seconds = run_python(python_path, *parameters)
+            result = {
+                'case': case_name, 'size': list(size), 'crops': len(python_schedule),
+                'python_seconds': _rounded(python_seconds),
+                'python_ms_per_crop': _per_crop(python_seconds['total'], len(python_schedule)),
+                'python_pixel_mismatches': check_pixels(source_pixels, python_files),
+                'python_files_match_schedule': sorted(python_files) == python_schedule,
+            }
+
+            if rscript is None:
+                result['r_skipped'] = True
+            else:
+                r_path = os.path.join(work_folder, 'r', f"{case_name}.png")
+                os.makedirs(os.path.dirname(r_path), exist_ok=True)
+                shutil.copy(source_path, r_path)
+                try:
+                    r_schedule, r_stop, r_files, r_seconds = run_r(r_path, *parameters, rscript=rscript)
+                except RuntimeError as error:
+                    result['r_error'] = str(error)
+                else:
+                    result.update({
+                        'r_seconds': _rounded(r_seconds),
+                        'r_ms_per_crop': _per_crop(r_seconds['total'], len(r_schedule)),
+                        'schedule_match': r_schedule == python_schedule,
+                        'first_schedule_difference': _first_difference(python_schedule, r_schedule),
+                        'stop_match': r_stop == python_stop,
+                        'r_pixel_mismatches': check_pixels(source_pixels, r_files),
+                    })
+            result['parity'] = _parity(result)
+            results.append(result)
+            _print_result(result, python_stop)
+
+    if results_path is not None:
+        with open(results_path, 'a', encoding='utf-8') as results_file:
+            for result in results:
+                results_file.write(json.dumps(result) + '\n')
+    return results
+
+
+def _first_difference(python_schedule, r_schedule):
+    # 第一个不同的步骤，便于定位舍入差异/The first differing step, to locate rounding differences
+    for python_step, r_step in zip(python_schedule, r_schedule):
+        if python_step != r_step:
+            return {'python': list(python_step), 'r': list(r_step)}
+    if len(python_schedule) != len(r_schedule):
+        return {'python_crops': len(python_schedule), 'r_crops': len(r_schedule)}
+    return None
+
+
+def _parity(result):
+    # 没有R结果时只看Python自身的检查/Without R results only the Python checks count
+    python_ok = result['python_files_match_schedule'] and not result['python_pixel_mismatches']
+    if 'r_error' in result:
+        return False
+    if 'schedule_match' not in result:
+        return python_ok
+    return python_ok and result['schedule_match'] and result['stop_match'] and not result['r_pixel_mismatches']
+
+
+def _rounded(stage_seconds):
+    return {stage: round(seconds, 6) for stage, seconds in stage_seconds.items()}
+
+
+def _per_crop(seconds, crop_count):
+    return round(seconds / crop_count * 1000, 3) if crop_count else None
+
+
+def _print_result(result, python_stop):
+    print(f"\n{result['case']} {result['size'][0]}x{result['size'][1]}: {result['crops']} 张裁剪/crops, "
+          f"停止于/stops at {python_stop[0]} {sorted(python_stop[1])}")
+    print(f"  Python: " + ', '.join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in result['python_seconds'].items())
+          + f", {result['python_ms_per_crop']} ms/crop")
+    if 'r_seconds' in result:
+        print(f"  R:      " + ', '.join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in result['r_seconds'].items())
+              + f", {result['r_ms_per_crop']} ms/crop")
+        faster = 'Python' if result['python_seconds']['total'] <= result['r_seconds']['total'] else 'R'
+        print(f"  更快/Faster: {faster}")
+    if 'r_error' in result:
+        print(f"  {result['r_error']}")
+    if result.get('r_skipped'):
+        print("  R:      已跳过，未找到Rscript/skipped, Rscript not found")
+    print(f"  一致/Parity{'（仅Python/Python only）' if result.get('r_skipped') else ''}: {'是/yes' if result['parity'] else '否/NO'}")
+    if not result['parity']:
+        print(f"  {json.dumps({key: value for key, value in result.items() if 'mismatch' in key or 'match' in key or 'difference' in key}, ensure_ascii=False)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="逐步裁剪的Python/R对照与速度比较/Stepwise cropper Python/R parity and speed comparison")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rscript', help="Rscript 路径，默认在PATH中查找/Path to Rscript, looked up on PATH by default")
+    parser.add_argument('--results', help="结果JSON-lines文件/JSON-lines results file")
+    parser.add_argument('--cases', help="逗号分隔的用例名称/Comma-separated case names")
+    arguments = parser.parse_args(argv)
+
+    cases = PARITY_CASES
+    if arguments.cases:
+        selected = set(arguments.cases.split(','))
+        cases = [case for case in PARITY_CASES if case[0] in selected]
+    results = run_parity(cases, arguments.seed, arguments.rscript, arguments.results)
+    return 0 if all(result['parity'] for result in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
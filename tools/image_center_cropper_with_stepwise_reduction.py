@@ -1,7 +1,18 @@
-from PIL import Image
+from PIL import Image, TiffImagePlugin
+from multiprocessing import shared_memory
+import json
+import math
 import os
 
-def crop(width_step_pixel, input_image_path, crop_aspect_ratio=1/1, min_size_ratio=0.1, min_pixel_limit=100):
+from batch_image_common import ANCHOR_MODES, apply_orientation, exif_orientation, run_tasks
+from batch_image_instrumentation import StageTimer
+
+# 终止标志位：尺寸低于最小允许值、面积比例低于最小比例/Stop flag bits: size below the minimum allowed value, area ratio below the minimum ratio
+STOP_SIZE = 1
+STOP_AREA = 2
+
+
+def crop(width_step_pixel, input_image_path, crop_aspect_ratio=1/1, min_size_ratio=0.1, min_pixel_limit=100, workers=1, output_mode='files', contact_cell_pixel=256, anchor='center', rank_by_energy=False):
     """
     最终目的/动机
     Ultimate Purpose/Motivation
@@ -46,6 +57,26 @@ def crop(width_step_pixel, input_image_path, crop_aspect_ratio=1/1, min_size_rat
         - crop_aspect_ratio: 裁剪宽高比（默认1:1）/ Crop aspect ratio (default 1:1)
         - min_size_ratio: 最小尺寸比例（默认0.2）/ Minimum size ratio (default 0.2)
         - min_pixel_limit: 最小像素限制（默认100）/ Minimum pixel limit (default 100)
+        - workers: 并行编码的进程数，默认为1表示顺序编码，None表示使用全部CPU核心 / Number of encoding processes, default is 1 for serial encoding, None means all CPU cores
+        - output_mode: 输出模式（默认'files'）/ Output mode (default 'files')
+        - contact_cell_pixel: 联系表中每个缩略图的最大边长（默认256）/ Maximum side length of each thumbnail in the contact sheet (default 256)
+        - anchor: 裁剪锚点（默认'center'）/ Crop anchor (default 'center')
+            * 'center' - 所有裁剪框居中/ All crop boxes are centered
+            * 'energy' - 每一步在缩小的灰度代理图上用积分图找出保留细节最多的位置，适合主体偏离中心的图片/ Each step finds the position that keeps the most detail using a summed-area table on a downscaled grayscale proxy, suited to off-center subjects
+        - rank_by_energy: 是否按保留能量为裁剪序列排序（默认False）/ Whether to rank the crop sequence by retained energy (default False)
+            排序结果写入 原始文件名_energy_ranking.json，见 rank_crops_by_energy
+            The ranking is written to original_filename_energy_ranking.json, see rank_crops_by_energy
+
+    输出模式
+    Output Modes
+        源图片只解码一次，裁剪序列预先计算，各模式只在编码方式上不同
+        The source image is decoded only once and the crop schedule is computed up front, the modes differ only in how crops are encoded
+        - 'files': 每一步输出一个文件（命名规则见上）
+        - 'files': One file per step (see naming rules above)
+        - 'multiframe': 所有裁剪写入一个多页TIFF文件：原始文件名_crops.tiff
+        - 'multiframe': All crops are written into one multi-page TIFF file: original_filename_crops.tiff
+        - 'contact_sheet': 所有裁剪的缩略图拼成一张联系表：原始文件名_contact_sheet.扩展名
+        - 'contact_sheet': Thumbnails of all crops are tiled into one contact sheet: original_filename_contact_sheet.extension
         
     终止条件
     Termination Conditions
@@ -55,114 +86,368 @@ def crop(width_step_pixel, input_image_path, crop_aspect_ratio=1/1, min_size_rat
         - Crop area ratio is less than the minimum size ratio
         上述任一条件满足时，程序停止生成新的裁剪图像
         The program stops generating new cropped images when any of the conditions are met
+
+    返回
+    Returns
+        - 分阶段耗时（秒）{'decode': 解码, 'schedule': 计算序列和裁剪框, 'encode': 裁剪并编码写入} / Per-stage timings in seconds {'decode': decoding, 'schedule': computing the schedule and crop boxes, 'encode': cropping, encoding and writing}
     """
+    # 检查输出模式和裁剪锚点/Check output mode and crop anchor
+    if output_mode not in ('files', 'multiframe', 'contact_sheet'):
+        raise ValueError(f"不支持的输出模式/Unsupported output mode: {output_mode}")
+    if anchor not in ANCHOR_MODES:
+        raise ValueError(f"不支持的裁剪锚点/Unsupported crop anchor: {anchor}")
+
     # 创建输出文件夹/Create output directory
     output_directory = f"{os.path.splitext(input_image_path)[0]}_output"
     os.makedirs(output_directory, exist_ok=True)
     
+    # 分阶段计时，供 benchmark_stepwise_parity 与R实现比较/Per-stage timings, compared against the R implementation by benchmark_stepwise_parity
+    timer = StageTimer()
     with Image.open(input_image_path) as source_image:
+        with timer.stage('decode'):
+            # 只解码一次，后续所有裁剪共享同一像素缓冲区/Decode only once, all later crops share the same pixel buffer
+            source_image.load()
+            # 按EXIF方向校正，手机竖拍照片沿正确的轴裁剪/Correct the EXIF orientation so portrait phone photos are cropped along the right axis
+            source_image = apply_orientation(source_image, exif_orientation(source_image))
+
         # 获取图片尺寸/Get image dimensions
         source_width_pixel, source_height_pixel = source_image.size
-        
-        # 计算初始裁剪框（从中心）/Calculate initial crop frame (from center)
-        if source_width_pixel / source_height_pixel > crop_aspect_ratio:
-            current_crop_height_pixel = source_height_pixel
-            current_crop_width_pixel = int(source_height_pixel * crop_aspect_ratio)
-        else:
-            current_crop_width_pixel = source_width_pixel
-            current_crop_height_pixel = int(source_width_pixel / crop_aspect_ratio)
-        
-        # 计算最小允许尺寸/Calculate minimum allowed dimensions
-        min_allowed_crop_width_pixel = max(current_crop_width_pixel * min_size_ratio, min_pixel_limit)
-        min_allowed_crop_height_pixel = max(current_crop_height_pixel * min_size_ratio, min_pixel_limit)
-        
+
+        with timer.stage('schedule'):
+            # 预先计算完整的裁剪序列/Compute the complete crop schedule up front
+            schedule, stop_reason_zh, stop_reason_en = compute_crop_schedule(
+                source_width_pixel, source_height_pixel, width_step_pixel,
+                crop_aspect_ratio, min_size_ratio, min_pixel_limit)
+            energy_map = None
+            if anchor == 'energy' or rank_by_energy:
+                # 能量图只计算一次，供每一步查询，NumPy按需导入/The energy map is computed once and queried for every step, importing NumPy on demand
+                from batch_image_saliency import EnergyMap
+                energy_map = EnergyMap(source_image)
+            if anchor == 'energy':
+                crop_boxes = [energy_map.best_box(crop_width_pixel, crop_height_pixel)[0] for _, crop_width_pixel, crop_height_pixel, _ in schedule]
+            else:
+                crop_boxes = [
+                    _center_box(source_width_pixel, source_height_pixel, crop_width_pixel, crop_height_pixel)
+                    for _, crop_width_pixel, crop_height_pixel, _ in schedule
+                ]
+
         # 获取文件名信息/Get file name information
         original_file_name, file_extension = os.path.splitext(os.path.basename(input_image_path))
-        crop_sequence_index = 1
-        
-        # 保存初始尺寸作为基准/Save initial dimensions as reference
-        initial_crop_width_pixel = current_crop_width_pixel
-        initial_crop_height_pixel = current_crop_height_pixel
-        
-        while True:
-            # 计算当前面积比例/Calculate current area ratio
-            relative_area_ratio = round(
-                (current_crop_width_pixel * current_crop_height_pixel) / 
-                (initial_crop_width_pixel * initial_crop_height_pixel), 5)
-            
-            # 检查终止条件：当前尺寸不满足要求/Check termination condition: current dimensions not meeting requirements
-            if (current_crop_width_pixel < min_allowed_crop_width_pixel or 
-                current_crop_height_pixel < min_allowed_crop_height_pixel or
-                relative_area_ratio < min_size_ratio):
-                reasons_zh = []
-                reasons_en = []
-                if current_crop_width_pixel < min_allowed_crop_width_pixel or current_crop_height_pixel < min_allowed_crop_height_pixel:
-                    reasons_zh.append(f"宽/高限制(宽={current_crop_width_pixel}, 高={current_crop_height_pixel}) < 最小允许值(宽={min_allowed_crop_width_pixel}, 高={min_allowed_crop_height_pixel})")
-                    reasons_en.append(f"Width/height limit(width={current_crop_width_pixel}, height={current_crop_height_pixel}) < min allowed values(width={min_allowed_crop_width_pixel}, height={min_allowed_crop_height_pixel})")
-                if relative_area_ratio < min_size_ratio:
-                    reasons_zh.append(f"面积比例限制(当前比例={relative_area_ratio}) < 最小比例({min_size_ratio})")
-                    reasons_en.append(f"Area ratio limit(current ratio={relative_area_ratio}) < min ratio({min_size_ratio})")
-                
-                if reasons_zh and reasons_en:
-                    print(f"停止生成图像 {crop_sequence_index}，原因：{', '.join(reasons_zh)}")
-                    print(f"Stop generating image {crop_sequence_index}, reasons: {', '.join(reasons_en)}")
-                break
-                
-            # 裁剪并保存图片/Crop and save image
-            crop_left_position_pixel = (source_width_pixel - current_crop_width_pixel) // 2
-            crop_top_position_pixel = (source_height_pixel - current_crop_height_pixel) // 2
-            source_image.crop(
-                (crop_left_position_pixel, crop_top_position_pixel, 
-                 crop_left_position_pixel + current_crop_width_pixel, 
-                 crop_top_position_pixel + current_crop_height_pixel)
-            ).save(
-                f"{output_directory}/{original_file_name}_crop{crop_sequence_index}_"
-                f"{current_crop_width_pixel}_{current_crop_height_pixel}_{relative_area_ratio}{file_extension.lower()}")
-            
-            # 计算下一步尺寸/Calculate next dimensions
-            next_crop_width_pixel = current_crop_width_pixel - width_step_pixel
-            next_crop_height_pixel = next_crop_width_pixel / crop_aspect_ratio
-            next_crop_width_pixel, next_crop_height_pixel = round(next_crop_width_pixel), round(next_crop_height_pixel)
-            
-            # 计算下一步面积比例/Calculate next area ratio
-            next_relative_area_ratio = round(
-                (next_crop_width_pixel * next_crop_height_pixel) / 
-                (initial_crop_width_pixel * initial_crop_height_pixel), 5)
-            
-            # 检查下一步是否会触发终止条件/Check if next step will trigger termination condition
-            if (next_crop_width_pixel < min_allowed_crop_width_pixel or 
-                next_crop_height_pixel < min_allowed_crop_height_pixel or
-                next_relative_area_ratio < min_size_ratio):
-                reasons_zh = []
-                reasons_en = []
-                if next_crop_width_pixel < min_allowed_crop_width_pixel or next_crop_height_pixel < min_allowed_crop_height_pixel:
-                    reasons_zh.append(f"下一步的 min(宽, 高)({next_crop_width_pixel}, {next_crop_height_pixel}) < 最小允许值({min_pixel_limit})")
-                    reasons_en.append(f"Next step min(width, height)({next_crop_width_pixel}, {next_crop_height_pixel}) < min allowed value({min_pixel_limit})")
-                if next_relative_area_ratio < min_size_ratio:
-                    reasons_zh.append(f"下一步面积比例({next_relative_area_ratio}) < 最小比例({min_size_ratio})")
-                    reasons_en.append(f"Next step area ratio({next_relative_area_ratio}) < min ratio({min_size_ratio})")
-                
-                if reasons_zh and reasons_en:
-                    print(f"停止生成图像 {crop_sequence_index+1}，原因：{', '.join(reasons_zh)}")
-                    print(f"Stop generating image {crop_sequence_index+1}, reasons: {', '.join(reasons_en)}")
-                break
-                
-            # 更新尺寸和序号/Update dimensions and index
-            current_crop_width_pixel, current_crop_height_pixel = next_crop_width_pixel, next_crop_height_pixel
-            crop_sequence_index += 1
-    
-    print(f"完成！已生成 {crop_sequence_index} 张图像，保存在 {output_directory} 文件夹中")
-    print(f"Completed! Generated {crop_sequence_index} images saved in {output_directory} folder")
+
+        if rank_by_energy:
+            ranking = rank_crops_by_energy(energy_map, schedule, crop_boxes)
+            with open(f"{output_directory}/{original_file_name}_energy_ranking.json", 'w', encoding='utf-8') as ranking_file:
+                json.dump(ranking, ranking_file, ensure_ascii=False, indent=2)
+            if ranking:
+                print(f"能量密度最高的裁剪: crop{ranking[0]['index']}，保留能量 {ranking[0]['retained_energy']:.1%}")
+                print(f"Highest energy density crop: crop{ranking[0]['index']}, retained energy {ranking[0]['retained_energy']:.1%}")
+
+        with timer.stage('encode'):
+            if output_mode == 'files':
+                output_paths = [
+                    f"{output_directory}/{original_file_name}_crop{crop_sequence_index}_"
+                    f"{crop_width_pixel}_{crop_height_pixel}_{relative_area_ratio}{file_extension.lower()}"
+                    for crop_sequence_index, crop_width_pixel, crop_height_pixel, relative_area_ratio in schedule
+                ]
+                _save_crops(source_image, crop_boxes, output_paths, workers)
+            elif output_mode == 'multiframe':
+                _save_multiframe(source_image, crop_boxes, f"{output_directory}/{original_file_name}_crops.tiff")
+            else:
+                _save_contact_sheet(
+                    source_image, crop_boxes, contact_cell_pixel,
+                    f"{output_directory}/{original_file_name}_contact_sheet{file_extension.lower()}")
+
+    if stop_reason_zh and stop_reason_en:
+        print(stop_reason_zh)
+        print(stop_reason_en)
+    print(f"完成！已生成 {len(schedule)} 张图像，保存在 {output_directory} 文件夹中")
+    print(f"Completed! Generated {len(schedule)} images saved in {output_directory} folder")
+    return timer.seconds
+
+
+def crop_schedule_array(source_width_pixel, source_height_pixel, width_step_pixel, crop_aspect_ratio=1/1, min_size_ratio=0.1, min_pixel_limit=100):
+    """
+    以数组形式计算完整的裁剪序列（纯函数，向量化，不读写任何文件）
+    Compute the complete crop schedule as an array (pure, vectorized, no file I/O)
+
+    最终目的/动机
+    Ultimate Purpose/Motivation
+        Python和R两个实现必须给出相同的序列，序列的计算与解码、编码分开，才能单独比较和计时
+        The Python and R implementations must produce the same schedule, and keeping it apart from decoding and encoding lets it be compared and timed on its own
+
+    功能说明
+    Function Description
+        - 第一步之后宽度按固定步长递减，所有候选尺寸和面积比例一次性计算，再找出第一个触发终止条件的候选
+        - After the first step the width drops by a constant amount, so every candidate size and area ratio is computed at once and the first candidate that hits a termination condition is located
+        - 高度由取整前的宽度计算，取整规则（四舍六入五成双）与逐步循环和R实现相同
+        - Heights are computed from the width before rounding, with the same round-half-to-even rule as the step-by-step loop and the R implementation
+        - NumPy按需导入
+        - NumPy is imported on demand
+
+    参数
+    Parameters
+        - source_width_pixel / source_height_pixel: 源图片尺寸 / Source image dimensions
+        - 其余参数与 crop() 相同 / Other parameters are the same as crop()
+
+    返回
+    Returns
+        - 结构化数组，字段为 index、width、height、area_ratio、stop / Structured array with the fields index, width, height, area_ratio, stop
+        - 除最后一行外均为要生成的裁剪；最后一行是第一个被拒绝的候选，stop 为 STOP_SIZE 和 STOP_AREA 的按位或
+        - Every row but the last is a crop to generate; the last row is the first rejected candidate, with stop the bitwise or of STOP_SIZE and STOP_AREA
+    """
+    import numpy as np
+
+    # 计算初始裁剪框（从中心）/Calculate initial crop frame (from center)
+    if source_width_pixel / source_height_pixel > crop_aspect_ratio:
+        initial_crop_height_pixel = source_height_pixel
+        initial_crop_width_pixel = int(source_height_pixel * crop_aspect_ratio)
+    else:
+        initial_crop_width_pixel = source_width_pixel
+        initial_crop_height_pixel = int(source_width_pixel / crop_aspect_ratio)
+
+    if initial_crop_width_pixel < 1 or initial_crop_height_pixel < 1:
+        raise ValueError(f"初始裁剪框为空/The initial crop box is empty: {initial_crop_width_pixel}x{initial_crop_height_pixel}")
+
+    # 计算最小允许尺寸/Calculate minimum allowed dimensions
+    min_allowed_crop_width_pixel = max(initial_crop_width_pixel * min_size_ratio, min_pixel_limit)
+    min_allowed_crop_height_pixel = max(initial_crop_height_pixel * min_size_ratio, min_pixel_limit)
+
+    # 取整后的步长从第二步起保持不变（非半整数步长为 round(步长)，半整数步长取整到偶数后也固定）
+    # The rounded decrement is constant from the second step on (round(step) for non-half-integer steps, and half-integer steps settle once rounded to even)
+    first_width_pixel = float(np.round(initial_crop_width_pixel - width_step_pixel))
+    width_decrement_pixel = first_width_pixel - float(np.round(first_width_pixel - width_step_pixel))
+    initial_fits = (initial_crop_width_pixel >= min_allowed_crop_width_pixel
+                    and initial_crop_height_pixel >= min_allowed_crop_height_pixel and 1.0 >= min_size_ratio)
+    if not initial_fits:
+        candidate_count = 1
+    elif width_decrement_pixel <= 0:
+        raise ValueError(f"宽度步长取整后必须为正/The width step must be positive after rounding: {width_step_pixel}")
+    else:
+        # 足够多的候选，保证宽度最终低于最小允许值/Enough candidates that the width eventually drops below the minimum allowed value
+        candidate_count = max(0, math.floor((first_width_pixel - min_allowed_crop_width_pixel) / width_decrement_pixel)) + 3
+
+    # 所有候选尺寸：高度由取整前的宽度计算/All candidate sizes: heights come from the width before rounding
+    widths = np.empty(candidate_count)
+    heights = np.empty(candidate_count)
+    widths[0], heights[0] = initial_crop_width_pixel, initial_crop_height_pixel
+    previous_widths = first_width_pixel - width_decrement_pixel * (np.arange(candidate_count - 1) - 1)
+    previous_widths[:1] = initial_crop_width_pixel
+    widths[1:] = np.round(previous_widths - width_step_pixel)
+    heights[1:] = np.round((previous_widths - width_step_pixel) / crop_aspect_ratio)
+    area_ratios = widths * heights / (initial_crop_width_pixel * initial_crop_height_pixel)
+    # np.round 先乘以10^5再取整，在接近0.5的位置可能与正确舍入的 round() 相差一位，这些少数元素逐个用 round() 重算
+    # np.round scales by 10^5 before rounding and can be one digit off the correctly rounded round() near a half, so those few elements are recomputed one by one with round()
+    scaled = area_ratios * 100000
+    near_half = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    area_ratios = np.round(area_ratios, 5)
+    area_ratios[near_half] = [round(float(widths[position] * heights[position]) / (initial_crop_width_pixel * initial_crop_height_pixel), 5) for position in near_half]
+
+    # 终止标志，截取到第一个被拒绝的候选为止/Stop flags, truncated after the first rejected candidate
+    stop = (((widths < min_allowed_crop_width_pixel) | (heights < min_allowed_crop_height_pixel)) * STOP_SIZE
+            | (area_ratios < min_size_ratio) * STOP_AREA)
+    length = int(np.argmax(stop != 0)) + 1
+
+    schedule = np.zeros(length, dtype=[('index', np.int64), ('width', np.int64), ('height', np.int64), ('area_ratio', np.float64), ('stop', np.uint8)])
+    schedule['index'] = np.arange(1, length + 1)
+    schedule['width'] = widths[:length]
+    schedule['height'] = heights[:length]
+    schedule['area_ratio'] = area_ratios[:length]
+    schedule['stop'] = stop[:length]
+    return schedule
+
+
+def compute_crop_schedule(source_width_pixel, source_height_pixel, width_step_pixel, crop_aspect_ratio=1/1, min_size_ratio=0.1, min_pixel_limit=100):
+    """
+    计算逐步缩小的裁剪序列（纯函数，不读写任何文件）
+    Compute the stepwise reduced crop schedule (pure function, no file I/O)
+
+    由 crop_schedule_array 计算，这里只转换为元组列表并格式化终止原因
+    Computed by crop_schedule_array, this only converts it to a list of tuples and formats the stop reasons
+
+    参数
+    Parameters
+        - source_width_pixel / source_height_pixel: 源图片尺寸 / Source image dimensions
+        - 其余参数与 crop() 相同 / Other parameters are the same as crop()
+
+    返回
+    Returns
+        - (序列, 中文终止原因, 英文终止原因) / (schedule, Chinese stop reason, English stop reason)
+        - 序列的每一项为 (序号, 宽度, 高度, 面积比例) / Each schedule item is (index, width, height, area_ratio)
+        - 终止原因为格式化好的提示文本，序列总在第一个被拒绝的候选处终止，因此总是字符串 / Stop reasons are formatted messages, the schedule always ends at the first rejected candidate so they are always strings
+    """
+    schedule_array = crop_schedule_array(
+        source_width_pixel, source_height_pixel, width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit)
+    # tolist 一次性转换为Python的int和float，文件名和提示与原来的逐步循环完全相同/tolist converts to Python ints and floats in one go, so filenames and messages match the former step-by-step loop exactly
+    rows = list(zip(*(schedule_array[field].tolist() for field in ('index', 'width', 'height', 'area_ratio', 'stop'))))
+    schedule = [row[:4] for row in rows[:-1]]
+    stop_index, stop_width_pixel, stop_height_pixel, stop_area_ratio, stop = rows[-1]
+
+    reasons_zh = []
+    reasons_en = []
+    if stop_index == 1:
+        # 初始尺寸就不满足要求/The initial dimensions already fail the requirements
+        min_allowed_crop_width_pixel = max(stop_width_pixel * min_size_ratio, min_pixel_limit)
+        min_allowed_crop_height_pixel = max(stop_height_pixel * min_size_ratio, min_pixel_limit)
+        if stop & STOP_SIZE:
+            reasons_zh.append(f"宽/高限制(宽={stop_width_pixel}, 高={stop_height_pixel}) < 最小允许值(宽={min_allowed_crop_width_pixel}, 高={min_allowed_crop_height_pixel})")
+            reasons_en.append(f"Width/height limit(width={stop_width_pixel}, height={stop_height_pixel}) < min allowed values(width={min_allowed_crop_width_pixel}, height={min_allowed_crop_height_pixel})")
+        if stop & STOP_AREA:
+            reasons_zh.append(f"面积比例限制(当前比例={stop_area_ratio}) < 最小比例({min_size_ratio})")
+            reasons_en.append(f"Area ratio limit(current ratio={stop_area_ratio}) < min ratio({min_size_ratio})")
+    else:
+        # 下一步会触发终止条件/The next step would hit a termination condition
+        if stop & STOP_SIZE:
+            reasons_zh.append(f"下一步的 min(宽, 高)({stop_width_pixel}, {stop_height_pixel}) < 最小允许值({min_pixel_limit})")
+            reasons_en.append(f"Next step min(width, height)({stop_width_pixel}, {stop_height_pixel}) < min allowed value({min_pixel_limit})")
+        if stop & STOP_AREA:
+            reasons_zh.append(f"下一步面积比例({stop_area_ratio}) < 最小比例({min_size_ratio})")
+            reasons_en.append(f"Next step area ratio({stop_area_ratio}) < min ratio({min_size_ratio})")
+
+    return (schedule,
+            f"停止生成图像 {stop_index}，原因：{', '.join(reasons_zh)}",
+            f"Stop generating image {stop_index}, reasons: {', '.join(reasons_en)}")
+
+
+def rank_crops_by_energy(energy_map, schedule, crop_boxes):
+    """
+    按保留能量为裁剪序列排序
+    Rank the crop sequence by retained energy
+
+    功能说明
+    Function Description
+        - 保留能量：裁剪框内能量占整张图片能量的比例，随裁剪变小而单调减少
+        - Retained energy: the fraction of the whole image's energy inside the crop box, which decreases monotonically as crops get smaller
+        - 排序依据为能量密度（保留能量 / 面积比例），即去掉的边缘中细节越少排名越靠前；相同时面积大的在前
+        - Ranked by energy density (retained energy / area ratio), so crops that removed the least detail with their margins rank first; ties put the larger crop first
+
+    参数
+    Parameters
+        - energy_map: batch_image_saliency.EnergyMap 对象 / batch_image_saliency.EnergyMap object
+        - schedule: compute_crop_schedule 返回的序列 / Schedule returned by compute_crop_schedule
+        - crop_boxes: 与序列对应的裁剪框 / Crop boxes matching the schedule
+
+    返回
+    Returns
+        - 字典列表，包含 index、width、height、area_ratio、box、retained_energy、energy_density / List of dicts with index, width, height, area_ratio, box, retained_energy, energy_density
+    """
+    ranking = []
+    for (crop_sequence_index, crop_width_pixel, crop_height_pixel, relative_area_ratio), crop_box in zip(schedule, crop_boxes):
+        retained_energy = energy_map.retained_energy(crop_box)
+        ranking.append({
+            'index': crop_sequence_index, 'width': crop_width_pixel, 'height': crop_height_pixel,
+            'area_ratio': relative_area_ratio, 'box': list(crop_box),
+            'retained_energy': round(retained_energy, 5),
+            'energy_density': round(retained_energy / relative_area_ratio, 5),
+        })
+    ranking.sort(key=lambda item: (-item['energy_density'], -item['area_ratio']))
+    return ranking
+
+
+def _center_box(source_width_pixel, source_height_pixel, crop_width_pixel, crop_height_pixel):
+    # 计算居中裁剪框/Calculate the centered crop box
+    crop_left_position_pixel = (source_width_pixel - crop_width_pixel) // 2
+    crop_top_position_pixel = (source_height_pixel - crop_height_pixel) // 2
+    return (crop_left_position_pixel, crop_top_position_pixel,
+            crop_left_position_pixel + crop_width_pixel,
+            crop_top_position_pixel + crop_height_pixel)
+
+
+def _save_crops(source_image, crop_boxes, output_paths, workers):
+    # 顺序编码：直接从已解码的源图片裁剪/Serial encoding: crop directly from the decoded source image
+    if workers == 1:
+        for crop_box, output_path in zip(crop_boxes, output_paths):
+            source_image.crop(crop_box).save(output_path)
+        return
+
+    # 并行编码：将像素复制到共享内存，工作进程只读取其中的区域/Parallel encoding: copy pixels into shared memory, workers only read their region
+    pixel_bytes = source_image.tobytes()
+    shared_pixels = shared_memory.SharedMemory(create=True, size=max(len(pixel_bytes), 1))
+    try:
+        shared_pixels.buf[:len(pixel_bytes)] = pixel_bytes
+        del pixel_bytes
+        tasks = (
+            (shared_pixels.name, source_image.mode, source_image.size, source_image.getpalette(),
+             source_image.info, crop_box, output_path)
+            for crop_box, output_path in zip(crop_boxes, output_paths)
+        )
+        for _, _, error in run_tasks(_encode_shared_crop, tasks, workers):
+            if error is not None:
+                raise error
+    finally:
+        shared_pixels.close()
+        shared_pixels.unlink()
+
+
+def _encode_shared_crop(shared_name, mode, size, palette, info, crop_box, output_path):
+    # 在工作进程中从共享像素缓冲区裁剪并编码/Crop from the shared pixel buffer and encode it in a worker process
+    shared_pixels = shared_memory.SharedMemory(name=shared_name)
+    try:
+        source_image = Image.frombuffer(mode, size, shared_pixels.buf, 'raw', mode, 0, 1)
+        cropped_image = source_image.crop(crop_box)
+        # frombuffer 不保留调色板和附加信息，需要手动恢复/frombuffer drops the palette and extra info, restore them manually
+        if palette is not None:
+            cropped_image.putpalette(palette)
+        cropped_image.info.update(info)
+        # 释放对共享缓冲区的引用后才能关闭/References to the shared buffer must be released before closing
+        del source_image
+        cropped_image.save(output_path)
+    finally:
+        shared_pixels.close()
+
+
+def _save_multiframe(source_image, crop_boxes, output_path):
+    # 逐页写入多页TIFF，内存中同时只保留一个裁剪/Write the multi-page TIFF page by page, keeping only one crop in memory at a time
+    with TiffImagePlugin.AppendingTiffWriter(output_path, new=True) as tiff_file:
+        for crop_box in crop_boxes:
+            source_image.crop(crop_box).save(tiff_file, format='TIFF')
+            tiff_file.newFrame()
+
+
+def _save_contact_sheet(source_image, crop_boxes, contact_cell_pixel, output_path):
+    # 所有裁剪宽高比相同，按第一张计算缩略图尺寸/All crops share the aspect ratio, size thumbnails from the first one
+    if not crop_boxes:
+        return
+    first_left, first_top, first_right, first_bottom = crop_boxes[0]
+    scale = contact_cell_pixel / max(first_right - first_left, first_bottom - first_top)
+    thumbnail_width_pixel = max(1, round((first_right - first_left) * scale))
+    thumbnail_height_pixel = max(1, round((first_bottom - first_top) * scale))
+
+    # 调色板等模式先转换，保证缩放质量/Convert palette and other modes first for proper resampling quality
+    if source_image.mode not in ('RGB', 'RGBA', 'L'):
+        has_alpha = 'A' in source_image.mode or 'transparency' in source_image.info
+        source_image = source_image.convert('RGBA' if has_alpha else 'RGB')
+    if source_image.mode == 'RGBA' and output_path.endswith(('.jpg', '.jpeg')):
+        source_image = source_image.convert('RGB')
+
+    columns = math.ceil(math.sqrt(len(crop_boxes)))
+    rows = math.ceil(len(crop_boxes) / columns)
+    contact_sheet = Image.new(source_image.mode, (columns * thumbnail_width_pixel, rows * thumbnail_height_pixel), 'white')
+    for position, crop_box in enumerate(crop_boxes):
+        # 缩放时直接指定源区域，避免生成全分辨率裁剪/Resample straight from the source region without creating a full-resolution crop
+        thumbnail = source_image.resize(
+            (thumbnail_width_pixel, thumbnail_height_pixel), Image.Resampling.LANCZOS,
+            box=crop_box, reducing_gap=3.0)
+        row, column = divmod(position, columns)
+        contact_sheet.paste(thumbnail, (column * thumbnail_width_pixel, row * thumbnail_height_pixel))
+    contact_sheet.save(output_path)
 
 
 # 使用示例/Usage example
-# first
-crop(
-    width_step_pixel=20,
-    input_image_path='D:\\path\\to\\your\\JPG\\Aaaawesome_photo_center.jpg',
-    crop_aspect_ratio=16/9,
-    min_size_ratio=0.0025,
-    min_pixel_limit=100
-)
-# second
-crop(5, "C:/path/to/your/PNG/small_photo_center.png", 1, 0.01, 50)
\ No newline at end of file
+# 放在主模块保护下，避免导入或工作进程启动时执行/Guarded so that importing or starting worker processes does not run it
+if __name__ == "__main__":
+    # first
+    crop(
+        width_step_pixel=20,
+        input_image_path='D:\\path\\to\\your\\JPG\\Aaaawesome_photo_center.jpg',
+        crop_aspect_ratio=16/9,
+        min_size_ratio=0.0025,
+        min_pixel_limit=100
+    )
+    # second
+    crop(5, "C:/path/to/your/PNG/small_photo_center.png", 1, 0.01, 50)
+    # third: 一次解码，并行编码所有裁剪/Decode once and encode all crops in parallel
+    crop(20, 'D:/path/to/your/JPG/huge_photo.jpg', 16/9, 0.0025, 100, workers=None)
+    # fourth: 所有裁剪写入一个多页TIFF/Write all crops into one multi-page TIFF
+    crop(20, 'D:/path/to/your/JPG/huge_photo.jpg', 16/9, 0.0025, 100, output_mode='multiframe')
+    # fifth: 主体偏离中心时按能量跟随主体，并按保留能量排序/Follow an off-center subject by energy and rank the crops by retained energy
+    crop(20, 'D:/path/to/your/JPG/off_center_photo.jpg', 1, 0.01, 100, anchor='energy', rank_by_energy=True)
@@ -0,0 +1,327 @@
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+
+# 子命令对应的模块和函数，按需导入，--help 和参数错误不会加载Pillow/NumPy/Subcommand modules and functions, imported on demand so --help and argument errors never load Pillow/NumPy
+COMMANDS = {
+    'expand': ('batch_image_formatter_and_expander', 'fixed_ratio_expand'),
+    'crop': ('batch_image_formatter_and_cropper', 'fixed_ratio_crop'),
+    'stepwise-crop': ('image_center_cropper_with_stepwise_reduction', 'crop'),
+    'pipeline': ('batch_image_pipeline', 'fixed_ratio_pipeline'),
+}
+
+# 需要从文本解析的参数及其解析函数名/Options parsed from text and the name of their parser
+TEXT_OPTIONS = {
+    'target_aspect_ratio': 'parse_ratio',
+    'crop_aspect_ratio': 'parse_ratio',
+    'max_output_size': 'parse_size',
+    'target_file_size': 'parse_file_size',
+    'memory_budget': 'parse_file_size',
+    'srcset_widths': 'parse_widths',
+    'srcset_formats': 'parse_names',
+}
+
+# 命令行选项的可选值，与各模块中的常量相同；在这里列出是为了让解析器不导入Pillow
+# Allowed values of command-line options, the same as the constants in the modules; listed here so the parser never imports Pillow
+ENCODE_PROFILES = ('fast', 'balanced', 'smallest', 'lossless')
+HASH_METHODS = ('ahash', 'dhash', 'phash')
+DUPLICATE_ACTIONS = ('skip', 'symlink')
+VERBOSITY_LEVELS = ('files', 'progress', 'summary', 'quiet')
+FILL_MODES = ('color', 'edge', 'blur')
+ANCHOR_MODES = ('center', 'energy')
+OUTPUT_MODES = ('files', 'multiframe', 'contact_sheet')
+
+# 作业文件中相对于作业文件所在目录解析的路径参数/Path options resolved relative to the job file's directory
+PATH_OPTIONS = ('input_folder', 'output_folder', 'input_image_path', 'event_log', 'plan_path')
+
+
+def run_job(command, options, base_folder=None, defaults=None):
+    """
+    在当前进程中运行一个作业
+    Run one job in the current process
+
+    功能说明
+    Function Description
+        - 选项名与对应函数的关键字参数相同，如 fixed_ratio_expand 的 target_aspect_ratio
+        - Option names are the keyword arguments of the matching function, e.g. target_aspect_ratio of fixed_ratio_expand
+        - 宽高比、尺寸、文件大小和列表可以写成文本：'4/3'、'1920x1080'、'200k'、'1600,800,400'
+        - Aspect ratios, sizes, file sizes and lists may be given as text: '4/3', '1920x1080', '200k', '1600,800,400'
+        - workers 为0表示使用全部CPU核心，与各工具的命令行一致
+        - workers of 0 means all CPU cores, consistent with the tools' command lines
+        - pipeline 作业的 stages 为 [{'crop': '4/3'}, {'expand': 1}, {'resize': '1600x1600'}, {'mode': 'RGB'}] 形式的列表
+        - The stages of a pipeline job are a list like [{'crop': '4/3'}, {'expand': 1}, {'resize': '1600x1600'}, {'mode': 'RGB'}]
+
+    参数
+    Parameters
+        - command: 子命令名称，见 COMMANDS / Subcommand name, see COMMANDS
+        - options: 关键字参数字典 / Dictionary of keyword arguments
+        - base_folder: 相对路径的基准目录，默认为None表示当前目录 / Base directory for relative paths, default is None meaning the current directory
+        - defaults: 默认选项，只使用该命令接受的部分 / Default options, only those the command accepts are used
+
+    返回
+    Returns
+        - 处理失败的文件列表，stepwise-crop 为空列表 / List of failed files, an empty list for stepwise-crop
+    """
+    if command not in COMMANDS:
+        raise ValueError(f"不支持的命令/Unsupported command: {command}")
+    module_name, function_name = COMMANDS[command]
+    module = __import__(module_name)
+    function = getattr(module, function_name)
+
+    accepted = inspect.signature(function).parameters
+    if command == 'pipeline':
+        accepted = {**accepted, 'anchor': None, 'background_color': None, 'fill_mode': None}
+    options = {**{name: value for name, value in (defaults or {}).items() if name in accepted}, **options}
+    parsers = __import__('batch_image_pipeline')
+    for name, parser_name in TEXT_OPTIONS.items():
+        if isinstance(options.get(name), str):
+            options[name] = getattr(parsers, parser_name)(options[name])
+    if base_folder is not None:
+        for name in PATH_OPTIONS:
+            if isinstance(options.get(name), str):
+                options[name] = os.path.join(base_folder, os.path.expanduser(options[name]))
+    if options.get('workers', 1) == 0:
+        options['workers'] = None
+    if isinstance(options.get('background_color'), list):
+        options['background_color'] = tuple(options['background_color'])
+    if command == 'pipeline':
+        options['stages'] = _pipeline_stages(
+            parsers, options.get('stages', ()), options.pop('anchor', 'center'),
+            options.pop('background_color', 'white'), options.pop('fill_mode', 'color'))
+
+    result = function(**options)
+    # stepwise-crop 返回分阶段耗时而不是失败列表/stepwise-crop returns stage timings rather than a list of failures
+    return [] if result is None or command == 'stepwise-crop' else result
+
+
+def _pipeline_stages(pipeline, stage_options, anchor, background_color, fill_mode):
+    # 将作业文件中的阶段列表转换为阶段对象/Convert the stage list of a job file into stage objects
+    stages = []
+    for stage_option in stage_options:
+        if isinstance(stage_option, dict) and len(stage_option) == 1:
+            (kind, value), = stage_option.items()
+        else:
+            raise ValueError(f"阶段应为单键字典/A stage should be a single-key dictionary: {stage_option}")
+        if kind == 'crop':
+            stages.append(pipeline.CropStage(pipeline.parse_ratio(str(value)), anchor))
+        elif kind == 'expand':
+            stages.append(pipeline.ExpandStage(pipeline.parse_ratio(str(value)), background_color, fill_mode))
+        elif kind == 'resize':
+            stages.append(pipeline.ResizeStage(pipeline.parse_size(value) if isinstance(value, str) else tuple(value)))
+        elif kind == 'mode':
+            stages.append(pipeline.ConvertStage(value))
+        else:
+            raise ValueError(f"不支持的阶段/Unsupported stage: {kind}")
+    if not stages:
+        raise ValueError("至少需要一个阶段/At least one stage is required")
+    return stages
+
+
+def load_jobs(job_file_path):
+    """
+    读取批量作业文件（JSON或YAML）
+    Read a batch job file (JSON or YAML)
+
+    功能说明
+    Function Description
+        - 文件内容为作业列表，或 {'defaults': {...}, 'jobs': [...]}，defaults 中的选项作为每个作业接受的默认值
+        - The file holds a list of jobs, or {'defaults': {...}, 'jobs': [...]}, whose defaults apply to every job that accepts them
+        - 每个作业是带 'command' 键的字典，其余键为 run_job 的选项
+        - Each job is a dictionary with a 'command' key, the other keys are run_job options
+        - .yaml/.yml 文件需要安装PyYAML，只在读取YAML时导入
+        - .yaml/.yml files require PyYAML, which is imported only when reading YAML
+
+    返回
+    Returns
+        - (默认选项字典, [(命令, 选项字典)]) / (default options dictionary, [(command, options dictionary)])
+    """
+    with open(job_file_path, encoding='utf-8') as job_file:
+        if os.path.splitext(job_file_path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("读取YAML作业文件需要安装PyYAML/PyYAML is required to read YAML job files") from None
+            content = yaml.safe_load(job_file)
+        else:
+            content = json.load(job_file)
+
+    if isinstance(content, list):
+        defaults, job_list = {}, content
+    elif isinstance(content, dict) and isinstance(content.get('jobs'), list):
+        defaults, job_list = content.get('defaults') or {}, content['jobs']
+    else:
+        raise ValueError(f"作业文件应为作业列表或包含 'jobs' 的字典/The job file should be a list of jobs or a dictionary with 'jobs': {job_file_path}")
+
+    jobs = []
+    for index, job in enumerate(job_list, 1):
+        if not isinstance(job, dict) or job.get('command') not in COMMANDS:
+            raise ValueError(f"第 {index} 个作业缺少有效的 'command'/Job {index} has no valid 'command': {job}")
+        options = dict(job)
+        jobs.append((options.pop('command'), options))
+    return defaults, jobs
+
+
+def run_job_file(job_file_path, keep_going=True):
+    """
+    在一个进程中依次运行作业文件中的所有作业，Pillow/NumPy和工作进程池的启动开销只付一次
+    Run every job of a job file one after another in one process, so the Pillow/NumPy startup cost is paid only once
+
+    参数
+    Parameters
+        - job_file_path: 作业文件路径，相对路径按作业文件所在目录解析 / Job file path, relative paths inside are resolved against its directory
+        - keep_going: 作业出错后是否继续运行后续作业，默认为True / Whether to keep running later jobs after a job errors, default is True
+
+    返回
+    Returns
+        - 失败（出错或有文件处理失败）的作业数 / Number of failed jobs (errored or with failed files)
+    """
+    defaults, jobs = load_jobs(job_file_path)
+    base_folder = os.path.dirname(os.path.abspath(job_file_path))
+    failed_jobs = 0
+    for index, (command, options) in enumerate(jobs, 1):
+        print(f"\n作业 {index}/{len(jobs)}: {command}")
+        print(f"Job {index}/{len(jobs)}: {command}")
+        start_time = time.perf_counter()
+        try:
+            failures = run_job(command, options, base_folder, defaults)
+        except (OSError, TypeError, ValueError) as error:
+            print(f"作业出错/Job error: {type(error).__name__}: {error}", file=sys.stderr)
+            failures = [error]
+            if not keep_going:
+                return failed_jobs + 1
+        failed_jobs += bool(failures)
+        print(f"作业耗时/Job time: {time.perf_counter() - start_time:.2f}s")
+    print(f"\n完成 {len(jobs)} 个作业，失败 {failed_jobs} 个")
+    print(f"Finished {len(jobs)} jobs, {failed_jobs} failed")
+    return failed_jobs
+
+
+def _add_folder_options(parser):
+    # expand、crop 和 pipeline 共用的批处理选项/Batch options shared by expand, crop and pipeline
+    parser.add_argument('input_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('--format', dest='output_format', help="输出格式/Output format")
+    parser.add_argument('--workers', type=int, default=1, help="进程数，0表示全部CPU核心/Number of processes, 0 means all CPU cores")
+    parser.add_argument('--profile', dest='encode_profile', choices=ENCODE_PROFILES, help="编码配置/Encode profile")
+    parser.add_argument('--target-size', dest='target_file_size', help="目标文件大小，如 200k/Target file size, e.g. 200k")
+    parser.add_argument('--dedup', dest='deduplicate', choices=HASH_METHODS, help="处理前检测重复图片/Detect duplicate images before processing")
+    parser.add_argument('--dedup-distance', dest='duplicate_distance', type=int, help="视为重复的最大汉明距离，默认按算法容忍重新编码：ahash 2、dhash 6、phash 10/Maximum Hamming distance treated as a duplicate, by default tolerant of re-encoding per method: ahash 2, dhash 6, phash 10")
+    parser.add_argument('--dedup-action', dest='duplicate_action', default='skip', choices=DUPLICATE_ACTIONS, help="重复文件的处理方式/How duplicates are handled")
+    parser.add_argument('--srcset', dest='srcset_widths', help="响应式尺寸阶梯的宽度，如 1600,800,400/Responsive size ladder widths, e.g. 1600,800,400")
+    parser.add_argument('--srcset-formats', default='webp,jpeg', help="尺寸阶梯的输出格式/Size ladder output formats, e.g. webp,jpeg")
+    parser.add_argument('--prefetch', type=int, default=0, help="流水线预读文件数，0表示不使用流水线/Number of files prefetched by the pipeline, 0 disables it")
+    parser.add_argument('--recursive', action='store_true', help="递归处理子目录/Process subdirectories recursively")
+    parser.add_argument('--include', action='append', help="只处理文件名或相对路径匹配的文件，可重复，如 '*.jpg'/Only process files whose name or relative path matches, repeatable, e.g. '*.jpg'")
+    parser.add_argument('--exclude', action='append', help="跳过文件名或相对路径匹配的文件，可重复，如 'drafts/*'/Skip files whose name or relative path matches, repeatable, e.g. 'drafts/*'")
+    parser.add_argument('--incremental', action='store_true', help="跳过清单中记录为未变化的文件/Skip files the manifest records as unchanged")
+    parser.add_argument('--content-hash', action='store_true', help="修改时间变化时按内容哈希判断文件是否变化/Use a content hash to decide whether a file changed when its mtime did")
+    parser.add_argument('--prune-stale', action='store_true', help="增量处理时删除源文件已不存在或已重新生成的过期输出/With incremental processing, delete stale outputs whose source is gone or was regenerated")
+    parser.add_argument('--resume', action='store_true', help="从作业日志继续，只重试失败和未处理的文件/Continue from the job journal, retrying only failed and unprocessed files")
+    parser.add_argument('--verbosity', default='files', choices=VERBOSITY_LEVELS, help="输出详细程度/Output verbosity")
+    parser.add_argument('--event-log', help="JSON-lines事件日志路径/JSON-lines event log path")
+    parser.add_argument('--dry-run', action='store_true', help="只读取文件头打印计划/Only read headers and print the plan")
+    parser.add_argument('--plan', dest='plan_path', help="只读取文件头并将计划写入JSON/Only read headers and write the plan to JSON")
+
+
+def build_parser():
+    """
+    构建 mine-img 命令行解析器，只依赖标准库
+    Build the mine-img command-line parser, using the standard library only
+    """
+    parser = argparse.ArgumentParser(prog='mine-img', description="批量图像工具/Batch image tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    expand = commands.add_parser('expand', help="按比例向外扩充/Expand outward to an aspect ratio")
+    _add_folder_options(expand)
+    expand.add_argument('--ratio', dest='target_aspect_ratio', required=True, help="目标宽高比，如 4/3/Target aspect ratio, e.g. 4/3")
+    expand.add_argument('--background', dest='background_color', default='white', help="背景颜色/Background color")
+    expand.add_argument('--fill', dest='fill_mode', default='color', choices=FILL_MODES, help="填充模式/Fill mode")
+    expand.add_argument('--numpy', dest='use_numpy', action='store_true', help="使用NumPy合成/Composite with NumPy")
+    expand.add_argument('--max-size', dest='max_output_size', help="最大输出尺寸，如 1920x1080/Maximum output size, e.g. 1920x1080")
+    expand.add_argument('--memory-budget', help="内存预算，如 256M；只有未压缩输入（TIFF、BMP）能分块流式处理，超出预算的JPEG缩小解码，其他格式完整解码并警告"
+                        "/Memory budget, e.g. 256M; only uncompressed inputs (TIFF, BMP) are streamed in bands, a JPEG over it is decoded downscaled, other formats are decoded in full with a warning")
+
+    crop = commands.add_parser('crop', help="按比例裁剪/Crop to an aspect ratio")
+    _add_folder_options(crop)
+    crop.add_argument('--ratio', dest='crop_aspect_ratio', help="裁剪宽高比，默认保持原比例/Crop aspect ratio, keeps the original by default")
+    crop.add_argument('--anchor', default='center', choices=ANCHOR_MODES, help="裁剪锚点/Crop anchor")
+    crop.add_argument('--max-size', dest='max_output_size', help="最大输出尺寸，如 1920x1080/Maximum output size, e.g. 1920x1080")
+    crop.add_argument('--memory-budget', help="内存预算，如 256M；只有未压缩输入（TIFF、BMP）能分块流式处理，超出预算的JPEG缩小解码，其他格式完整解码并警告"
+                        "/Memory budget, e.g. 256M; only uncompressed inputs (TIFF, BMP) are streamed in bands, a JPEG over it is decoded downscaled, other formats are decoded in full with a warning")
+
+    stepwise = commands.add_parser('stepwise-crop', help="逐步缩小的居中裁剪序列/Stepwise shrinking crop sequence")
+    stepwise.add_argument('images', nargs='+', help="输入图片，可以有多张/Input images, several are allowed")
+    stepwise.add_argument('--step', dest='width_step_pixel', type=int, required=True, help="每次缩小的宽度步长（像素）/Width reduction step per iteration (pixels)")
+    stepwise.add_argument('--ratio', dest='crop_aspect_ratio', default='1', help="裁剪宽高比/Crop aspect ratio")
+    stepwise.add_argument('--min-size-ratio', type=float, default=0.1, help="最小尺寸比例/Minimum size ratio")
+    stepwise.add_argument('--min-pixel', dest='min_pixel_limit', type=int, default=100, help="最小像素限制/Minimum pixel limit")
+    stepwise.add_argument('--workers', type=int, default=1, help="进程数，0表示全部CPU核心/Number of processes, 0 means all CPU cores")
+    stepwise.add_argument('--output-mode', default='files', choices=OUTPUT_MODES, help="输出模式/Output mode")
+    stepwise.add_argument('--contact-cell', dest='contact_cell_pixel', type=int, default=256, help="联系表缩略图边长/Contact sheet thumbnail side length")
+    stepwise.add_argument('--anchor', default='center', choices=ANCHOR_MODES, help="裁剪锚点/Crop anchor")
+    stepwise.add_argument('--rank-by-energy', action='store_true', help="按保留能量排序/Rank crops by retained energy")
+
+    # pipeline 的参数由 batch_image_pipeline.main 解析/The pipeline's options are parsed by batch_image_pipeline.main
+    commands.add_parser('pipeline', add_help=False, help="组合处理管线，参数同 batch_image_pipeline.py/Composable pipeline, same options as batch_image_pipeline.py")
+
+    jobs = commands.add_parser('run', help="在一个进程中运行作业文件/Run a job file in one process")
+    jobs.add_argument('job_file', help="JSON或YAML作业文件/JSON or YAML job file")
+    jobs.add_argument('--stop-on-error', action='store_true', help="作业出错时停止/Stop when a job errors")
+    return parser
+
+
+def main(argv=None):
+    """
+    mine-img 命令行入口
+    mine-img command-line entry
+
+    示例/Examples
+        mine-img expand D:/photos/in D:/photos/out --ratio 4/3 --background "#2181A1" --format webp
+        mine-img crop D:/photos/in D:/photos/out --ratio 16:9 --anchor energy --workers 0
+        mine-img crop D:/photos/in D:/photos/out --ratio 4/5 --plan plan.json
+        mine-img stepwise-crop D:/photos/a.jpg D:/photos/b.jpg --step 20 --ratio 16/9
+        mine-img pipeline D:/photos/in D:/photos/out --crop 4/3 --resize 1920x1080
+        mine-img run jobs.yaml
+
+    作业文件示例/Job file example (jobs.yaml)
+        defaults:
+          workers: 0
+          verbosity: progress
+        jobs:
+          - command: expand
+            input_folder: in
+            output_folder: out/expanded
+            target_aspect_ratio: 4/3
+          - command: pipeline
+            input_folder: in
+            output_folder: out/web
+            stages: [{crop: 16/9}, {resize: 1600x1600}]
+            output_format: webp
+            target_file_size: 200k
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ['pipeline']:
+        from batch_image_pipeline import main as pipeline_main
+        return pipeline_main(argv[1:], prog='mine-img pipeline')
+
+    parser = build_parser()
+    arguments = vars(parser.parse_args(argv))
+    command = arguments.pop('command')
+    try:
+        if command == 'run':
+            return 1 if run_job_file(arguments['job_file'], not arguments['stop_on_error']) else 0
+        if command == 'stepwise-crop':
+            images = arguments.pop('images')
+            for image_path in images:
+                run_job(command, {**arguments, 'input_image_path': image_path})
+            return 0
+        return 1 if run_job(command, arguments) else 0
+    except ValueError as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 工具脚本是顶层模块，位于测试目录的上一级/The tool scripts are top-level modules one level above the tests directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
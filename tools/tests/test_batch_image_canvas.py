@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from batch_image_canvas import expand_array
+from batch_image_common import expand_layout, new_canvas
+
+
+def noise_image(mode, size, seed=0):
+    generator = np.random.default_rng(seed)
+    image = Image.fromarray(generator.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8), 'RGBA')
+    return image.convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'LA', 'P', 'CMYK'])
+@pytest.mark.parametrize('size, ratio', [((120, 80), 1), ((80, 120), 16/9), ((97, 31), 0.7), ((64, 64), 1)])
+def test_color_fill_matches_pillow_paste(mode, size, ratio):
+    image = noise_image(mode, size)
+    background_color = (33, 129, 161, 200)
+    new_width, new_height, paste_x, paste_y = expand_layout(size, ratio)
+
+    expected = new_canvas(image.mode, (new_width, new_height), background_color)
+    expected.paste(image, (paste_x, paste_y))
+    actual = expand_array(image, (new_width, new_height), (paste_x, paste_y), background_color)
+    assert actual.mode == expected.mode
+    assert np.array_equal(np.asarray(actual), np.asarray(expected))
+
+
+def test_edge_fill_replicates_borders():
+    image = noise_image('RGB', (40, 30))
+    expanded = np.asarray(expand_array(image, (60, 50), (7, 11), fill_mode='edge'))
+    source = np.asarray(image)
+    assert np.array_equal(expanded[11:41, 7:47], source)
+    assert np.array_equal(expanded[0, 7:47], source[0])
+    assert np.array_equal(expanded[-1, 7:47], source[-1])
+    assert np.array_equal(expanded[0, 0], source[0, 0]) and np.array_equal(expanded[-1, -1], source[-1, -1])
+
+
+@pytest.mark.parametrize('canvas_size, paste_position', [((100, 80), (0, 0)), ((120, 81), (21, 0)), ((120, 80), (-1, 0))])
+def test_source_outside_canvas_is_rejected(canvas_size, paste_position):
+    with pytest.raises(ValueError):
+        expand_array(noise_image('RGB', (100, 81)), canvas_size, paste_position)
+
+
+@pytest.mark.parametrize('first_key, second_key', [(None, None), ('first', 'second')])
+def test_results_are_not_overwritten_by_another_caller(first_key, second_key):
+    # RGBA画布由 Image.fromarray 直接共享内存，RGB画布会被复制/RGBA canvases share memory through Image.fromarray, RGB canvases are copied
+    first = expand_array(noise_image('RGBA', (40, 30), seed=1), (40, 40), (0, 5), fill_mode='edge', cache_key=first_key)
+    expected = np.asarray(first).copy()
+    expand_array(noise_image('RGBA', (40, 30), seed=2), (40, 40), (0, 5), fill_mode='edge', cache_key=second_key)
+    assert np.array_equal(np.asarray(first), expected)
+
+
+def test_pipeline_expand_stages_keep_their_own_canvas():
+    from batch_image_pipeline import ExpandStage
+    first_stage, second_stage = ExpandStage(1, fill_mode='edge'), ExpandStage(1, fill_mode='edge')
+    first = first_stage(noise_image('RGBA', (40, 30), seed=1))
+    expected = np.asarray(first).copy()
+    second_stage(noise_image('RGBA', (30, 40), seed=2))
+    assert np.array_equal(np.asarray(first), expected)
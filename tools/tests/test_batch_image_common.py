@@ -0,0 +1,183 @@
+import os
+
+import pytest
+
+from batch_image_common import ENCODE_PROFILES, check_encode_options, encode_image, iter_image_files, open_image, partial_path, write_output
+
+
+def test_write_output_replaces_atomically(tmp_path):
+    output_path = str(tmp_path / 'photo_crop.jpg')
+    write_output(output_path, b'old')
+    write_output(output_path, b'new')
+    assert open(output_path, 'rb').read() == b'new'
+    assert os.listdir(tmp_path) == ['photo_crop.jpg']
+
+
+@pytest.mark.parametrize('error_class', [OSError, KeyboardInterrupt])
+def test_write_output_leaves_no_partial_file_on_error(tmp_path, error_class):
+    output_path = str(tmp_path / 'photo_crop.tiff')
+    write_output(output_path, b'previous')
+
+    def failing_stream(output_file):
+        output_file.write(b'half')
+        raise error_class('interrupted')
+
+    with pytest.raises(error_class):
+        write_output(output_path, failing_stream)
+    assert not os.path.exists(partial_path(output_path))
+    # 旧输出保持完整/The previous output stays intact
+    assert open(output_path, 'rb').read() == b'previous'
+    assert os.listdir(tmp_path) == ['photo_crop.tiff']
+
+
+def make_tree(root, relative_paths):
+    for relative_path in relative_paths:
+        path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            # 只有 .png 以外的扩展名才需要真实的文件头/Only files without a supported extension need a real header
+            file.write(b'\x89PNG\r\n\x1a\n' if relative_path.endswith('.dat') else b'not an image')
+
+
+WALK_TREE = ['a.jpg', 'b.PNG', 'notes.txt', 'raw.dat', 'drafts/c.jpg', 'drafts/old/d.webp', 'site/e.jpeg']
+
+
+def walked(root, **options):
+    return [relative_path.replace(os.sep, '/') for relative_path in iter_image_files(str(root), **options)]
+
+
+def test_iter_image_files_order_and_recursion(tmp_path):
+    make_tree(str(tmp_path), WALK_TREE)
+    assert walked(tmp_path) == ['a.jpg', 'b.PNG', 'raw.dat']
+    assert walked(tmp_path, recursive=True) == ['a.jpg', 'b.PNG', 'raw.dat', 'drafts/c.jpg', 'drafts/old/d.webp', 'site/e.jpeg']
+    assert walked(tmp_path, recursive=True, skip_folders=[str(tmp_path / 'drafts')]) == ['a.jpg', 'b.PNG', 'raw.dat', 'site/e.jpeg']
+
+
+@pytest.mark.parametrize('include, exclude, expected', [
+    # 模式匹配文件名/Patterns match the filename
+    ('*.jpg', None, ['a.jpg', 'drafts/c.jpg']),
+    (['*.jpg', '*.jpeg'], None, ['a.jpg', 'drafts/c.jpg', 'site/e.jpeg']),
+    # 或以/分隔的相对路径/Or the /-separated relative path
+    ('drafts/*', None, ['drafts/c.jpg', 'drafts/old/d.webp']),
+    (None, 'drafts/*', ['a.jpg', 'b.PNG', 'raw.dat', 'site/e.jpeg']),
+    # 排除优先于包含/Exclude wins over include
+    ('*.jp*g', ['drafts/*', 'e.*'], ['a.jpg']),
+    ('*.gif', None, []),
+])
+def test_iter_image_files_include_exclude(tmp_path, include, exclude, expected):
+    make_tree(str(tmp_path), WALK_TREE)
+    assert walked(tmp_path, recursive=True, include=include, exclude=exclude) == expected
+
+
+def test_open_image_reports_jpeg_downscale(tmp_path, capsys):
+    from PIL import Image
+    path = str(tmp_path / 'big.jpg')
+    Image.new('RGB', (800, 600), (10, 20, 30)).save(path)
+
+    img, tiled, decode_scale = open_image(path, 800 * 600 * 3 // 3)
+    with img:
+        assert (tiled, decode_scale, img.size) == (False, 2, (400, 300))
+    assert 'decoded at 1/2' in capsys.readouterr().err
+
+    img, tiled, decode_scale = open_image(path, 800 * 600 * 3)
+    with img:
+        assert (tiled, decode_scale, img.size) == (False, 1, (800, 600))
+
+
+def test_open_image_keeps_bomb_check_for_compressed_formats(tmp_path, monkeypatch):
+    from PIL import Image
+    Image.new('RGB', (100, 100)).save(tmp_path / 'bomb.png')
+    Image.new('RGB', (100, 100)).save(tmp_path / 'raw.bmp')
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+
+    with pytest.raises(Image.DecompressionBombError):
+        open_image(str(tmp_path / 'bomb.png'), 1000)
+    # 能按行带流式读取的未压缩图片不受限制/Uncompressed images that can be streamed are exempt
+    img, tiled, decode_scale = open_image(str(tmp_path / 'raw.bmp'), 1000)
+    with img:
+        assert (tiled, decode_scale) == (True, 1)
+    assert Image.MAX_IMAGE_PIXELS == 1000
+
+
+def test_downscaled_jpeg_is_recorded_in_events_and_manifest(tmp_path):
+    import json
+    from PIL import Image
+    from batch_image_formatter_and_expander import fixed_ratio_expand
+    from batch_image_manifest import BatchManifest
+    input_folder, output_folder = tmp_path / 'in', tmp_path / 'out'
+    input_folder.mkdir()
+    Image.new('RGB', (500, 500), (10, 20, 30)).save(input_folder / 'e.jpg')
+    event_log = str(tmp_path / 'events.jsonl')
+
+    fixed_ratio_expand(str(input_folder), str(output_folder), 1, memory_budget=200000, verbosity='quiet', event_log=event_log)
+    done = [event for event in map(json.loads, open(event_log)) if event['event'] == 'file_done']
+    assert [(event['output'], event['decode_scale']) for event in done] == [('e_expand_250_250.jpg', 2)]
+    manifest = BatchManifest(str(output_folder), {})
+    assert manifest.entries['e.jpg']['decode_scale'] == 2
+    manifest.close()
+
+
+@pytest.mark.parametrize('prefetch', [0, 4])
+def test_prefetched_errors_name_the_source_path(tmp_path, prefetch):
+    from batch_image_formatter_and_expander import fixed_ratio_expand
+    input_folder = tmp_path / 'in'
+    input_folder.mkdir()
+    (input_folder / 'junk.jpg').write_bytes(b'\xff\xd8\xff\x00' + b'garbage' * 4)
+
+    failures = fixed_ratio_expand(str(input_folder), str(tmp_path / 'out'), 1, verbosity='quiet', prefetch=prefetch)
+    assert failures == [('junk.jpg', f"cannot identify image file {str(input_folder / 'junk.jpg')!r}")]
+
+
+def noise_image(size=(160, 120), seed=0):
+    import numpy as np
+    from PIL import Image
+    generator = np.random.default_rng(seed)
+    return Image.fromarray(generator.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8), 'RGB')
+
+
+@pytest.mark.parametrize('encode_profile', [None] + sorted(ENCODE_PROFILES))
+@pytest.mark.parametrize('image_format', ['JPEG', 'PNG', 'WEBP', 'TIFF'])
+def test_encode_profiles_round_trip(encode_profile, image_format):
+    from io import BytesIO
+    from PIL import Image
+    image = noise_image()
+    with Image.open(BytesIO(encode_image(image, image_format, encode_profile))) as decoded:
+        assert (decoded.format, decoded.size) == (image_format, image.size)
+        if image_format in ('PNG', 'TIFF') or encode_profile == 'lossless' and image_format == 'WEBP':
+            assert decoded.convert('RGB').tobytes() == image.tobytes()
+
+
+def test_smallest_profile_is_not_larger_than_fast():
+    image = noise_image()
+    for image_format in ('PNG', 'WEBP'):
+        assert len(encode_image(image, image_format, 'smallest')) <= len(encode_image(image, image_format, 'fast'))
+
+
+@pytest.mark.parametrize('image_format', ['JPEG', 'WEBP'])
+def test_target_file_size_finds_the_highest_fitting_quality(image_format):
+    from batch_image_common import _encode
+    image = noise_image()
+    sizes = {quality: len(_encode(image, image_format, {'quality': quality})) for quality in range(1, 96)}
+    target_file_size = (sizes[20] + sizes[90]) // 2
+    data = encode_image(image, image_format, target_file_size=target_file_size)
+    # 噪声图的大小随质量单调增加，二分搜索应得到不超过目标的最高质量/Noise sizes grow monotonically with quality, so the search must find the highest fitting quality
+    assert all(sizes[quality] <= sizes[quality + 1] for quality in range(1, 95))
+    best_quality = max(quality for quality, size in sizes.items() if size <= target_file_size)
+    assert data == _encode(image, image_format, {'quality': best_quality})
+
+
+def test_target_file_size_falls_back_to_lowest_quality_and_ignores_lossless():
+    from batch_image_common import _encode
+    image = noise_image()
+    assert encode_image(image, 'JPEG', target_file_size=1) == _encode(image, 'JPEG', {'quality': 1})
+    assert encode_image(image, 'PNG', 'fast', target_file_size=1) == encode_image(image, 'PNG', 'fast')
+    lossless = encode_image(image, 'WEBP', 'lossless')
+    assert len(encode_image(image, 'WEBP', 'lossless', target_file_size=len(lossless) // 4)) <= len(lossless) // 4
+
+
+def test_check_encode_options_rejects_unknown_profile_and_size():
+    check_encode_options('balanced', 1000)
+    with pytest.raises(ValueError):
+        check_encode_options('tiny', None)
+    with pytest.raises(ValueError):
+        check_encode_options(None, 0)
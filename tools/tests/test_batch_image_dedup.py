@@ -0,0 +1,82 @@
+import io
+import os
+import random
+
+import pytest
+from PIL import Image
+
+from batch_image_common import encode_image, process_folder
+from batch_image_dedup import DEFAULT_DISTANCES, HASH_METHODS, BKTree, hamming_distance, image_hash
+
+
+@pytest.mark.parametrize('radius', [0, 1, 3, 6, 10])
+def test_bk_tree_search_matches_linear_scan(radius):
+    generator = random.Random(radius)
+    base_hashes = [generator.getrandbits(64) for _ in range(20)]
+    # 在随机哈希附近翻转少量位，形成近似重复的簇/Flip a few bits near random hashes to form clusters of near-duplicates
+    hashes = [value ^ sum(1 << generator.randrange(64) for _ in range(generator.randint(0, 8)))
+              for value in base_hashes for _ in range(10)]
+    tree = BKTree()
+    for item, value in enumerate(hashes):
+        tree.add(value, item)
+
+    for query in hashes[::7] + [generator.getrandbits(64) for _ in range(10)]:
+        expected = sorted((hamming_distance(query, value), item) for item, value in enumerate(hashes)
+                          if hamming_distance(query, value) <= radius)
+        assert tree.search(query, radius) == expected
+
+
+def test_bk_tree_empty_and_identical_hashes():
+    tree = BKTree()
+    assert tree.search(0, 64) == []
+    tree.add(0b1011, 'a.jpg')
+    tree.add(0b1011, 'b.jpg')
+    tree.add(0b0011, 'c.jpg')
+    assert tree.search(0b1011, 0) == [(0, 'a.jpg'), (0, 'b.jpg')]
+    assert tree.search(0b1011, 1) == [(0, 'a.jpg'), (0, 'b.jpg'), (1, 'c.jpg')]
+
+
+def structured_image(size, seed):
+    # 少量色块放大并加噪声，近似照片的低频结构/A few color blocks upscaled with noise, roughly the low-frequency structure of a photo
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    blocks = Image.fromarray((rng.random((6, 8, 3)) * 255).astype('uint8')).resize(size, Image.Resampling.BICUBIC)
+    return Image.fromarray((np.asarray(blocks) + rng.normal(0, 12, blocks.size[::-1] + (3,))).clip(0, 255).astype('uint8'))
+
+
+@pytest.mark.parametrize('size', [(1600, 1200), (1200, 1600), (640, 480), (3000, 2000)])
+def test_reduced_decode_keeps_cross_format_copies_within_default_distance(size):
+    jpeg = io.BytesIO(encode_image(structured_image(size, seed=sum(size)), 'JPEG'))
+    with Image.open(jpeg) as img:
+        png = io.BytesIO(encode_image(img.convert('RGB'), 'PNG'))
+    for method in HASH_METHODS:
+        jpeg.seek(0)
+        png.seek(0)
+        assert hamming_distance(image_hash(jpeg, method), image_hash(png, method)) <= DEFAULT_DISTANCES[method]
+
+
+def copy_compute(source, filename, failing):
+    # 原样复制源文件，文件名在 failing 中时失败/Copy the source unchanged, failing when the filename is in failing
+    if filename in failing:
+        raise OSError(f"cannot process {filename}")
+    with open(source, 'rb') as source_file:
+        data = source_file.read()
+    return filename, data, (1, 1), 'PNG', {}, 1
+
+
+@pytest.mark.parametrize('action', ['skip', 'symlink'])
+def test_duplicate_is_processed_when_its_original_fails(tmp_path, action):
+    input_folder, output_folder = tmp_path / 'in', tmp_path / 'out'
+    input_folder.mkdir()
+    image = structured_image((200, 150), seed=1)
+    for filename in ('a.png', 'b.png', 'c.png'):
+        image.save(input_folder / filename)
+    structured_image((200, 150), seed=2).save(input_folder / 'd.png')
+
+    failures, skipped, duplicate_count = process_folder(
+        copy_compute, (('a.png',),), str(input_folder), str(output_folder), {}, verbosity='quiet',
+        deduplicate='dhash', duplicate_action=action)
+    assert [relative_path for relative_path, _ in failures] == ['a.png']
+    assert duplicate_count == 0
+    assert sorted(name for name in os.listdir(output_folder) if not name.startswith('.')) == ['b.png', 'c.png', 'd.png']
+    assert not any(os.path.islink(output_folder / name) for name in os.listdir(output_folder))
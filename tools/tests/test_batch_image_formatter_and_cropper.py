@@ -0,0 +1,63 @@
+import io
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from batch_image_common import center_crop_box, fit_size, load_region
+from batch_image_formatter_and_cropper import _crop_image
+
+
+def gradient_image(size):
+    # 平滑渐变，缩放方式不同时像素差应很小/A smooth gradient, so different resampling paths should give nearly the same pixels
+    x = np.linspace(0, 255, size[0])[None, :]
+    y = np.linspace(0, 255, size[1])[:, None]
+    return Image.fromarray(np.dstack([x + 0 * y, y + 0 * x, (x + y) / 2]).astype(np.uint8), 'RGB')
+
+
+def random_cases(count, seed=0):
+    generator = random.Random(seed)
+    for _ in range(count):
+        yield ((generator.randint(20, 900), generator.randint(20, 900)), round(generator.uniform(0.25, 4), 3),
+               (generator.randint(16, 400), generator.randint(16, 400)))
+
+
+@pytest.mark.parametrize('size, max_output_size', [((400, 300), (100, 100)), ((300, 400), (500, 500)), ((1, 1000), (10, 10)), ((640, 480), (640, 10))])
+def test_fit_size_only_shrinks_and_fits(size, max_output_size):
+    width, height = fit_size(size, max_output_size)
+    assert 1 <= width <= max(size[0], 1) and 1 <= height <= size[1]
+    assert width <= max_output_size[0] or width == 1
+    assert height <= max_output_size[1] or height == 1
+    assert fit_size(size, None) == size
+
+
+@pytest.mark.parametrize('image_format, ext', [('JPEG', '.jpg'), ('PNG', '.png')])
+def test_crop_max_output_size_sweep(image_format, ext):
+    for index, (size, ratio, max_output_size) in enumerate(random_cases(60, seed=len(image_format))):
+        buffer = io.BytesIO()
+        gradient_image(size).save(buffer, image_format)
+        buffer.seek(0)
+        output_filename, data, output_size, source_format, _, decode_scale = _crop_image(
+            buffer, f"{index}{ext}", ratio, None, max_output_size, None, None, 'center', None, None, ())
+        left, top, right, bottom = center_crop_box(size, ratio)
+        assert output_size == fit_size((right - left, bottom - top), max_output_size), (size, ratio, max_output_size)
+        assert output_filename == f"{index}_crop_{output_size[0]}_{output_size[1]}{ext}"
+        assert (source_format, decode_scale) == (image_format, 1)
+        with Image.open(io.BytesIO(data)) as output:
+            assert output.size == output_size
+
+
+def test_jpeg_draft_region_matches_full_decode():
+    buffer = io.BytesIO()
+    gradient_image((1600, 1200)).save(buffer, 'JPEG', quality=95)
+    box = (200, 0, 1400, 1200)
+    with Image.open(buffer) as img:
+        drafted = load_region(img, box, (300, 300))
+        assert img.size == (400, 300)
+    buffer.seek(0)
+    with Image.open(buffer) as img:
+        img.load()
+        full = img.resize((300, 300), Image.Resampling.LANCZOS, box=box)
+    difference = np.abs(np.asarray(drafted, dtype=np.int16) - np.asarray(full, dtype=np.int16))
+    assert drafted.size == (300, 300) and difference.mean() < 2
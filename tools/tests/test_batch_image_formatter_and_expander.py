@@ -0,0 +1,30 @@
+import random
+
+import pytest
+from PIL import Image
+
+from batch_image_common import expand_layout, fit_size
+from batch_image_formatter_and_expander import _expand_image
+
+
+def make_image(path, size):
+    Image.new('RGB', size, (200, 40, 90)).save(path)
+    return str(path)
+
+
+def random_cases(count, seed=0):
+    generator = random.Random(seed)
+    for _ in range(count):
+        yield ((generator.randint(20, 400), generator.randint(20, 400)), round(generator.uniform(0.25, 4), 3),
+               (generator.randint(20, 300), generator.randint(20, 300)))
+
+
+@pytest.mark.parametrize('fill_mode, use_numpy', [('color', False), ('color', True), ('edge', False), ('blur', False)])
+def test_expand_max_output_size_sweep(tmp_path, fill_mode, use_numpy):
+    # 包括曾使原图比画布大1像素的尺寸/Includes the size that used to leave the original 1px larger than the canvas
+    cases = [((132, 342), 0.386, (274, 240))] + list(random_cases(150))
+    for index, (size, ratio, max_output_size) in enumerate(cases):
+        source_path = make_image(tmp_path / f"{index}.png", size)
+        _, _, output_size, _, _, _ = _expand_image(
+            source_path, f"{index}.png", ratio, (255, 255, 255, 255), None, max_output_size, fill_mode, use_numpy, None, None, None, None, ())
+        assert output_size == fit_size(expand_layout(size, ratio)[:2], max_output_size), (size, ratio, max_output_size)
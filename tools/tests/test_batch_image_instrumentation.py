@@ -0,0 +1,81 @@
+import io
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from batch_image_formatter_and_expander import fixed_ratio_expand
+from batch_image_instrumentation import BatchInstrumentation, FilePrinter, JsonLinesLog, ProgressDisplay
+
+
+def make_images(folder, count=3, broken=()):
+    os.makedirs(folder, exist_ok=True)
+    for index in range(count):
+        Image.new('RGB', (60, 40)).save(os.path.join(folder, f"{index}.png"))
+    for filename in broken:
+        with open(os.path.join(folder, filename), 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n' + b'x' * 20)
+    return folder
+
+
+def test_file_printer_reports_failures(capsys):
+    instrumentation = BatchInstrumentation([FilePrinter()])
+    instrumentation.start()
+    instrumentation.file_failed('a/b.png', OSError('Truncated File Read'))
+    assert capsys.readouterr().out.splitlines() == [
+        '处理失败: a/b.png -> 错误: Truncated File Read',
+        'Failed: a/b.png -> Error: Truncated File Read',
+    ]
+
+
+def test_invalid_verbosity_is_rejected_before_touching_disk(tmp_path):
+    input_folder = make_images(str(tmp_path / 'in'))
+    output_folder = str(tmp_path / 'out')
+    with pytest.raises(ValueError):
+        fixed_ratio_expand(input_folder, output_folder, 1, verbosity='loud', event_log=str(tmp_path / 'events.jsonl'))
+    assert not os.path.exists(output_folder)
+    assert not os.path.exists(tmp_path / 'events.jsonl')
+
+
+def test_event_log_is_closed_when_the_batch_raises(tmp_path, monkeypatch):
+    input_folder = make_images(str(tmp_path / 'in'))
+    logs = []
+
+    class RecordingLog(JsonLinesLog):
+        def __init__(self, path):
+            super().__init__(path)
+            logs.append(self)
+
+    def failing_observer(event):
+        if event['event'] == 'file_done':
+            raise RuntimeError('observer failed')
+
+    monkeypatch.setattr('batch_image_instrumentation.JsonLinesLog', RecordingLog)
+    with pytest.raises(RuntimeError):
+        fixed_ratio_expand(input_folder, str(tmp_path / 'out'), 1, verbosity='quiet',
+                           event_log=str(tmp_path / 'events.jsonl'), observers=[failing_observer])
+    assert len(logs) == 1 and logs[0]._file is None
+    assert json.loads(open(tmp_path / 'events.jsonl').readline())['event'] == 'batch_start'
+
+
+def test_progress_total_arrives_after_start(tmp_path):
+    input_folder = make_images(str(tmp_path / 'in'), count=4, broken=('bad.png',))
+    event_log = str(tmp_path / 'events.jsonl')
+    fixed_ratio_expand(input_folder, str(tmp_path / 'out'), 1, verbosity='progress', event_log=event_log)
+    events = [json.loads(line) for line in open(event_log)]
+    assert events[0] == {'event': 'batch_start', 'total': None, 'time': events[0]['time']}
+    assert [event['total'] for event in events if event['event'] == 'batch_total'] in ([], [5])
+    assert events[-1]['done'] == 4 and events[-1]['failed'] == 1
+
+
+def test_progress_display_uses_a_late_total():
+    stream = io.StringIO()
+    display = ProgressDisplay(stream, interval=0)
+    display({'event': 'batch_start', 'total': None})
+    display({'event': 'file_done'})
+    assert '1/' not in stream.getvalue()
+    display({'event': 'batch_total', 'total': 4})
+    display({'event': 'file_done'})
+    assert stream.getvalue().rsplit('\r', 1)[-1].startswith('已处理/Processed 2/4')
+    assert display.count == 2
@@ -0,0 +1,128 @@
+import os
+
+from batch_image_manifest import BatchManifest
+
+
+def make_file(path, content=b'data'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+    return path
+
+
+def processed(tmp_path, parameters=None, content_hash=False, sources=('a.jpg',)):
+    # 处理一次并关闭清单，返回 (输入目录, 输出目录)/Process once and close the manifest, returning (input folder, output folder)
+    input_folder, output_folder = str(tmp_path / 'in'), str(tmp_path / 'out')
+    manifest = BatchManifest(make_folder(output_folder), parameters or {'ratio': 1}, content_hash)
+    for relative_path in sources:
+        source_path = make_file(os.path.join(input_folder, relative_path))
+        output = make_file(os.path.join(output_folder, f"{os.path.splitext(relative_path)[0]}_crop.jpg"))
+        manifest.record(relative_path, source_path, os.path.relpath(output, output_folder))
+    manifest.close()
+    return input_folder, output_folder
+
+
+def make_folder(path):
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def test_is_current_for_unchanged_source(tmp_path):
+    input_folder, output_folder = processed(tmp_path)
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert manifest.is_current('a.jpg', os.path.join(input_folder, 'a.jpg'))
+    assert manifest.skipped_count == 1
+    manifest.close()
+
+
+def test_is_current_false_when_parameters_source_or_output_change(tmp_path):
+    input_folder, output_folder = processed(tmp_path)
+    source_path = os.path.join(input_folder, 'a.jpg')
+
+    manifest = BatchManifest(output_folder, {'ratio': 2})
+    assert not manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+    stat = os.stat(source_path)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert not manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+    os.remove(os.path.join(output_folder, 'a_crop.jpg'))
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert not manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+
+def test_is_current_false_when_a_derivative_is_missing(tmp_path):
+    input_folder, output_folder = str(tmp_path / 'in'), make_folder(str(tmp_path / 'out'))
+    source_path = make_file(os.path.join(input_folder, 'a.jpg'))
+    derivatives = ['a_640.webp', 'a_1280.webp']
+    for derivative in derivatives:
+        make_file(os.path.join(output_folder, derivative))
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    manifest.record('a.jpg', source_path, derivatives[-1], derivatives)
+    manifest.close()
+
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+    os.remove(os.path.join(output_folder, 'a_640.webp'))
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert not manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+
+def test_content_hash_skips_touched_source(tmp_path):
+    input_folder, output_folder = processed(tmp_path, content_hash=True)
+    source_path = os.path.join(input_folder, 'a.jpg')
+    stat = os.stat(source_path)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    manifest = BatchManifest(output_folder, {'ratio': 1}, content_hash=True)
+    assert manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+    make_file(source_path, b'other')
+    manifest = BatchManifest(output_folder, {'ratio': 1}, content_hash=True)
+    assert not manifest.is_current('a.jpg', source_path)
+    manifest.close()
+
+
+def test_prune_removes_outputs_of_removed_and_regenerated_sources(tmp_path):
+    input_folder, output_folder = processed(tmp_path, sources=('a.jpg', 'b.jpg', 'c.jpg'))
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    # a 未变化，b 以新的输出名重新生成，c 的源文件已删除/a is unchanged, b is regenerated under a new output name, c's source was deleted
+    assert manifest.is_current('a.jpg', os.path.join(input_folder, 'a.jpg'))
+    b_source = make_file(os.path.join(input_folder, 'b.jpg'), b'changed')
+    assert not manifest.is_current('b.jpg', b_source)
+    make_file(os.path.join(output_folder, 'b_crop_new.jpg'))
+    manifest.record('b.jpg', b_source, 'b_crop_new.jpg')
+
+    assert manifest.prune() == ['b_crop.jpg', 'c_crop.jpg']
+    manifest.close()
+    assert sorted(os.listdir(output_folder)) == ['.batch_manifest.jsonl', 'a_crop.jpg', 'b_crop_new.jpg']
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert sorted(manifest.entries) == ['a.jpg', 'b.jpg']
+    manifest.close()
+
+
+def test_failed_sources_and_retry(tmp_path):
+    input_folder, output_folder = processed(tmp_path, sources=('a.jpg', 'b.jpg'))
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    manifest.record_failure('b.jpg', os.path.join(input_folder, 'b.jpg'), OSError('truncated'))
+    manifest.record_failure('z.jpg', os.path.join(input_folder, 'z.jpg'), ValueError('bad'))
+    manifest.close()
+
+    manifest = BatchManifest(output_folder, {'ratio': 1})
+    assert manifest.failed_sources() == ['b.jpg', 'z.jpg']
+    assert manifest.entries['b.jpg']['error_class'] == 'OSError'
+    # 失败记录保留上一次的输出，但永远不算作未变化/A failure keeps the previous output but never counts as unchanged
+    assert manifest.entries['b.jpg']['output'] == 'b_crop.jpg'
+    assert not manifest.is_current('b.jpg', os.path.join(input_folder, 'b.jpg'))
+
+    manifest.record('b.jpg', os.path.join(input_folder, 'b.jpg'), 'b_crop.jpg')
+    assert manifest.failed_sources() == ['z.jpg']
+    manifest.close()
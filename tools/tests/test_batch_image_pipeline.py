@@ -0,0 +1,68 @@
+import io
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from batch_image_pipeline import CropStage, ConvertStage, ExpandStage, ResizeStage, _pipeline_image, _plan_pipeline
+
+
+def noise_image(mode, size, seed=0):
+    generator = np.random.default_rng(seed)
+    return Image.fromarray(generator.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8), 'RGBA').convert(mode)
+
+
+def encoded(image, image_format='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    buffer.seek(0)
+    return buffer
+
+
+def random_stages(generator):
+    makers = [
+        lambda: CropStage(round(generator.uniform(0.3, 3), 3)),
+        lambda: ExpandStage(round(generator.uniform(0.3, 3), 3), fill_mode=generator.choice(['color', 'edge', 'blur'])),
+        lambda: ResizeStage((generator.randint(16, 200), generator.randint(16, 200))),
+        lambda: ConvertStage(generator.choice(['RGB', 'L', 'RGBA'])),
+    ]
+    return [generator.choice(makers)() for _ in range(generator.randint(1, 4))]
+
+
+def test_stage_output_sizes_match_the_images():
+    generator = random.Random(0)
+    for _ in range(80):
+        image = noise_image(generator.choice(['RGB', 'RGBA', 'L']), (generator.randint(20, 300), generator.randint(20, 300)))
+        size = image.size
+        for stage in random_stages(generator):
+            size = stage.output_size(size)
+            image = stage(image)
+            assert image.size == tuple(size), stage.describe()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pipeline_equals_stages_applied_in_order(seed):
+    generator = random.Random(seed)
+    source = noise_image('RGB', (generator.randint(40, 240), generator.randint(40, 240)), seed)
+    stages = random_stages(generator)
+
+    expected = source
+    for stage in stages:
+        expected = stage(expected)
+    output_filename, data, output_size, source_format, _, _ = _pipeline_image(
+        encoded(source), 'photo.png', stages, None, None, None, None, ())
+    assert output_filename == f"photo_{'_'.join(stage.name for stage in stages)}_{expected.width}_{expected.height}.png"
+    assert (output_size, source_format) == (expected.size, 'PNG')
+    with Image.open(io.BytesIO(data)) as output:
+        assert output.tobytes() == expected.tobytes()
+
+    plan = _plan_pipeline(encoded(source), 'photo.png', stages, None, None, None, None, ())
+    assert [output['file'] for output in plan['outputs']] == [output_filename]
+
+
+def test_stages_reject_unknown_options():
+    with pytest.raises(ValueError):
+        CropStage(1, anchor='corner')
+    with pytest.raises(ValueError):
+        ExpandStage(1, fill_mode='mirror')
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from batch_image_formatter_and_cropper import fixed_ratio_crop
+from batch_image_formatter_and_expander import fixed_ratio_expand
+
+# (模式, 格式, 扩展名)，均为可按行带读取的未压缩格式/(mode, format, extension), all uncompressed formats that can be read in bands
+STREAMABLE_SOURCES = [('RGB', 'BMP', '.bmp'), ('L', 'BMP', '.bmp'), ('RGB', 'TIFF', '.tiff'), ('RGBA', 'TIFF', '.tiff'), ('L', 'TIFF', '.tiff')]
+
+
+def make_source(folder, mode, image_format, ext, size=(173, 91)):
+    os.makedirs(folder, exist_ok=True)
+    generator = np.random.default_rng(sum(size))
+    image = Image.fromarray(generator.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8), 'RGBA').convert(mode)
+    image.save(os.path.join(folder, f"source{ext}"), format=image_format)
+    return folder
+
+
+def only_output(folder):
+    outputs = [name for name in os.listdir(folder) if not name.startswith('.')]
+    assert len(outputs) == 1
+    return os.path.join(folder, outputs[0])
+
+
+def assert_same_pixels(tiled_path, in_memory_path):
+    assert os.path.basename(tiled_path) == os.path.basename(in_memory_path)
+    with Image.open(tiled_path) as tiled, Image.open(in_memory_path) as in_memory:
+        assert (tiled.mode, tiled.size) == (in_memory.mode, in_memory.size)
+        assert tiled.tobytes() == in_memory.tobytes()
+
+
+@pytest.mark.parametrize('mode, image_format, ext', STREAMABLE_SOURCES)
+@pytest.mark.parametrize('ratio', [1, 3, 0.5])
+def test_tiled_crop_matches_in_memory(tmp_path, mode, image_format, ext, ratio):
+    input_folder = make_source(str(tmp_path / 'in'), mode, image_format, ext)
+    fixed_ratio_crop(input_folder, str(tmp_path / 'tiled'), ratio, 'tiff', verbosity='quiet', memory_budget=4096)
+    fixed_ratio_crop(input_folder, str(tmp_path / 'memory'), ratio, 'tiff', verbosity='quiet')
+    assert_same_pixels(only_output(tmp_path / 'tiled'), only_output(tmp_path / 'memory'))
+
+
+@pytest.mark.parametrize('mode, image_format, ext', STREAMABLE_SOURCES)
+@pytest.mark.parametrize('ratio, fill_mode', [(1, 'color'), (3, 'color'), (1, 'edge'), (0.5, 'edge')])
+def test_tiled_expand_matches_in_memory(tmp_path, mode, image_format, ext, ratio, fill_mode):
+    input_folder = make_source(str(tmp_path / 'in'), mode, image_format, ext)
+    options = dict(background_color=(33, 129, 161), output_format='tiff', fill_mode=fill_mode, verbosity='quiet')
+    fixed_ratio_expand(input_folder, str(tmp_path / 'tiled'), ratio, memory_budget=4096, **options)
+    fixed_ratio_expand(input_folder, str(tmp_path / 'memory'), ratio, **options)
+    assert_same_pixels(only_output(tmp_path / 'tiled'), only_output(tmp_path / 'memory'))
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+import mine_img
+
+TOOLS_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_images(folder, sizes=((120, 80), (60, 90))):
+    os.makedirs(folder, exist_ok=True)
+    for index, size in enumerate(sizes):
+        Image.new('RGB', size, (20 * index, 90, 160)).save(os.path.join(folder, f"{index}.png"))
+    return folder
+
+
+def outputs(folder):
+    return sorted(name for name in os.listdir(folder) if not name.startswith('.'))
+
+
+@pytest.mark.parametrize('argv', [['--help'], ['expand', '--help'], ['crop', '--help'], ['run', '--help'], ['expand', 'in', 'out']])
+def test_help_and_argument_errors_import_no_pillow(argv):
+    # 在新进程中检查，当前进程的测试已经导入了Pillow/Checked in a fresh process, the tests in this process already imported Pillow
+    code = ("import sys, mine_img\n"
+            f"try:\n    mine_img.main({argv!r})\nexcept SystemExit:\n    pass\n"
+            "print(sorted(name for name in ('PIL', 'numpy') if name in sys.modules))")
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=TOOLS_FOLDER)
+    assert completed.stdout.strip().splitlines()[-1] == '[]'
+
+
+def test_choice_constants_match_the_modules():
+    import batch_image_common
+    import batch_image_dedup
+    import batch_image_instrumentation
+    assert mine_img.ENCODE_PROFILES == tuple(batch_image_common.ENCODE_PROFILES)
+    assert mine_img.FILL_MODES == batch_image_common.FILL_MODES
+    assert mine_img.ANCHOR_MODES == batch_image_common.ANCHOR_MODES
+    assert mine_img.HASH_METHODS == batch_image_dedup.HASH_METHODS
+    assert mine_img.DUPLICATE_ACTIONS == batch_image_dedup.DUPLICATE_ACTIONS
+    assert mine_img.VERBOSITY_LEVELS == batch_image_instrumentation.VERBOSITY_LEVELS
+
+
+def write_job_file(path, jobs, defaults=None):
+    with open(path, 'w', encoding='utf-8') as job_file:
+        json.dump({'defaults': defaults or {}, 'jobs': jobs}, job_file)
+    return str(path)
+
+
+def test_job_file_runs_every_job(tmp_path):
+    make_images(str(tmp_path / 'in'))
+    job_file_path = write_job_file(tmp_path / 'jobs.json', [
+        {'command': 'expand', 'input_folder': 'in', 'output_folder': 'out/expanded', 'target_aspect_ratio': '1'},
+        {'command': 'crop', 'input_folder': 'in', 'output_folder': 'out/cropped', 'crop_aspect_ratio': '4/3', 'max_output_size': '40x40'},
+        {'command': 'pipeline', 'input_folder': 'in', 'output_folder': 'out/web', 'stages': [{'crop': '16/9'}, {'resize': '32x32'}],
+         'output_format': 'webp'},
+    ], defaults={'verbosity': 'quiet', 'anchor': 'center'})
+
+    assert mine_img.run_job_file(job_file_path) == 0
+    assert outputs(tmp_path / 'out' / 'expanded') == ['0_expand_120_120.png', '1_expand_90_90.png']
+    assert outputs(tmp_path / 'out' / 'cropped') == ['0_crop_40_30.png', '1_crop_40_30.png']
+    assert len(outputs(tmp_path / 'out' / 'web')) == 2
+    assert all(name.endswith('.webp') for name in outputs(tmp_path / 'out' / 'web'))
+
+
+@pytest.mark.parametrize('keep_going', [True, False])
+def test_job_file_errors_and_keep_going(tmp_path, keep_going):
+    make_images(str(tmp_path / 'in'))
+    job_file_path = write_job_file(tmp_path / 'jobs.json', [
+        {'command': 'expand', 'input_folder': 'in', 'output_folder': 'bad', 'target_aspect_ratio': 'wide'},
+        {'command': 'expand', 'input_folder': 'in', 'output_folder': 'good', 'target_aspect_ratio': '1'},
+    ], defaults={'verbosity': 'quiet'})
+
+    assert mine_img.run_job_file(job_file_path, keep_going) == 1
+    assert os.path.exists(tmp_path / 'good') == keep_going
+
+
+def test_job_file_rejects_unknown_command(tmp_path):
+    job_file_path = write_job_file(tmp_path / 'jobs.json', [{'command': 'sharpen', 'input_folder': 'in'}])
+    with pytest.raises(ValueError):
+        mine_img.load_jobs(job_file_path)
+
+
+def test_pipeline_subcommand_uses_the_pipeline_parser(tmp_path):
+    input_folder = make_images(str(tmp_path / 'in'))
+    output_folder = str(tmp_path / 'out')
+    assert mine_img.main(['pipeline', input_folder, output_folder, '--crop', '1', '--resize', '30x30', '--verbosity', 'quiet']) == 0
+    assert [Image.open(os.path.join(output_folder, name)).size for name in outputs(output_folder)] == [(30, 30), (30, 30)]
@@ -0,0 +1,80 @@
+import random
+import shutil
+
+import pytest
+
+from benchmark_stepwise_parity import PARITY_CASES, run_parity
+from image_center_cropper_with_stepwise_reduction import STOP_AREA, STOP_SIZE, compute_crop_schedule, crop_schedule_array
+
+
+def loop_schedule(source_width_pixel, source_height_pixel, width_step_pixel, crop_aspect_ratio, min_size_ratio, min_pixel_limit):
+    # 原来的逐步循环，作为向量化实现的参考：返回 (序列, 第一个被拒绝的候选 (序号, 终止标志))
+    # The former step-by-step loop, the reference for the vectorized version: returns (schedule, first rejected candidate (index, stop flags))
+    if source_width_pixel / source_height_pixel > crop_aspect_ratio:
+        width, height = int(source_height_pixel * crop_aspect_ratio), source_height_pixel
+    else:
+        width, height = source_width_pixel, int(source_width_pixel / crop_aspect_ratio)
+    min_width = max(width * min_size_ratio, min_pixel_limit)
+    min_height = max(height * min_size_ratio, min_pixel_limit)
+    initial_area = width * height
+
+    schedule = []
+    index = 1
+    while True:
+        area_ratio = round(width * height / initial_area, 5)
+        stop = ((width < min_width or height < min_height) * STOP_SIZE) | ((area_ratio < min_size_ratio) * STOP_AREA)
+        if stop:
+            return schedule, (index, stop)
+        schedule.append((index, width, height, area_ratio))
+        next_width = width - width_step_pixel
+        width, height = round(next_width), round(next_width / crop_aspect_ratio)
+        index += 1
+
+
+def random_cases(count, seed=0):
+    generator = random.Random(seed)
+    for _ in range(count):
+        yield (generator.randint(50, 4000), generator.randint(50, 4000),
+               generator.choice([1, 3, 7, 12.5, 20, 33, 40.5, generator.uniform(1, 80)]),
+               generator.choice([1, 4/3, 3/2, 16/9, 21/9, 9/16, generator.uniform(0.3, 3)]),
+               generator.choice([0.0025, 0.05, 0.1, 0.25, 0.5]),
+               generator.choice([1, 50, 100, 256]))
+
+
+@pytest.mark.parametrize('case', [case[1:] for case in PARITY_CASES] + list(random_cases(300)))
+def test_schedule_matches_loop(case):
+    if len(case) == 5:
+        (source_width_pixel, source_height_pixel), *parameters = case
+    else:
+        source_width_pixel, source_height_pixel, *parameters = case
+    expected_schedule, (expected_index, expected_stop) = loop_schedule(source_width_pixel, source_height_pixel, *parameters)
+
+    schedule, stop_reason_zh, stop_reason_en = compute_crop_schedule(source_width_pixel, source_height_pixel, *parameters)
+    assert schedule == expected_schedule
+    # 序列总会终止，因此总有终止原因/The schedule always ends, so there is always a stop reason
+    assert stop_reason_zh.startswith(f"停止生成图像 {expected_index}，原因：") and not stop_reason_zh.endswith('：')
+    assert stop_reason_en.startswith(f"Stop generating image {expected_index}, reasons: ") and not stop_reason_en.endswith(': ')
+    # 文件名由这些值格式化，类型也必须与循环相同/Filenames are formatted from these values, so the types must match the loop as well
+    assert all(type(width) is int and type(height) is int and type(area_ratio) is float for _, width, height, area_ratio in schedule)
+
+    stop_row = crop_schedule_array(source_width_pixel, source_height_pixel, *parameters)[-1]
+    assert (int(stop_row['index']), int(stop_row['stop'])) == (expected_index, expected_stop)
+
+
+def test_schedule_rejects_empty_box_and_non_positive_step():
+    with pytest.raises(ValueError):
+        compute_crop_schedule(1, 1000, 10, 1/2000)
+    with pytest.raises(ValueError):
+        compute_crop_schedule(1000, 1000, 0.4, 1)
+
+
+@pytest.mark.skipif(shutil.which('Rscript') is None, reason="未找到Rscript，跳过Python/R对照/Rscript not found, skipping the Python/R parity check")
+def test_parity_with_r():
+    results = run_parity(PARITY_CASES[:2])
+    assert all(result['parity'] for result in results), results
+
+
+def test_parity_without_r_checks_python_only(capsys):
+    results = run_parity(PARITY_CASES[-1:], rscript='missing-Rscript')
+    assert results[0]['r_skipped'] and results[0]['parity']
+    assert 'Rscript not found' in capsys.readouterr().out